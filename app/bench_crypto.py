@@ -0,0 +1,240 @@
+"""
+Offline crypto microbenchmarks: drives app/crypto.py directly, no HTTP or DB in the loop.
+
+Sweeps scheme (RSA-2048 hybrid, Kyber512/768/1024 + AES-GCM) x payload size x
+executor/worker count x key mode (reuse one key vs a fresh key per message), and prints
+ops/sec and latency percentiles per case.
+
+    python -m app.bench_crypto --duration 2 --output bench.json
+    python -m app.bench_crypto --baseline bench.json --threshold 10   # exit 1 on regression
+
+Cases are matched against the baseline by id; a case whose ops/sec drops more than
+--threshold percent below its baseline fails the run.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from app.codec import encode_transaction
+from app.crypto import generate_rsa_keys, rsa_hybrid_encrypt, pqc_kem_encrypt
+from app.kem import generate_kem_keypair, resolve_kem_algorithm
+from app.metrics import Benchmark, LatencyHistogram
+from app.models import Transaction
+
+logger = logging.getLogger("uvicorn")
+
+RESULTS_FORMAT_VERSION = 1
+
+RSA_SCHEME = "RSA-2048"
+SCHEMES = [RSA_SCHEME, "Kyber512", "Kyber768", "Kyber1024"]
+KEY_MODES = ["reuse", "per_message"]
+
+SAMPLE_TRANSACTION = Transaction(
+    trans_date_trans_time="2019-01-01 00:00:18", cc_num="2703186189652095", merchant="fraud_Rippin, Kub and Mann",
+    category="misc_net", amt=4.97, first="Jennifer", last="Banks", gender="F", street="561 Perry Cove",
+    city="Moravian Falls", state="NC", zip=28654, lat=36.0788, long=-81.1781, city_pop=3495,
+    job="Psychologist, counselling", dob="1988-03-09", trans_num="0b242abb623afc578575680df30655b9",
+    unix_time=1325376018, merch_lat=36.011293, merch_long=-82.048315, is_fraud=0
+)
+
+# ✅ "txn" is one serialised Transaction (in RECORD_FORMAT); anything else is a byte count (k/m suffixes allowed)
+def parse_payload_size(value):
+    if value == "txn":
+        return len(encode_transaction(SAMPLE_TRANSACTION))
+    multiplier = {"k": 1024, "m": 1024 * 1024}.get(value[-1].lower(), 1)
+    return int(value[:-1] if multiplier > 1 else value) * multiplier
+
+def parse_executor(value):
+    kind, _, workers = value.partition(":")
+    if kind not in ("threads", "processes"):
+        raise argparse.ArgumentTypeError(f"executor must be threads:N or processes:N, got {value}")
+    return kind, int(workers or 1)
+
+def case_id(case):
+    return f"{case['scheme']}/{case['payload_bytes']}B/{case['executor']}x{case['workers']}/{case['key_mode']}"
+
+def _build_operation(scheme, key_mode, payload):
+    if scheme == RSA_SCHEME:
+        if key_mode == "reuse":
+            _, public_key = generate_rsa_keys()
+            return lambda: rsa_hybrid_encrypt(payload, public_key)
+        return lambda: rsa_hybrid_encrypt(payload, generate_rsa_keys()[1])
+
+    algorithm = resolve_kem_algorithm(scheme)
+    if key_mode == "reuse":
+        public_key, _ = generate_kem_keypair(algorithm)
+        return lambda: pqc_kem_encrypt(payload, public_key, algorithm)
+    return lambda: pqc_kem_encrypt(payload, generate_kem_keypair(algorithm)[0], algorithm)
+
+# ✅ One worker's share of a case: warm up, wait for the others, then run for `duration` seconds (thread or process)
+def run_worker(scheme, key_mode, payload_bytes, duration, warmup, barrier):
+    try:
+        payload = os.urandom(payload_bytes)
+        operation = _build_operation(scheme, key_mode, payload)
+        for _ in range(warmup):
+            operation()
+    except Exception:
+        # Don't leave the other workers waiting for us
+        barrier.abort()
+        raise
+    barrier.wait()
+
+    histogram = LatencyHistogram()
+    errors = 0
+    started = time.time()
+    deadline = time.perf_counter() + duration
+    while True:
+        start = time.perf_counter()
+        if start >= deadline:
+            break
+        try:
+            operation()
+        except Exception:
+            errors += 1
+            continue
+        histogram.record((time.perf_counter() - start) * 1000)
+    # Wall clock timestamps, so windows from different processes can be compared
+    return histogram.to_dict(), errors, started, time.time()
+
+def run_case(case, duration, warmup):
+    workers = case["workers"]
+    if case["executor"] == "processes":
+        context = multiprocessing.get_context("spawn")
+        manager = context.Manager()
+        barrier = manager.Barrier(workers)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    else:
+        manager = None
+        barrier = threading.Barrier(workers)
+        pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        with pool:
+            futures = [
+                pool.submit(run_worker, case["scheme"], case["key_mode"], case["payload_bytes"], duration, warmup, barrier)
+                for _ in range(workers)
+            ]
+            parts = [future.result() for future in futures]
+    finally:
+        if manager is not None:
+            manager.shutdown()
+
+    histogram = LatencyHistogram()
+    errors = 0
+    for part, part_errors, _, _ in parts:
+        histogram.merge(LatencyHistogram.from_dict(part))
+        errors += part_errors
+    # Every counted op ran between the first worker's start and the last one's finish; the barrier
+    # keeps that window close to `duration` however long each worker took to spawn and warm up
+    window = max(finished for _, _, _, finished in parts) - min(started for _, _, started, _ in parts)
+    percentiles = histogram.percentiles([q for _, q in Benchmark.PERCENTILES])
+    return {
+        "id": case_id(case),
+        **case,
+        "ops": histogram.count,
+        "errors": errors,
+        "ops_per_sec": histogram.count / window if histogram.count and window > 0 else 0,
+        "wall_seconds": window,
+        "mean_ms": histogram.mean(),
+        **{name.replace("_latency", "_ms"): value for (name, _), value in zip(Benchmark.PERCENTILES, percentiles)},
+        "max_ms": histogram.max if histogram.count else 0
+    }
+
+def build_cases(args):
+    return [
+        {"scheme": scheme, "payload_bytes": payload_bytes, "executor": kind, "workers": workers, "key_mode": key_mode}
+        for scheme in args.schemes
+        for payload_bytes in args.payload_sizes
+        for kind, workers in args.executors
+        for key_mode in args.key_modes
+    ]
+
+# ✅ Cases whose throughput fell more than threshold% below the baseline
+def compare(results, baseline, threshold):
+    previous = {result["id"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get(result["id"])
+        if before is None or not before["ops_per_sec"]:
+            continue
+        change = (result["ops_per_sec"] - before["ops_per_sec"]) / before["ops_per_sec"] * 100
+        result["baseline_ops_per_sec"] = before["ops_per_sec"]
+        result["change_percent"] = change
+        if change < -threshold:
+            regressions.append(result)
+    return regressions
+
+def print_results(results):
+    header = f"{'case':<52} {'ops/sec':>10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'p99.9 ms':>9} {'vs base':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        change = f"{r['change_percent']:+.1f}%" if "change_percent" in r else ""
+        print(f"{r['id']:<52} {r['ops_per_sec']:>10.1f} {r['p50_ms']:>9.3f} {r['p90_ms']:>9.3f} {r['p99_ms']:>9.3f} {r['p999_ms']:>9.3f} {change:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app/crypto.py encryption paths without HTTP/DB")
+    parser.add_argument("--schemes", type=lambda v: v.split(","), default=SCHEMES,
+                        help=f"Comma-separated schemes (default: {','.join(SCHEMES)})")
+    parser.add_argument("--payload-sizes", type=lambda v: [parse_payload_size(s) for s in v.split(",")],
+                        default=[parse_payload_size(s) for s in ("txn", "4k", "64k", "1m")],
+                        help="Comma-separated payload sizes: txn, bytes, or k/m suffixed (default: txn,4k,64k,1m)")
+    parser.add_argument("--executors", type=lambda v: [parse_executor(s) for s in v.split(",")],
+                        default=[("threads", 1), ("threads", os.cpu_count() or 1)],
+                        help="Comma-separated threads:N / processes:N (default: threads:1,threads:<cpus>)")
+    parser.add_argument("--key-modes", type=lambda v: v.split(","), default=KEY_MODES,
+                        help="Comma-separated key modes: reuse, per_message (default: both)")
+    parser.add_argument("--duration", type=float, default=2.0, help="Measured seconds per case")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured operations per worker before timing")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON from a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed ops/sec drop vs baseline, in percent")
+    args = parser.parse_args()
+
+    for key_mode in args.key_modes:
+        if key_mode not in KEY_MODES:
+            parser.error(f"unknown key mode {key_mode}")
+    for scheme in args.schemes:
+        if scheme != RSA_SCHEME:
+            try:
+                resolve_kem_algorithm(scheme)
+            except ValueError as e:
+                parser.error(str(e))
+
+    logging.basicConfig(level=logging.INFO)
+    results = []
+    for case in build_cases(args):
+        logger.info(f"⏱️ {case_id(case)}")
+        results.append(run_case(case, args.duration, args.warmup))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "version": RESULTS_FORMAT_VERSION,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "duration": args.duration,
+                "results": results
+            }, f, indent=2)
+
+    if regressions:
+        for r in regressions:
+            logger.error(f"❌ {r['id']}: {r['ops_per_sec']:.1f} ops/sec, {r['change_percent']:.1f}% vs baseline {r['baseline_ops_per_sec']:.1f}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,385 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
+import base64
+import json
+import logging
 import sqlite3
 import statistics
-from app.database import get_db
-from app.metrics import rsa_benchmark, pqc_benchmark , Benchmark
+import threading
+import time
+from collections import deque
+from app import config
+from app.database import get_db, db_writer, db_pool
+from app.metrics import Benchmark
+
+logger = logging.getLogger("uvicorn")
 
 router = APIRouter()
 rsa_session_benchmark = Benchmark()
 pqc_session_benchmark = Benchmark()
 
-def record_benchmark(db, type, latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time, algorithm):
-    cursor = db.cursor()
-    cursor.execute("""
+class BenchmarkSink:
+    """
+    Buffers benchmark rows in memory and inserts them in batches from a background thread,
+    so request paths never pay an INSERT + commit for telemetry.
+    """
+
+    def __init__(self, buffer_size, flush_size, flush_interval):
+        self.buffer_size = buffer_size
+        self.flush_size = max(flush_size, 1)
+        self.flush_interval = flush_interval
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self.recorded = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed = 0
+        self._reported_drops = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None and not self._stopping:
+                self._thread = threading.Thread(target=self._run, name="benchmark-sink", daemon=True)
+                self._thread.start()
+
+    def record(self, row):
+        if self._thread is None:
+            self._start()
+        with self._lock:
+            if len(self._buffer) >= self.buffer_size:
+                # Backpressure: the DB can't keep up, shed telemetry rather than block requests
+                self.dropped += 1
+                return False
+            self._buffer.append(row)
+            self.recorded += 1
+            pending = len(self._buffer)
+        if pending >= self.flush_size:
+            self._wakeup.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            self._report_drops()
+            if self._stopping:
+                break
+
+    def flush(self):
+        while True:
+            with self._lock:
+                rows = [self._buffer.popleft() for _ in range(min(self.flush_size, len(self._buffer)))]
+            if not rows:
+                return
+            try:
+                db_writer.submit(_insert_benchmarks, rows).result()
+                self.flushed += len(rows)
+                self.flushes += 1
+            except Exception as e:
+                self.failed += len(rows)
+                logger.error(f"❌ Failed to flush {len(rows)} benchmark records: {e}")
+                return
+
+    def _report_drops(self):
+        dropped = self.dropped
+        if dropped > self._reported_drops:
+            logger.warning(f"⚠️ Benchmark buffer full: dropped {dropped - self._reported_drops} records ({dropped} total)")
+            self._reported_drops = dropped
+
+    # ✅ Flush everything still buffered (called on shutdown, before the DB writer stops)
+    def stop(self):
+        self._stopping = True
+        if self._thread is not None:
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        return {
+            "buffered": len(self._buffer),
+            "buffer_size": self.buffer_size,
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+
+# Bucket start of a 'YYYY-MM-DD HH:MM:SS' timestamp, per rollup granularity
+ROLLUP_BUCKETS = {
+    "minute": lambda ts: ts[:17] + "00",
+    "hour": lambda ts: ts[:14] + "00:00",
+    "day": lambda ts: ts[:11] + "00:00:00"
+}
+
+def _insert_benchmarks(conn, rows):
+    conn.executemany("""
         INSERT INTO benchmarks 
-        (type, latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time, algorithm)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (type, latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time, algorithm))
-    db.commit()
-
-@router.get("/benchmarks/live")
-async def get_live_benchmarks():
-    rsa_summary = rsa_benchmark.summary()
-    pqc_summary = pqc_benchmark.summary()
-
-    return {
-        "RSA": rsa_summary,
-        "PQC": pqc_summary
-    }
-    
+        (type, latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time, algorithm, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    update_rollups(conn, rows)
+
+# ✅ Fold new benchmark rows into benchmark_rollups, in the same transaction as the rows
+def update_rollups(conn, rows):
+    buckets = {}
+    for type, latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time, algorithm, timestamp in rows:
+        values = (latency or 0, stddev or 0, min_latency or 0, max_latency or 0, throughput or 0, error_rate or 0, encryption_time or 0)
+        for granularity, bucket_of in ROLLUP_BUCKETS.items():
+            key = (granularity, bucket_of(timestamp), algorithm, type)
+            acc = buckets.get(key)
+            if acc is None:
+                buckets[key] = [1, *values, min_latency, max_latency]
+                continue
+            acc[0] += 1
+            for i, value in enumerate(values, 1):
+                acc[i] += value
+            if min_latency is not None and (acc[8] is None or min_latency < acc[8]):
+                acc[8] = min_latency
+            if max_latency is not None and (acc[9] is None or max_latency > acc[9]):
+                acc[9] = max_latency
+
+    conn.executemany("""
+        INSERT INTO benchmark_rollups
+        (granularity, bucket, algorithm, type, samples, sum_latency, sum_stddev, sum_min_latency, sum_max_latency,
+         sum_throughput, sum_error_rate, sum_encryption_time, min_latency, max_latency)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (granularity, algorithm, bucket, type) DO UPDATE SET
+            samples = samples + excluded.samples,
+            sum_latency = sum_latency + excluded.sum_latency,
+            sum_stddev = sum_stddev + excluded.sum_stddev,
+            sum_min_latency = sum_min_latency + excluded.sum_min_latency,
+            sum_max_latency = sum_max_latency + excluded.sum_max_latency,
+            sum_throughput = sum_throughput + excluded.sum_throughput,
+            sum_error_rate = sum_error_rate + excluded.sum_error_rate,
+            sum_encryption_time = sum_encryption_time + excluded.sum_encryption_time,
+            min_latency = MIN(COALESCE(min_latency, excluded.min_latency), COALESCE(excluded.min_latency, min_latency)),
+            max_latency = MAX(COALESCE(max_latency, excluded.max_latency), COALESCE(excluded.max_latency, max_latency))
+    """, [(*key, *acc) for key, acc in buckets.items()])
+
+# ✅ Retention: delete raw rows and fine-grained rollups older than their retention, in short chunks
+def _delete_chunk(conn, sql, cutoff, chunk_size):
+    return conn.execute(sql, (cutoff, chunk_size)).rowcount
+
+def compact_benchmarks():
+    now = time.time()
+    policies = [
+        (config.BENCHMARK_RAW_RETENTION_DAYS,
+         "DELETE FROM benchmarks WHERE id IN (SELECT id FROM benchmarks WHERE timestamp < ? LIMIT ?)"),
+        (config.BENCHMARK_MINUTE_ROLLUP_RETENTION_DAYS,
+         """DELETE FROM benchmark_rollups WHERE (granularity, algorithm, bucket, type) IN (
+             SELECT granularity, algorithm, bucket, type FROM benchmark_rollups
+             WHERE granularity = 'minute' AND bucket < ? LIMIT ?)"""),
+        (config.BENCHMARK_HOUR_ROLLUP_RETENTION_DAYS,
+         """DELETE FROM benchmark_rollups WHERE (granularity, algorithm, bucket, type) IN (
+             SELECT granularity, algorithm, bucket, type FROM benchmark_rollups
+             WHERE granularity = 'hour' AND bucket < ? LIMIT ?)""")
+    ]
+    deleted = 0
+    for days, sql in policies:
+        if days <= 0:
+            continue  # keep forever
+        cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - days * 86400))
+        while True:
+            # One chunk per writer transaction so request writes interleave
+            removed = db_writer.submit(_delete_chunk, sql, cutoff, config.BENCHMARK_COMPACT_CHUNK_SIZE).result()
+            deleted += removed
+            if removed < config.BENCHMARK_COMPACT_CHUNK_SIZE:
+                break
+    return deleted
+
+benchmark_sink = BenchmarkSink(
+    config.BENCHMARK_BUFFER_SIZE,
+    config.BENCHMARK_FLUSH_SIZE,
+    config.BENCHMARK_FLUSH_INTERVAL_SECONDS
+)
+
+def record_benchmark(type, latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time, algorithm):
+    # Timestamp taken now, not at flush time, in the same format as CURRENT_TIMESTAMP
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    return benchmark_sink.record(
+        (type, latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time, algorithm, timestamp)
+    )
+
+def record_summary(summary, type, algorithm, encryption_time):
+    return record_benchmark(
+        type=type,
+        latency=summary["average_latency"],
+        stddev=summary["stddev_latency"],
+        min_latency=summary["min_latency"],
+        max_latency=summary["max_latency"],
+        throughput=summary["throughput"],
+        error_rate=summary["error_rate"],
+        encryption_time=encryption_time,
+        algorithm=algorithm
+    )
+
+# Accepts 'YYYY-MM-DD', 'YYYY-MM-DD HH:MM' or ISO 'YYYY-MM-DDTHH:MM:SS[Z]' (UTC)
+def _parse_bound(value, end_of_period=False):
+    value = value.replace("T", " ").rstrip("Z")[:19]
+    fill = " 23:59:59" if end_of_period else " 00:00:00"
+    return value + fill[len(value) - 10:] if len(value) < 19 else value
+
+ROLLUP_AVERAGES = """
+    SUM(samples) AS samples,
+    SUM(sum_latency) / SUM(samples) AS avg_latency,
+    SUM(sum_stddev) / SUM(samples) AS avg_stddev,
+    SUM(sum_min_latency) / SUM(samples) AS avg_min_latency,
+    SUM(sum_max_latency) / SUM(samples) AS avg_max_latency,
+    SUM(sum_throughput) / SUM(samples) AS avg_throughput,
+    SUM(sum_error_rate) / SUM(samples) AS avg_error_rate,
+    SUM(sum_encryption_time) / SUM(samples) AS avg_encryption_time,
+    MIN(min_latency) AS min_latency,
+    MAX(max_latency) AS max_latency
+"""
+
+# ✅ History from benchmark_rollups. Without granularity: one average per algorithm (as before);
+# with granularity=minute|hour|day: one row per bucket. Time ranges resolve to whole buckets.
 @router.get("/benchmarks/history")
-async def get_historical_benchmarks(db: sqlite3.Connection = Depends(get_db)):
-    cursor = db.cursor()
-    results = []
-
-    for algo in ["RSA", "PQC"]:
-        cursor.execute("SELECT latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time FROM benchmarks WHERE algorithm = ?", (algo,))
-        rows = cursor.fetchall()
-        if not rows:
-            continue
-
-        latencies = [row[0] for row in rows]
-        stddevs = [row[1] for row in rows]
-        min_latencies = [row[2] for row in rows]
-        max_latencies = [row[3] for row in rows]
-        throughputs = [row[4] for row in rows]
-        error_rates = [row[5] for row in rows]
-        encryption_times = [row[6] for row in rows]
-
-        results.append({
-            "algorithm": algo,
-            "avg_latency": sum(latencies) / len(latencies),
-            "avg_stddev": sum(stddevs) / len(stddevs),
-            "avg_min_latency": sum(min_latencies) / len(min_latencies),
-            "avg_max_latency": sum(max_latencies) / len(max_latencies),
-            "avg_throughput": sum(throughputs) / len(throughputs),
-            "avg_error_rate": sum(error_rates) / len(error_rates),
-            "avg_encryption_time": sum(encryption_times) / len(encryption_times)
-        })
-    
-    return results    
-@router.get("/benchmarks/live")
-async def get_live_benchmarks():
-    return {
-        "RSA": rsa_benchmark.summary(),
-        "PQC": pqc_benchmark.summary()
-    }
-    
-@router.get("/benchmarks/sessions")
-async def get_session_benchmarks(db: sqlite3.Connection = Depends(get_db)):
+async def get_historical_benchmarks(
+    db: sqlite3.Connection = Depends(get_db),
+    algorithm: str = None,
+    type: str = None,
+    start: str = None,
+    end: str = None,
+    granularity: str = None
+):
+    if granularity is not None and granularity not in ROLLUP_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(ROLLUP_BUCKETS)}")
+
+    # Totals over everything read the few day buckets; an explicit range needs minute precision
+    source = granularity or ("minute" if start or end else "day")
+    where = ["granularity = ?"]
+    params = [source]
+    if algorithm:
+        where.append("algorithm = ?")
+        params.append(algorithm)
+    if type:
+        where.append("type = ?")
+        params.append(type)
+    if start:
+        where.append("bucket >= ?")
+        params.append(ROLLUP_BUCKETS[source](_parse_bound(start)))
+    if end:
+        where.append("bucket <= ?")
+        params.append(_parse_bound(end, end_of_period=True))
+
+    group_by = "algorithm, bucket" if granularity else "algorithm"
     cursor = db.cursor()
-    cursor.execute("""
-        SELECT id, type, latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time, algorithm, timestamp 
+    cursor.execute(f"""
+        SELECT {group_by}, {ROLLUP_AVERAGES}
+        FROM benchmark_rollups
+        WHERE {" AND ".join(where)}
+        GROUP BY {group_by}
+        ORDER BY {group_by}
+    """, params)
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+SESSION_COLUMNS = "id, type, algorithm, latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time, timestamp"
+
+SESSIONS_PAGE_SIZE = 100
+SESSIONS_MAX_PAGE_SIZE = 1000
+
+# Opaque keyset cursor: the (timestamp, id) of the last row of the previous page
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(json.dumps([timestamp, row_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(timestamp), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _session_filters(algorithm, type, start, end):
+    where = []
+    params = []
+    if algorithm:
+        where.append("algorithm = ?")
+        params.append(algorithm)
+    if type:
+        where.append("type = ?")
+        params.append(type)
+    if start:
+        where.append("timestamp >= ?")
+        params.append(_parse_bound(start))
+    if end:
+        where.append("timestamp <= ?")
+        params.append(_parse_bound(end, end_of_period=True))
+    return where, params
+
+# ✅ One page, newest first, seeking on the (timestamp, id) index rather than OFFSET
+def fetch_session_page(db, where, params, after, limit):
+    where = list(where)
+    params = list(params)
+    if after is not None:
+        where.append("(timestamp, id) < (?, ?)")
+        params.extend(after)
+    cursor = db.execute(f"""
+        SELECT {SESSION_COLUMNS}
         FROM benchmarks
-        ORDER BY timestamp DESC
-        LIMIT 20
-    """)
-    rows = cursor.fetchall()
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    """, params + [limit])
     columns = [col[0] for col in cursor.description]
-    return [dict(zip(columns, row)) for row in rows]
-    
-        
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def _stream_sessions(where, params, after, limit):
+    # Own pooled connection: the response outlives the request's get_db dependency
+    conn = db_pool.acquire()
+    try:
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_size = SESSIONS_MAX_PAGE_SIZE if remaining is None else min(remaining, SESSIONS_MAX_PAGE_SIZE)
+            rows = fetch_session_page(conn, where, params, after, page_size)
+            for row in rows:
+                yield json.dumps(row) + "\n"
+            if len(rows) < page_size:
+                break
+            after = (rows[-1]["timestamp"], rows[-1]["id"])
+            if remaining is not None:
+                remaining -= len(rows)
+    finally:
+        db_pool.release(conn)
+
+# ✅ Benchmark rows, newest first. Default: a JSON array page with the next page's cursor in
+# the X-Next-Cursor header. format=ndjson streams every matching row (or `limit` rows) for export.
+@router.get("/benchmarks/sessions")
+async def get_session_benchmarks(
+    response: Response,
+    db: sqlite3.Connection = Depends(get_db),
+    algorithm: str = None,
+    type: str = None,
+    start: str = None,
+    end: str = None,
+    cursor: str = None,
+    limit: int = None,
+    format: str = "json"
+):
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'ndjson'")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    where, params = _session_filters(algorithm, type, start, end)
+    after = decode_cursor(cursor) if cursor else None
+
+    if format == "ndjson":
+        return StreamingResponse(_stream_sessions(where, params, after, limit), media_type="application/x-ndjson")
+
+    limit = min(limit or SESSIONS_PAGE_SIZE, SESSIONS_MAX_PAGE_SIZE)
+    rows = fetch_session_page(db, where, params, after, limit)
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+    return rows
+
 def get_all_benchmarks(db):
     cursor = db.cursor()
     cursor.execute("SELECT * FROM benchmarks")
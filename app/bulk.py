@@ -0,0 +1,127 @@
+import logging
+from collections import deque
+from starlette.concurrency import run_in_threadpool
+from app import config
+from app.engine import iter_encrypted, encrypt_envelope
+from app.executor import crypto_executor
+from app.benchmarks import record_summary
+from app.storage import transaction_store
+from app.database import db_writer
+from app.metrics import Benchmark, rsa_benchmark, pqc_benchmark
+from app.profiling import profiler
+from app.validation import validate_batch
+
+logger = logging.getLogger("uvicorn")
+
+# Most recent row failures kept for reporting
+MAX_REPORTED_ERRORS = 20
+
+class BulkLoad:
+    """Encrypts and inserts record batches for one bulk upload, keeping row counts and session benchmarks."""
+
+    def __init__(self, batches_done=0):
+        # batches_done > 0 when resuming a job, so batch numbers stay continuous in logs
+        self.batches = batches_done
+        self.total_rows = 0
+        self.success = 0
+        self.fail = 0
+        self.session_bm_rsa = Benchmark()
+        self.session_bm_pqc = Benchmark()
+        self.errors = deque(maxlen=MAX_REPORTED_ERRORS)
+
+    async def process_batch(self, batch_records, on_commit=None):
+        """
+        Encrypt one batch and insert it through the transaction store in one DB writer transaction.
+        With ENVELOPE_ENCRYPTION the batch shares one data key and is stored under one envelope header.
+        on_commit(cursor) runs inside the same transaction as the insert.
+        batch_records is a list of dicts or a DataFrame chunk; rows failing app/validation.py are
+        counted as failures and skipped.
+        Returns the positions in batch_records of rows that failed encryption (not inserted; worth
+        retrying, unlike rows that failed validation).
+        """
+        self.batches += 1
+        self.total_rows += len(batch_records)
+        insert_data = []
+
+        logger.info(f"🚀 Processing batch {self.batches} with {len(batch_records)} records...")
+
+        # Rows are type/range checked column-wise and serialized once; these bytes are what gets encrypted and stored
+        with profiler.span("validate"):
+            payloads, positions, rejected = await run_in_threadpool(validate_batch, batch_records)
+        if rejected:
+            logger.warning(f"⚠️ Batch {self.batches}: {len(rejected)} rows failed validation")
+            self.fail += len(rejected)
+            for position, reason in rejected[-MAX_REPORTED_ERRORS:]:
+                self.errors.append({"batch": self.batches, "row": position + 1, "stage": "validation", "error": reason})
+
+        header = None
+        failed = []
+        if config.ENVELOPE_ENCRYPTION and payloads:
+            header, results = await crypto_executor.run(encrypt_envelope, payloads)
+            for position, result in zip(positions, results):
+                if not self._tally(position + 1, result, insert_data):
+                    failed.append(position)
+        else:
+            i = 0
+            async for result in iter_encrypted(payloads):
+                if not self._tally(positions[i] + 1, result, insert_data):
+                    failed.append(positions[i])
+                i += 1
+
+        def store_batch(conn):
+            cursor = conn.cursor()
+            if insert_data and header is not None:
+                transaction_store.insert_envelope_batch(cursor, header, insert_data)
+            elif insert_data:
+                transaction_store.insert_transactions(cursor, insert_data)
+            if on_commit:
+                on_commit(cursor)
+
+        await db_writer.write(store_batch)
+        if insert_data:
+            logger.info(f"✅ Batch {self.batches} inserted {len(insert_data)} records successfully.")
+        return failed
+
+    def _tally(self, idx, result, insert_data):
+        status, row, rsa_time, pqc_time, error = result
+
+        if rsa_time is not None:
+            rsa_benchmark.record_latency(rsa_time)
+            self.session_bm_rsa.record_latency(rsa_time)
+        if status == "rsa_failed":
+            logger.error(f"❌ RSA encryption failed at row {idx}: {error}")
+            rsa_benchmark.record_error()
+            self.session_bm_rsa.record_error()
+            self.errors.append({"batch": self.batches, "row": idx, "stage": "RSA", "error": error})
+            self.fail += 1
+            return False
+
+        if pqc_time is not None:
+            pqc_benchmark.record_latency(pqc_time)
+            self.session_bm_pqc.record_latency(pqc_time)
+        if status == "pqc_failed":
+            logger.error(f"❌ PQC encryption failed at row {idx}: {error}")
+            pqc_benchmark.record_error()
+            self.session_bm_pqc.record_error()
+            self.errors.append({"batch": self.batches, "row": idx, "stage": "PQC", "error": error})
+            self.fail += 1
+            return False
+
+        insert_data.append(row)
+        self.success += 1
+        return True
+
+    # ✅ Fold another load's counts in (e.g. one per concurrently processed batch)
+    def merge(self, other):
+        self.total_rows += other.total_rows
+        self.success += other.success
+        self.fail += other.fail
+        self.session_bm_rsa.merge(other.session_bm_rsa)
+        self.session_bm_pqc.merge(other.session_bm_pqc)
+        self.errors.extend(other.errors)
+
+    # Record session-level benchmarks
+    def record_session_benchmarks(self):
+        for bm, algo in [(self.session_bm_rsa, "RSA"), (self.session_bm_pqc, "PQC")]:
+            summary = bm.summary()
+            record_summary(summary, type=f"bulk_session_{algo.lower()}", algorithm=algo, encryption_time=summary["average_latency"])
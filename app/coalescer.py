@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from app import config
+from app.benchmarks import record_summary
+from app.crypto import acquire_rsa_keys
+from app.database import db_writer
+from app.engine import encrypt_payload
+from app.executor import crypto_executor
+from app.metrics import Benchmark, rsa_benchmark, pqc_benchmark
+from app.storage import transaction_store
+
+logger = logging.getLogger("uvicorn")
+
+# ✅ Encrypt every payload of a window under one RSA key setup
+def encrypt_window(payloads):
+    rsa_keys = acquire_rsa_keys()
+    return [encrypt_payload(data, rsa_keys) for data in payloads]
+
+# ✅ One insert per window (committed by the DB writer)
+def store_window(conn, rows):
+    transaction_store.insert_transactions(conn.cursor(), rows)
+
+class EncryptionCoalescer:
+    """Collects concurrent single-transaction requests into short windows processed together."""
+
+    def __init__(self, max_batch, max_wait_ms):
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.windows = 0
+        self.requests = 0
+
+    # ✅ Queue one payload and wait for the window it lands in to be committed
+    async def submit(self, data: bytes):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((data, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        window, self._pending = self._pending, []
+        if window:
+            task = asyncio.get_running_loop().create_task(self._process(window))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, window):
+        self.windows += 1
+        self.requests += len(window)
+        try:
+            results = await crypto_executor.run(encrypt_window, [data for data, _ in window])
+
+            session_bm_rsa = Benchmark()
+            session_bm_pqc = Benchmark()
+            rows = []
+            for status, row, rsa_time, pqc_time, error in results:
+                if rsa_time is not None:
+                    rsa_benchmark.record_latency(rsa_time)
+                    session_bm_rsa.record_latency(rsa_time)
+                if status == "rsa_failed":
+                    logger.error(f"RSA encryption failed: {error}")
+                    rsa_benchmark.record_error()
+                    session_bm_rsa.record_error()
+                if pqc_time is not None:
+                    pqc_benchmark.record_latency(pqc_time)
+                    session_bm_pqc.record_latency(pqc_time)
+                if status == "pqc_failed":
+                    logger.error(f"PQC encryption failed: {error}")
+                    pqc_benchmark.record_error()
+                    session_bm_pqc.record_error()
+                if row is not None:
+                    rows.append(row)
+
+            if rows:
+                await db_writer.write(store_window, rows)
+            for bm, algo in [(session_bm_rsa, "RSA"), (session_bm_pqc, "PQC")]:
+                summary = bm.summary()
+                record_summary(summary, type=f"session_{algo.lower()}", algorithm=algo, encryption_time=summary["average_latency"])
+        except Exception as e:
+            logger.error(f"❌ Coalesced window of {len(window)} requests failed: {e}")
+            for _, future in window:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(window, results):
+            if not future.done():
+                future.set_result(result[0])
+
+    def stats(self):
+        return {
+            "enabled": config.COALESCE_ENABLED,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "windows": self.windows,
+            "requests": self.requests,
+            "average_window_size": self.requests / self.windows if self.windows else 0,
+            "pending": len(self._pending)
+        }
+
+    async def drain(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# ✅ Global instance used by /encrypt-transaction/ when COALESCE_ENABLED is set
+encryption_coalescer = EncryptionCoalescer(config.COALESCE_MAX_BATCH, config.COALESCE_MAX_WAIT_MS)
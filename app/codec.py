@@ -0,0 +1,301 @@
+"""
+Compact binary Transaction records: the plaintext that is encrypted and stored.
+
+A record is a version byte, a flags byte and a body. Body (version 1): a 3-byte little-endian
+bitmap, bit i set when field i (Transaction order) is in its packed form, then every field in
+order, without names:
+- int: zigzag varint
+- float: packed, a zigzag varint of (value * 10**k) << 4 | k when a decimal with k <= 15 places
+  gives back the exact float (amounts, coordinates); otherwise an 8-byte IEEE double
+- str: varint length + UTF-8; packed forms for the date fields (seconds / days from 1970-01-01),
+  cc_num (varint of the digits) and trans_num (32 lowercase hex digits as 16 raw bytes)
+FLAG_DEFLATE: the body is raw deflate with ZDICT as preset dictionary; only set when smaller.
+
+decode_record also reads the legacy format, JSON text (transaction_json rows and ciphertexts
+written before the codec, or with RECORD_FORMAT=json), so callers don't need to know which
+format a row is in.
+"""
+import json
+import math
+import re
+import struct
+import zlib
+from datetime import date
+from app import config
+from app.models import Transaction
+
+RECORD_VERSION = 1
+
+FLAG_DEFLATE = 0x01
+
+FIELDS = list(Transaction.__annotations__)
+FIELD_TYPES = dict(Transaction.__annotations__)
+
+BITMAP_BYTES = (len(FIELDS) + 7) // 8
+
+# Common values of the string fields, primed into the deflate window
+ZDICT = (
+    b"Psychologist, counsellingEngineer, manufacturingTeacher, secondary schoolofficerManager"
+    b"misc_netgrocery_posentertainmentgas_transportmisc_posgrocery_netshopping_netshopping_pos"
+    b"food_dininghealth_fitnesspersonal_carekids_petshome travel fraud_ and LLC, Ltd Inc Group "
+    b"StreetAvenueRoadSuitesApt. CoveLaneSpursViewsFalls"
+)
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_DATETIME = re.compile(r"(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})\Z")
+_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})\Z")
+_HEX128 = re.compile(r"[0-9a-f]{32}\Z")
+_DIGITS = re.compile(r"(0|[1-9][0-9]{0,37})\Z")
+_DOUBLE = struct.Struct("<d")
+
+class CodecError(ValueError):
+    pass
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+def _unzigzag(n):
+    return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+def _put_varint(out, n):
+    if n < 0x80:
+        out.append(n)
+        return
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _get_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+# Packed string forms: pack returns an int (or bytes for hex) or None when the value doesn't fit
+def _pack_datetime(value):
+    match = _DATETIME.match(value)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second = map(int, match.groups())
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+    try:
+        days = date(year, month, day).toordinal() - _EPOCH_ORDINAL
+    except ValueError:
+        return None
+    return _zigzag(days * 86400 + hour * 3600 + minute * 60 + second)
+
+def _unpack_datetime(n):
+    days, seconds = divmod(_unzigzag(n), 86400)
+    d = date.fromordinal(days + _EPOCH_ORDINAL)
+    return f"{d.year:04d}-{d.month:02d}-{d.day:02d} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def _pack_date(value):
+    match = _DATE.match(value)
+    if match is None:
+        return None
+    try:
+        return _zigzag(date(*map(int, match.groups())).toordinal() - _EPOCH_ORDINAL)
+    except ValueError:
+        return None
+
+def _unpack_date(n):
+    d = date.fromordinal(_unzigzag(n) + _EPOCH_ORDINAL)
+    return f"{d.year:04d}-{d.month:02d}-{d.day:02d}"
+
+def _pack_digits(value):
+    return int(value) if _DIGITS.match(value) else None
+
+# name: (pack, unpack) for string fields with a packed varint form
+STRING_PACKING = {
+    "trans_date_trans_time": (_pack_datetime, _unpack_datetime),
+    "dob": (_pack_date, _unpack_date),
+    "cc_num": (_pack_digits, str)
+}
+# 32 lowercase hex digits, packed as 16 raw bytes
+HEX_FIELDS = ("trans_num",)
+
+def _pack_float(value):
+    """zigzag(value * 10**k) << 4 | k, or None when no short decimal reproduces value exactly."""
+    if not math.isfinite(value) or (value == 0 and math.copysign(1, value) < 0):
+        return None
+    text = repr(value)
+    if "e" in text:
+        return None
+    whole, _, fraction = text.partition(".")
+    places = len(fraction.rstrip("0"))
+    if places > 15:
+        return None
+    scaled = int(whole + fraction[:places]) if places else int(whole)
+    if scaled / 10 ** places != value:
+        return None
+    return _zigzag(scaled) << 4 | places
+
+def _unpack_float(n):
+    return _unzigzag(n >> 4) / 10 ** (n & 0x0F)
+
+def _put_text(out, value):
+    raw = value.encode()
+    _put_varint(out, len(raw))
+    out += raw
+
+def _encode_int(out, value):
+    _put_varint(out, _zigzag(int(value)))
+    return False
+
+def _encode_float(out, value):
+    value = float(value)
+    packed = _pack_float(value)
+    if packed is None:
+        out += _DOUBLE.pack(value)
+        return False
+    _put_varint(out, packed)
+    return True
+
+def _encode_text(out, value):
+    _put_text(out, value)
+    return False
+
+def _packed_text_encoder(pack):
+    def encode(out, value):
+        packed = pack(value)
+        if packed is None:
+            _put_text(out, value)
+            return False
+        _put_varint(out, packed)
+        return True
+    return encode
+
+def _encode_hex128(out, value):
+    if _HEX128.match(value) is None:
+        _put_text(out, value)
+        return False
+    out += bytes.fromhex(value)
+    return True
+
+def _decode_int(body, pos, packed):
+    n, pos = _get_varint(body, pos)
+    return _unzigzag(n), pos
+
+def _decode_float(body, pos, packed):
+    if packed:
+        n, pos = _get_varint(body, pos)
+        return _unpack_float(n), pos
+    return _DOUBLE.unpack_from(body, pos)[0], pos + _DOUBLE.size
+
+def _decode_text(body, pos, packed):
+    length, pos = _get_varint(body, pos)
+    end = pos + length
+    if end > len(body):
+        raise IndexError("text runs past the end of the record")
+    return body[pos:end].decode(), end
+
+def _packed_text_decoder(unpack):
+    def decode(body, pos, packed):
+        if not packed:
+            return _decode_text(body, pos, packed)
+        n, pos = _get_varint(body, pos)
+        return unpack(n), pos
+    return decode
+
+def _decode_hex128(body, pos, packed):
+    if not packed:
+        return _decode_text(body, pos, packed)
+    if pos + 16 > len(body):
+        raise IndexError("trans_num runs past the end of the record")
+    return body[pos:pos + 16].hex(), pos + 16
+
+def _field_codec(name):
+    """(encode(out, value) -> packed?, decode(body, pos, packed) -> (value, pos)) for one field."""
+    field_type = FIELD_TYPES[name]
+    if field_type is int:
+        return _encode_int, _decode_int
+    if field_type is float:
+        return _encode_float, _decode_float
+    if name in STRING_PACKING:
+        pack, unpack = STRING_PACKING[name]
+        return _packed_text_encoder(pack), _packed_text_decoder(unpack)
+    if name in HEX_FIELDS:
+        return _encode_hex128, _decode_hex128
+    return _encode_text, _decode_text
+
+# Chosen once, so encoding a record is one call per field
+_FIELD_CODECS = [(name, 1 << i, *_field_codec(name)) for i, name in enumerate(FIELDS)]
+
+def _encode_body(values):
+    bitmap = 0
+    out = bytearray(BITMAP_BYTES)
+    for (_, bit, encode, _), value in zip(_FIELD_CODECS, values):
+        if encode(out, value):
+            bitmap |= bit
+    out[:BITMAP_BYTES] = bitmap.to_bytes(BITMAP_BYTES, "little")
+    return bytes(out)
+
+def _decode_body(body):
+    bitmap = int.from_bytes(body[:BITMAP_BYTES], "little")
+    pos = BITMAP_BYTES
+    record = {}
+    for name, bit, _, decode in _FIELD_CODECS:
+        record[name], pos = decode(body, pos, bitmap & bit)
+    if pos != len(body):
+        raise CodecError(f"{len(body) - pos} trailing bytes after record")
+    return record
+
+def _deflate(body):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZDICT)
+    return compressor.compress(body) + compressor.flush()
+
+def _inflate(body):
+    return zlib.decompressobj(-15, zdict=ZDICT).decompress(body)
+
+# ✅ One record: values in Transaction field order
+def encode_record(values, compress=False):
+    body = _encode_body(values)
+    flags = 0
+    if compress:
+        deflated = _deflate(body)
+        if len(deflated) < len(body):
+            body = deflated
+            flags |= FLAG_DEFLATE
+    return bytes((RECORD_VERSION, flags)) + body
+
+def encode_rows(rows, compress=False):
+    return [encode_record(values, compress) for values in rows]
+
+# ✅ Either format -> Transaction field dict
+def decode_record(data):
+    if isinstance(data, str):
+        return json.loads(data)
+    data = bytes(data)
+    if data[:1] == b"{":
+        return json.loads(data)
+    if len(data) < 2:
+        raise CodecError("Record too short")
+    version, flags = data[0], data[1]
+    if version != RECORD_VERSION:
+        raise CodecError(f"Unsupported record version {version}")
+    body = data[2:]
+    try:
+        if flags & FLAG_DEFLATE:
+            body = _inflate(body)
+        return _decode_body(body)
+    except (IndexError, UnicodeDecodeError, struct.error, zlib.error) as e:
+        raise CodecError(f"Corrupt record: {e}") from e
+
+def decode_records(blobs):
+    return [decode_record(data) for data in blobs]
+
+# ✅ Plaintext for a validated Transaction in the configured RECORD_FORMAT
+def encode_transaction(transaction: Transaction):
+    if config.RECORD_FORMAT == "json":
+        return transaction.json().encode()
+    return encode_record([getattr(transaction, name) for name in FIELDS], config.RECORD_COMPRESSION)
+
+def storage_value(payload: bytes):
+    """transaction_json column value: JSON payloads stay TEXT, binary records are stored as BLOBs."""
+    return payload.decode() if payload[:1] == b"{" else payload
@@ -0,0 +1,130 @@
+"""
+Deployment settings for PQC Transaction Encryption API, read from the environment
+"""
+import os
+
+# Bulk upload pipeline
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "10000"))
+
+# Process-pool encryption engine (0 workers = encrypt on the crypto executor threads)
+ENCRYPT_WORKERS = int(os.getenv("ENCRYPT_WORKERS", str(os.cpu_count() or 1)))
+ENCRYPT_CHUNKS_PER_WORKER = int(os.getenv("ENCRYPT_CHUNKS_PER_WORKER", "4"))
+
+# Opt-in envelope encryption for bulk batches: one RSA wrap + one KEM encapsulation per batch
+# seal a batch data key, and each record is AES-GCM encrypted under it (see app/storage.py)
+ENVELOPE_ENCRYPTION = os.getenv("ENVELOPE_ENCRYPTION", "false").lower() in ("1", "true", "yes")
+
+# Plaintext record format that is encrypted and stored: "binary" (app/codec.py) or "json" (legacy text).
+# RECORD_COMPRESSION deflates binary records when that makes them smaller.
+RECORD_FORMAT = os.getenv("RECORD_FORMAT", "binary")
+RECORD_COMPRESSION = os.getenv("RECORD_COMPRESSION", "false").lower() in ("1", "true", "yes")
+
+# RSA key provider: "pool" (pre-generated keypairs, one per message) or "rotating" (long-lived recipient key)
+RSA_KEY_MODE = os.getenv("RSA_KEY_MODE", "pool")
+RSA_POOL_LOW_WATERMARK = int(os.getenv("RSA_POOL_LOW_WATERMARK", "16"))
+RSA_POOL_HIGH_WATERMARK = int(os.getenv("RSA_POOL_HIGH_WATERMARK", "64"))
+RSA_POOL_REFILL_WORKERS = int(os.getenv("RSA_POOL_REFILL_WORKERS", "1"))
+RSA_KEY_MAX_USES = int(os.getenv("RSA_KEY_MAX_USES", "10000"))
+RSA_KEY_MAX_AGE_SECONDS = float(os.getenv("RSA_KEY_MAX_AGE_SECONDS", "3600"))
+
+# PQC KEM: parameter set (Kyber512/768/1024 or ML-KEM-512/768/1024) and
+# "recipient" (encapsulate to a long-lived recipient key) or "per_message" keypairs
+PQC_KEM_ALGORITHM = os.getenv("PQC_KEM_ALGORITHM", "Kyber512")
+PQC_KEY_MODE = os.getenv("PQC_KEY_MODE", "recipient")
+
+# Background bulk jobs. The spool directory holds uploads until their job finishes and
+# must be on a persistent volume for jobs to resume after a pod restart.
+BULK_JOB_SPOOL_DIR = os.getenv("BULK_JOB_SPOOL_DIR", "bulk_jobs")
+BULK_JOB_CONCURRENCY = int(os.getenv("BULK_JOB_CONCURRENCY", "1"))
+# A process runs a job only while it holds the job's lease (renewed every third of this);
+# jobs whose owner stopped renewing are picked up by another worker/replica once it expires
+BULK_JOB_LEASE_SECONDS = float(os.getenv("BULK_JOB_LEASE_SECONDS", "60"))
+
+# Thread pool that runs per-request encryption/decryption off the event loop
+CRYPTO_EXECUTOR_WORKERS = int(os.getenv("CRYPTO_EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+
+# Opt-in micro-batching of concurrent /encrypt-transaction/ calls: a window closes
+# after COALESCE_MAX_WAIT_MS or once COALESCE_MAX_BATCH requests are waiting
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "false").lower() in ("1", "true", "yes")
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", "64"))
+COALESCE_MAX_WAIT_MS = float(os.getenv("COALESCE_MAX_WAIT_MS", "5"))
+
+# SQLite: database file, connection pool and pragmas (see app/database.py)
+DB_PATH = os.getenv("DB_PATH", "creditcard.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+# How long a request waits for a free pooled connection before getting a 503
+DB_POOL_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT_SECONDS", "10"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+
+# Transaction storage backend: "sqlite" (a secure_transactions_v2 row per transaction) or "segments"
+# (append-only segment files in SEGMENT_DIR, one frame per batch indexed in SQLite; see app/segments.py).
+# Sealed segments with less than SEGMENT_COMPACT_MIN_LIVE_RATIO live bytes, or smaller than
+# SEGMENT_COMPACT_SMALL_BYTES, are rewritten every SEGMENT_COMPACT_INTERVAL_SECONDS.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+SEGMENT_DIR = os.getenv("SEGMENT_DIR", "segments")
+SEGMENT_MAX_BYTES = int(os.getenv("SEGMENT_MAX_BYTES", str(256 * 1024 * 1024)))
+SEGMENT_MMAP_CACHE_SIZE = int(os.getenv("SEGMENT_MMAP_CACHE_SIZE", "64"))
+SEGMENT_COMPACT_INTERVAL_SECONDS = int(os.getenv("SEGMENT_COMPACT_INTERVAL_SECONDS", "600"))
+SEGMENT_COMPACT_MIN_LIVE_RATIO = float(os.getenv("SEGMENT_COMPACT_MIN_LIVE_RATIO", "0.5"))
+SEGMENT_COMPACT_SMALL_BYTES = int(os.getenv("SEGMENT_COMPACT_SMALL_BYTES", str(16 * 1024 * 1024)))
+
+# Single-writer queue: writes submitted within DB_WRITER_MAX_WAIT_MS share one commit
+DB_WRITER_MAX_BATCH = int(os.getenv("DB_WRITER_MAX_BATCH", "64"))
+DB_WRITER_MAX_WAIT_MS = float(os.getenv("DB_WRITER_MAX_WAIT_MS", "2"))
+
+# Buffered benchmark writes: flushed every BENCHMARK_FLUSH_INTERVAL_SECONDS or at
+# BENCHMARK_FLUSH_SIZE rows; records beyond BENCHMARK_BUFFER_SIZE are dropped and counted
+BENCHMARK_BUFFER_SIZE = int(os.getenv("BENCHMARK_BUFFER_SIZE", "50000"))
+BENCHMARK_FLUSH_SIZE = int(os.getenv("BENCHMARK_FLUSH_SIZE", "500"))
+BENCHMARK_FLUSH_INTERVAL_SECONDS = float(os.getenv("BENCHMARK_FLUSH_INTERVAL_SECONDS", "1"))
+
+# Rolling windows for live benchmarks, in seconds; each window is a ring of ROLLING_SLOTS buckets
+ROLLING_WINDOWS_SECONDS = [int(s) for s in os.getenv("ROLLING_WINDOWS_SECONDS", "60,300,3600").split(",") if s.strip()]
+ROLLING_SLOTS = int(os.getenv("ROLLING_SLOTS", "12"))
+
+# Metrics snapshots: every process publishes its benchmarks here for /benchmarks/aggregate.
+# Defaults to the main DB (all workers of a pod); point it at a shared volume to span replicas.
+METRICS_DB_PATH = os.getenv("METRICS_DB_PATH", DB_PATH)
+METRICS_PUBLISH_INTERVAL_SECONDS = int(os.getenv("METRICS_PUBLISH_INTERVAL_SECONDS", "10"))
+METRICS_SNAPSHOT_TTL_SECONDS = int(os.getenv("METRICS_SNAPSHOT_TTL_SECONDS", "60"))
+
+# Benchmark retention in days (0 = keep forever); day rollups are always kept
+BENCHMARK_RAW_RETENTION_DAYS = int(os.getenv("BENCHMARK_RAW_RETENTION_DAYS", "7"))
+BENCHMARK_MINUTE_ROLLUP_RETENTION_DAYS = int(os.getenv("BENCHMARK_MINUTE_ROLLUP_RETENTION_DAYS", "30"))
+BENCHMARK_HOUR_ROLLUP_RETENTION_DAYS = int(os.getenv("BENCHMARK_HOUR_ROLLUP_RETENTION_DAYS", "365"))
+BENCHMARK_COMPACT_INTERVAL_SECONDS = int(os.getenv("BENCHMARK_COMPACT_INTERVAL_SECONDS", "3600"))
+BENCHMARK_COMPACT_CHUNK_SIZE = int(os.getenv("BENCHMARK_COMPACT_CHUNK_SIZE", "5000"))
+
+# On-demand profiling (/admin/profile): off unless enabled, and only for callers sending PROFILING_ADMIN_TOKEN
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", "5"))
+PROFILING_MAX_SECONDS = int(os.getenv("PROFILING_MAX_SECONDS", "300"))
+
+# Key store: RSA private keys and KEM secret keys are persisted wrapped (AES-GCM) under this
+# master key (base64, 32 bytes). Without it one is generated into KEY_STORE_MASTER_KEY_FILE.
+KEY_STORE_MASTER_KEY = os.getenv("KEY_STORE_MASTER_KEY", "")
+KEY_STORE_MASTER_KEY_FILE = os.getenv("KEY_STORE_MASTER_KEY_FILE", "keystore.key")
+
+# Decryption API: off unless enabled, and only for callers sending DECRYPT_ADMIN_TOKEN
+DECRYPT_ENABLED = os.getenv("DECRYPT_ENABLED", "false").lower() == "true"
+DECRYPT_ADMIN_TOKEN = os.getenv("DECRYPT_ADMIN_TOKEN", "")
+DECRYPT_KEY_CACHE_SIZE = int(os.getenv("DECRYPT_KEY_CACHE_SIZE", "256"))
+DECRYPT_MAX_BATCH = int(os.getenv("DECRYPT_MAX_BATCH", "1000"))
+
+# Queue subscriber worker (python -m app.pubsub_subscriber). Backend "spool" reads NDJSON files
+# dropped into SUBSCRIBER_SPOOL_DIR, "pubsub" pulls from Google Pub/Sub SUBSCRIBER_SUBSCRIPTION.
+# At most SUBSCRIBER_MAX_OUTSTANDING messages are pulled but not yet acked (backpressure).
+SUBSCRIBER_BACKEND = os.getenv("SUBSCRIBER_BACKEND", "spool")
+SUBSCRIBER_SPOOL_DIR = os.getenv("SUBSCRIBER_SPOOL_DIR", "subscriber_spool")
+SUBSCRIBER_SUBSCRIPTION = os.getenv("SUBSCRIBER_SUBSCRIPTION", "")
+SUBSCRIBER_BATCH_SIZE = int(os.getenv("SUBSCRIBER_BATCH_SIZE", "500"))
+SUBSCRIBER_BATCH_WAIT_MS = float(os.getenv("SUBSCRIBER_BATCH_WAIT_MS", "200"))
+SUBSCRIBER_CONCURRENCY = int(os.getenv("SUBSCRIBER_CONCURRENCY", "2"))
+SUBSCRIBER_MAX_OUTSTANDING = int(os.getenv("SUBSCRIBER_MAX_OUTSTANDING", "5000"))
+# Lease on pulled messages; the pubsub backend keeps extending it until the message is acked or nacked
+SUBSCRIBER_ACK_DEADLINE_SECONDS = int(os.getenv("SUBSCRIBER_ACK_DEADLINE_SECONDS", "600"))
@@ -1,9 +1,14 @@
 import os
-import oqs
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from app.keys import build_key_provider
+from app.kem import KEM_ALGORITHM, get_encap_kem, get_decap_kem, encapsulation_public_key
+from app.telemetry import stage
+
+RSA_ALGORITHM = "RSA-2048"
 
 # ✅ Derive 256-bit AES key from shared secret using SHA256
 def derive_aes_key(shared_secret):
@@ -15,23 +20,25 @@ def rsa_hybrid_encrypt(plaintext, public_key):
     aes_key = os.urandom(32)  # 256-bit AES key
 
     # Encrypt AES key with RSA public key
-    encrypted_aes_key = public_key.encrypt(
-        aes_key,
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
+    with stage("rsa_oaep_wrap", RSA_ALGORITHM):
+        encrypted_aes_key = public_key.encrypt(
+            aes_key,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
         )
-    )
 
     # Encrypt plaintext with AES key
-    iv = os.urandom(12)
-    encryptor = Cipher(
-        algorithms.AES(aes_key),
-        modes.GCM(iv),
-        backend=default_backend()
-    ).encryptor()
-    ciphertext = encryptor.update(plaintext) + encryptor.finalize()
+    with stage("aes_gcm", RSA_ALGORITHM):
+        iv = os.urandom(12)
+        encryptor = Cipher(
+            algorithms.AES(aes_key),
+            modes.GCM(iv),
+            backend=default_backend()
+        ).encryptor()
+        ciphertext = encryptor.update(plaintext) + encryptor.finalize()
 
     # Return RSA-encrypted AES key + AES ciphertext
     return encrypted_aes_key, iv + encryptor.tag + ciphertext
@@ -46,62 +53,109 @@ def aes_encrypt(key, plaintext):
     ciphertext = encryptor.update(plaintext) + encryptor.finalize()
     return iv + encryptor.tag + ciphertext
 
-# ✅ PQC KEM Encryption using Kyber512
-def pqc_kem_encrypt(plaintext):
-    with oqs.KeyEncapsulation("Kyber512") as kem:
-        public_key = kem.generate_keypair()
-        oqs_ciphertext, shared_secret = kem.encap_secret(public_key)
-    aes_key = derive_aes_key(shared_secret)
-    aes_ciphertext = aes_encrypt(aes_key, plaintext)
+# ✅ PQC KEM Encryption (Kyber/ML-KEM, PQC_KEM_ALGORITHM unless given) to the recipient public key
+def pqc_kem_encrypt(plaintext, public_key=None, algorithm=None):
+    algorithm = algorithm or KEM_ALGORITHM
+    if public_key is None:
+        public_key = encapsulation_public_key()
+    with stage("kem_encap", algorithm):
+        oqs_ciphertext, shared_secret = get_encap_kem(algorithm).encap_secret(public_key)
+    with stage("sha256_kdf", algorithm):
+        aes_key = derive_aes_key(shared_secret)
+    with stage("aes_gcm", algorithm):
+        aes_ciphertext = aes_encrypt(aes_key, plaintext)
     return public_key, oqs_ciphertext, aes_ciphertext
 
 # ✅ RSA 2048-bit key generation
 def generate_rsa_keys():
-    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with stage("rsa_keygen", RSA_ALGORITHM):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
     public_key = private_key.public_key()
     return private_key, public_key
 
+# ✅ Shared RSA key provider (background keypair pool or rotating recipient key)
+rsa_key_provider = build_key_provider(generate_rsa_keys)
+
+def acquire_rsa_keys():
+    return rsa_key_provider.acquire()
+
 # ✅ RSA Encryption using OAEP padding
 def rsa_encrypt(data: bytes, public_key):
-    return public_key.encrypt(
-        data,
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
+    with stage("rsa_oaep_wrap", RSA_ALGORITHM):
+        return public_key.encrypt(
+            data,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
         )
-    )
 
 def rsa_decrypt(ciphertext: bytes, private_key):
-    return private_key.decrypt(
-        ciphertext,
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
+    with stage("rsa_oaep_unwrap", RSA_ALGORITHM):
+        return private_key.decrypt(
+            ciphertext,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
         )
-    )
-def pqc_kem_decrypt(oqs_ciphertext, secret_key, aes_ciphertext):
-    # Load Kyber512 KEM
-    with oqs.KeyEncapsulation("Kyber512") as kem:
-        kem.secret_key = secret_key  # Set the secret key
-
-        # Decapsulate to get the shared secret
-        shared_secret = kem.decap_secret(oqs_ciphertext)
-
-    # Derive AES key from shared secret
-    aes_key = derive_aes_key(shared_secret)
 
-    # Decrypt AES-GCM ciphertext
-    iv = aes_ciphertext[:12]
-    tag = aes_ciphertext[12:28]
-    ciphertext = aes_ciphertext[28:]
+# ✅ Inverse of rsa_hybrid_encrypt
+def rsa_hybrid_decrypt(encrypted_aes_key, ciphertext, private_key):
+    aes_key = rsa_decrypt(encrypted_aes_key, private_key)
+    with stage("aes_gcm_decrypt", RSA_ALGORITHM):
+        return aes_decrypt(aes_key, ciphertext)
 
+# ✅ AES-GCM decryption of iv + tag + ciphertext
+def aes_decrypt(key, data):
+    iv = data[:12]
+    # GCM wants the tag as bytes; data may be a memoryview into a segment mapping
+    tag = bytes(data[12:28])
     decryptor = Cipher(
-        algorithms.AES(aes_key),
+        algorithms.AES(key),
         modes.GCM(iv, tag),
         backend=default_backend()
     ).decryptor()
+    return decryptor.update(data[28:]) + decryptor.finalize()
+
+_last_private_key = (None, None)
+
+# ✅ PKCS#8 DER of an RSA private key, for the key store (rotating mode reuses a key, so remember the last one)
+def rsa_private_key_bytes(private_key):
+    global _last_private_key
+    key, der = _last_private_key
+    if key is not private_key:
+        der = private_key.private_bytes(
+            serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+        _last_private_key = (private_key, der)
+    return der
+def pqc_kem_decrypt(oqs_ciphertext, secret_key, aes_ciphertext, algorithm=None):
+    algorithm = algorithm or KEM_ALGORITHM
+
+    # Decapsulate to get the shared secret (KEM context cached per thread and secret key)
+    with stage("kem_decap", algorithm):
+        shared_secret = get_decap_kem(secret_key, algorithm).decap_secret(oqs_ciphertext)
+
+    # Derive AES key from shared secret
+    with stage("sha256_kdf", algorithm):
+        aes_key = derive_aes_key(shared_secret)
+
+    # Decrypt AES-GCM ciphertext
+    with stage("aes_gcm_decrypt", algorithm):
+        return aes_decrypt(aes_key, aes_ciphertext)    
+
+# Records in a batch share the data key, so each gets its sequence number as GCM nonce
+def envelope_nonce(seq):
+    return seq.to_bytes(12, "big")
+
+# ✅ AES-GCM of one record under the batch data key; batch_uid is the associated data,
+# so a record can't be replayed into another batch or position
+def envelope_encrypt(aead: AESGCM, batch_uid, seq, plaintext):
+    return aead.encrypt(envelope_nonce(seq), plaintext, batch_uid)
 
-    plaintext = decryptor.update(ciphertext) + decryptor.finalize()
-    return plaintext    
\ No newline at end of file
+def envelope_decrypt(data_key, batch_uid, seq, ciphertext):
+    with stage("aes_gcm_decrypt", "envelope"):
+        return AESGCM(data_key).decrypt(envelope_nonce(seq), ciphertext, batch_uid)
@@ -1,18 +1,215 @@
+import asyncio
+import logging
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from app import config, telemetry
+
+logger = logging.getLogger("uvicorn")
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# Bucket start of a benchmarks.timestamp for each rollup granularity
+ROLLUP_BUCKET_SQL = {
+    "minute": "strftime('%Y-%m-%d %H:%M:00', timestamp)",
+    "hour": "strftime('%Y-%m-%d %H:00:00', timestamp)",
+    "day": "strftime('%Y-%m-%d 00:00:00', timestamp)"
+}
+
+# ✅ Open a connection with the tuned pragmas
+def connect(db_path=None, **kwargs):
+    conn = sqlite3.connect(
+        db_path or config.DB_PATH,
+        check_same_thread=False,
+        timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=config.SQLITE_STATEMENT_CACHE,
+        **kwargs
+    )
+    synchronous = config.SQLITE_SYNCHRONOUS.upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"Unknown SQLITE_SYNCHRONOUS: {config.SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+    conn.execute(f"PRAGMA cache_size = -{int(config.SQLITE_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size = {int(config.SQLITE_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+class PoolTimeout(Exception):
+    """No pooled connection became free within DB_POOL_ACQUIRE_TIMEOUT_SECONDS (HTTP 503)."""
+
+class ConnectionPool:
+    """Reusable reader/request connections; WAL lets them read while the writer commits."""
+
+    def __init__(self, size):
+        self.size = max(size, 1)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def acquire(self, timeout=None):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self.created < self.size:
+                self.created += 1
+                return connect()
+        timeout = config.DB_POOL_ACQUIRE_TIMEOUT_SECONDS if timeout is None else timeout
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"No database connection free after {timeout}s ({self.size} in use)") from None
+
+    def release(self, conn):
+        if conn.in_transaction:
+            # Never hand the next request a half-finished transaction
+            conn.rollback()
+        self._idle.put(conn)
+
+    def stats(self):
+        return {"size": self.size, "open": self.created, "idle": self._idle.qsize()}
+
+class DBWriter:
+    """
+    Single writer thread owning one connection. Write functions queued within a short
+    window run in one transaction (each under its own SAVEPOINT, so one failure doesn't
+    sink the others) and share a single commit.
+    Write functions receive the connection and must not commit themselves.
+    Commit hooks run on the writer thread right before every COMMIT; one raising rolls the
+    whole transaction back (app/segments.py fsyncs there, ahead of the index rows it backs).
+    """
+
+    def __init__(self, max_batch, max_wait_ms):
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.commits = 0
+        self.writes = 0
+        self._commit_hooks = []
+
+    def add_commit_hook(self, hook):
+        self._commit_hooks.append(hook)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args):
+        if self._thread is None:
+            self._start()
+        future = Future()
+        self._queue.put((fn, args, future, telemetry.current_endpoint.get()))
+        return future
+
+    # ✅ Await a write from async code
+    async def write(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.time()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is None:
+                break
+        return batch
+
+    def _run(self):
+        conn = connect(isolation_level=None)
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect(first)
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+
+            results = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, args, future, endpoint in batch:
+                    conn.execute("SAVEPOINT write_item")
+                    started = time.perf_counter()
+                    try:
+                        results.append((future, fn(conn, *args), None))
+                        conn.execute("RELEASE write_item")
+                        telemetry.db_writes.inc(fn.__name__, "ok")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write_item")
+                        conn.execute("RELEASE write_item")
+                        results.append((future, None, e))
+                        telemetry.db_writes.inc(fn.__name__, "error")
+                    telemetry.db_write_seconds.observe(time.perf_counter() - started, fn.__name__, endpoint)
+                for hook in self._commit_hooks:
+                    hook()
+                started = time.perf_counter()
+                conn.execute("COMMIT")
+                telemetry.db_commit_seconds.observe(time.perf_counter() - started)
+                self.commits += 1
+                self.writes += len(batch)
+            except Exception as e:
+                logger.error(f"❌ DB writer commit failed: {e}")
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                results = [(future, None, e) for _, _, future, _ in batch]
+
+            # Resolve only after COMMIT, so callers see durable writes
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            if stop:
+                break
+        conn.close()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "commits": self.commits,
+            "writes": self.writes,
+            "writes_per_commit": self.writes / self.commits if self.commits else 0
+        }
+
+# ✅ Global pool and writer
+db_pool = ConnectionPool(config.DB_POOL_SIZE)
+db_writer = DBWriter(config.DB_WRITER_MAX_BATCH, config.DB_WRITER_MAX_WAIT_MS)
 
 # Database connection dependency
 def get_db():
-    conn = sqlite3.connect("creditcard.db", check_same_thread=False)
+    conn = db_pool.acquire()
     try:
         yield conn
     finally:
-        conn.close()
+        db_pool.release(conn)
 
 # Initialize DB schema (run once)
-def init_db():
-    conn = sqlite3.connect("creditcard.db")
+def init_db(db_path=None):
+    conn = connect(db_path)
     cursor = conn.cursor()
 
+    # WAL is persistent in the file: readers no longer block behind bulk inserts
+    cursor.execute("PRAGMA journal_mode = WAL")
+
     # Create secure_transactions table
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS secure_transactions (
@@ -26,6 +223,86 @@ def init_db():
     )
     """)
 
+    # Storage format v2: deduplicated public keys + BLOB ciphertexts (see app/storage.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS public_keys (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        algorithm TEXT NOT NULL,
+        fingerprint BLOB NOT NULL UNIQUE, -- SHA-256 of public_key
+        public_key BLOB NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'secure_transactions_v2'")
+    v2_exists = cursor.fetchone() is not None
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS secure_transactions_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        transaction_json TEXT,
+        rsa_key_id INTEGER REFERENCES public_keys(id),
+        rsa_encrypted_key BLOB,
+        rsa_ciphertext BLOB,
+        pqc_key_id INTEGER REFERENCES public_keys(id),
+        oqs_ciphertext BLOB,
+        aes_ciphertext BLOB
+    )
+    """)
+    if not v2_exists:
+        # Start v2 ids after the legacy ones so ids stay unique across both layouts
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'secure_transactions'")
+        row = cursor.fetchone()
+        legacy_max_id = row[0] if row else 0
+        if legacy_max_id:
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES ('secure_transactions_v2', ?)",
+                (legacy_max_id,)
+            )
+
+    # Envelope batches (ENVELOPE_ENCRYPTION): the batch data key sealed to both recipients;
+    # secure_transactions_v2 rows point here with envelope_id/envelope_seq
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS envelope_batches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        batch_uid BLOB NOT NULL, -- AES-GCM associated data of every record in the batch
+        rsa_key_id INTEGER REFERENCES public_keys(id),
+        rsa_encrypted_key BLOB, -- data key under RSA-OAEP
+        pqc_key_id INTEGER REFERENCES public_keys(id),
+        oqs_ciphertext BLOB,
+        pqc_wrapped_key BLOB, -- data key under AES-GCM with the KEM-derived key
+        record_count INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("PRAGMA table_info(secure_transactions_v2)")
+    v2_columns = {row[1] for row in cursor.fetchall()}
+    if "envelope_id" not in v2_columns:
+        cursor.execute("ALTER TABLE secure_transactions_v2 ADD COLUMN envelope_id INTEGER REFERENCES envelope_batches(id)")
+        cursor.execute("ALTER TABLE secure_transactions_v2 ADD COLUMN envelope_seq INTEGER")
+
+    # Segment storage (STORAGE_BACKEND=segments): one row per batch frame in a segment file.
+    # Its records are transactions first_id .. first_id + record_count - 1 (see app/storage.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS segment_batches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_id INTEGER NOT NULL UNIQUE,
+        record_count INTEGER NOT NULL,
+        segment TEXT NOT NULL,
+        frame_offset INTEGER NOT NULL,
+        frame_length INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_segment_batches_segment ON segment_batches (segment)")
+
+    # Create key_secrets table: private key material for public_keys rows, wrapped under the key store master key
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS key_secrets (
+        key_id INTEGER PRIMARY KEY REFERENCES public_keys (id),
+        wrapped_secret BLOB NOT NULL
+    )
+    """)
+
     # Create benchmarks table
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS benchmarks (
@@ -43,6 +320,73 @@ def init_db():
     )
     """)
 
+    # History and session queries filter by algorithm and time range
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_benchmarks_algorithm_timestamp ON benchmarks (algorithm, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_benchmarks_timestamp ON benchmarks (timestamp)")
+
+    # Create benchmark_rollups table: per minute/hour/day sums, maintained as benchmarks are written
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS benchmark_rollups (
+        granularity TEXT NOT NULL, -- 'minute', 'hour' or 'day'
+        bucket TEXT NOT NULL, -- bucket start, same format as benchmarks.timestamp
+        algorithm TEXT NOT NULL,
+        type TEXT NOT NULL,
+        samples INTEGER NOT NULL,
+        sum_latency REAL NOT NULL,
+        sum_stddev REAL NOT NULL,
+        sum_min_latency REAL NOT NULL,
+        sum_max_latency REAL NOT NULL,
+        sum_throughput REAL NOT NULL,
+        sum_error_rate REAL NOT NULL,
+        sum_encryption_time REAL NOT NULL,
+        min_latency REAL,
+        max_latency REAL,
+        PRIMARY KEY (granularity, algorithm, bucket, type)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("SELECT 1 FROM benchmark_rollups LIMIT 1")
+    if cursor.fetchone() is None:
+        # First start with rollups: build them once from the raw rows already there
+        for granularity, bucket_sql in ROLLUP_BUCKET_SQL.items():
+            cursor.execute(f"""
+                INSERT INTO benchmark_rollups
+                SELECT '{granularity}', {bucket_sql}, algorithm, type, COUNT(*),
+                       TOTAL(latency), TOTAL(stddev), TOTAL(min_latency), TOTAL(max_latency),
+                       TOTAL(throughput), TOTAL(error_rate), TOTAL(encryption_time),
+                       MIN(min_latency), MAX(max_latency)
+                FROM benchmarks
+                WHERE algorithm IS NOT NULL AND type IS NOT NULL AND timestamp IS NOT NULL
+                GROUP BY 2, algorithm, type
+            """)
+
+    # Create bulk_jobs table (background /pushBulk uploads and their last committed batch)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS bulk_jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL, -- 'queued', 'running', 'completed', 'failed' or 'cancelled'
+        filename TEXT,
+        spool_path TEXT,
+        batch_size INTEGER,
+        batches_committed INTEGER DEFAULT 0,
+        rows_total INTEGER DEFAULT 0,
+        rows_success INTEGER DEFAULT 0,
+        rows_fail INTEGER DEFAULT 0,
+        error TEXT,
+        created_at REAL,
+        updated_at REAL,
+        finished_at REAL,
+        owner TEXT, -- process running the job (app/jobs.py OWNER_ID) while lease_until is in the future
+        lease_until REAL,
+        cancel_requested INTEGER DEFAULT 0
+    )
+    """)
+    cursor.execute("PRAGMA table_info(bulk_jobs)")
+    job_columns = {row[1] for row in cursor.fetchall()}
+    if "owner" not in job_columns:
+        cursor.execute("ALTER TABLE bulk_jobs ADD COLUMN owner TEXT")
+        cursor.execute("ALTER TABLE bulk_jobs ADD COLUMN lease_until REAL")
+        cursor.execute("ALTER TABLE bulk_jobs ADD COLUMN cancel_requested INTEGER DEFAULT 0")
+
     # Create users table
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS users (
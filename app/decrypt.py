@@ -0,0 +1,142 @@
+import logging
+import time
+from collections import defaultdict
+from app.benchmarks import record_summary
+from app.codec import decode_record
+from app.crypto import rsa_hybrid_decrypt, rsa_decrypt, pqc_kem_decrypt, envelope_decrypt
+from app.executor import crypto_executor
+from app.keystore import key_cache, load_wrapped_secrets
+from app.metrics import Benchmark, rsa_decrypt_benchmark, pqc_decrypt_benchmark
+from app.storage import fetch_transactions
+
+logger = logging.getLogger("uvicorn")
+
+# Which ciphertext to open: the PQC one, the RSA one, or both (and check they agree)
+DECRYPT_SCHEMES = ("pqc", "rsa", "both")
+
+class MissingKey(Exception):
+    pass
+
+def _needed_key_ids(records, scheme):
+    key_ids = []
+    for record in records:
+        if scheme in ("rsa", "both"):
+            key_ids.append(record["rsa_key_id"])
+        if scheme in ("pqc", "both"):
+            key_ids.append(record["pqc_key_id"])
+    return key_ids
+
+def _key(key_id, keys, secrets):
+    if key_id is None:
+        raise MissingKey("Row predates the key store; no key material to decrypt it")
+    key = keys.get(key_id)
+    if key is None:
+        if key_id not in secrets:
+            raise MissingKey(f"No stored key material for key {key_id}")
+        key = key_cache.load(key_id, *secrets[key_id])
+    return key
+
+def _open_group(records, key_id, keys, secrets, open_one, benchmark, session_benchmark, opened, errors):
+    """Decrypt every record sharing one key: the key is looked up/unwrapped once for the group."""
+    try:
+        key = _key(key_id, keys, secrets)
+    except Exception as e:
+        # Missing or unwrappable key: every row in the group is a failed decryption
+        for record in records:
+            benchmark.record_error()
+            session_benchmark.record_error()
+            errors[record["id"]] = str(e)
+        return
+    for record in records:
+        start = time.time()
+        try:
+            opened[record["id"]] = open_one(record, key)
+        except Exception as e:
+            benchmark.record_error()
+            session_benchmark.record_error()
+            errors[record["id"]] = f"Decryption failed: {str(e) or type(e).__name__}"
+            continue
+        latency = (time.time() - start) * 1000
+        benchmark.record_latency(latency)
+        session_benchmark.record_latency(latency)
+
+def _open_rsa(record, private_key):
+    return rsa_hybrid_decrypt(record["rsa_encrypted_key"], record["rsa_ciphertext"], private_key)
+
+def _open_pqc(record, secret_key):
+    return pqc_kem_decrypt(record["oqs_ciphertext"], secret_key, record["aes_ciphertext"], record["pqc_algorithm"])
+
+def _open_rsa_envelope(envelope, record, private_key):
+    return rsa_decrypt(envelope["rsa_encrypted_key"], private_key)
+
+def _open_pqc_envelope(envelope, record, secret_key):
+    return pqc_kem_decrypt(envelope["oqs_ciphertext"], secret_key, envelope["pqc_wrapped_key"], record["pqc_algorithm"])
+
+def _opener(open_row, open_data_key):
+    """open_row for plain rows; envelope rows unseal their batch data key once per envelope in this call."""
+    data_keys = {}
+
+    def open_one(record, key):
+        envelope = record["envelope"]
+        if envelope is None:
+            return open_row(record, key)
+        data_key = data_keys.get(envelope["id"])
+        if data_key is None:
+            data_key = data_keys[envelope["id"]] = open_data_key(envelope, record, key)
+        return envelope_decrypt(data_key, envelope["batch_uid"], record["envelope_seq"], record["aes_ciphertext"])
+    return open_one
+
+# ✅ Decrypt fetched records grouped by key (runs on the crypto executor)
+def decrypt_batch(records, keys, secrets, scheme):
+    session_bm_rsa = Benchmark()
+    session_bm_pqc = Benchmark()
+    rsa_plain, pqc_plain, errors = {}, {}, {}
+    open_rsa = _opener(_open_rsa, _open_rsa_envelope)
+    open_pqc = _opener(_open_pqc, _open_pqc_envelope)
+
+    if scheme in ("rsa", "both"):
+        groups = defaultdict(list)
+        for record in records:
+            groups[record["rsa_key_id"]].append(record)
+        for key_id, group in groups.items():
+            _open_group(group, key_id, keys, secrets, open_rsa, rsa_decrypt_benchmark, session_bm_rsa, rsa_plain, errors)
+
+    if scheme in ("pqc", "both"):
+        groups = defaultdict(list)
+        for record in records:
+            if record["id"] not in errors:
+                groups[record["pqc_key_id"]].append(record)
+        for key_id, group in groups.items():
+            _open_group(group, key_id, keys, secrets, open_pqc, pqc_decrypt_benchmark, session_bm_pqc, pqc_plain, errors)
+
+    results = []
+    for record in records:
+        row_id = record["id"]
+        if row_id in errors:
+            results.append({"id": row_id, "status": "error", "error": errors[row_id]})
+            continue
+        plaintext = pqc_plain.get(row_id, rsa_plain.get(row_id))
+        if scheme == "both" and rsa_plain[row_id] != pqc_plain[row_id]:
+            results.append({"id": row_id, "status": "error", "error": "RSA and PQC plaintexts differ"})
+            continue
+        results.append({"id": row_id, "status": "ok", "transaction": decode_record(plaintext)})
+
+    for bm, algo in [(session_bm_rsa, "RSA"), (session_bm_pqc, "PQC")]:
+        summary = bm.summary()
+        if summary["count"] or bm.errors:
+            record_summary(summary, type=f"decrypt_session_{algo.lower()}", algorithm=algo, encryption_time=summary["average_latency"])
+    return results
+
+def _fetch_and_decrypt(db, ids, scheme):
+    records = fetch_transactions(db, ids)
+    # Only unwrap keys the cache doesn't already hold
+    keys, missing = key_cache.lookup(_needed_key_ids(records, scheme))
+    secrets = load_wrapped_secrets(db, missing)
+    return records, decrypt_batch(records, keys, secrets, scheme)
+
+async def decrypt_transactions(db, ids, scheme):
+    """Returns (results in id order, ids not found)."""
+    # The row and key reads block on SQLite too, so they run on the executor with the decryption
+    records, results = await crypto_executor.run(_fetch_and_decrypt, db, ids, scheme)
+    found = {record["id"] for record in records}
+    return results, [i for i in ids if i not in found]
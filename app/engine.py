@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from app import config, telemetry
+from app.crypto import (
+    RSA_ALGORITHM, acquire_rsa_keys, rsa_hybrid_encrypt, pqc_kem_encrypt, rsa_key_provider, rsa_private_key_bytes,
+    rsa_encrypt, envelope_encrypt
+)
+from app.codec import storage_value
+from app.kem import KEM_ALGORITHM, encapsulation_keypair
+from app.executor import crypto_executor
+
+logger = logging.getLogger("uvicorn")
+
+_pool = None
+
+# Latest RSA key provider stats reported by each worker process, keyed by pid
+worker_key_stats = {}
+
+# ✅ Encrypt one payload with RSA hybrid + PQC KEM (runs inside a worker process)
+def encrypt_payload(data: bytes, rsa_keys=None):
+    """
+    Returns (status, row, rsa_time, pqc_time, error) where status is
+    "ok", "rsa_failed" or "pqc_failed" and row is the storage.insert_transactions tuple.
+    Pass rsa_keys=(private_key, public_key) to share one RSA key across several payloads.
+    """
+    rsa_time = None
+    pqc_time = None
+
+    # rsa_time includes getting a key: near zero from a warm pool, a full keygen on a miss
+    start_rsa = time.time()
+    try:
+        rsa_private_key, rsa_public_key = rsa_keys or acquire_rsa_keys()
+        rsa_encrypted_key, rsa_ciphertext = rsa_hybrid_encrypt(data, rsa_public_key)
+        rsa_time = (time.time() - start_rsa) * 1000
+    except Exception as e:
+        telemetry.crypto_errors.inc(RSA_ALGORITHM, telemetry.current_endpoint.get())
+        return "rsa_failed", None, rsa_time, pqc_time, str(e)
+
+    start_pqc = time.time()
+    try:
+        pqc_public_key, pqc_secret_key = encapsulation_keypair()
+        _, oqs_ciphertext, aes_ciphertext = pqc_kem_encrypt(data, pqc_public_key)
+        pqc_time = (time.time() - start_pqc) * 1000
+    except Exception as e:
+        telemetry.crypto_errors.inc(KEM_ALGORITHM, telemetry.current_endpoint.get())
+        return "pqc_failed", None, rsa_time, pqc_time, str(e)
+
+    row = (
+        storage_value(data),
+        rsa_public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo),
+        rsa_encrypted_key,
+        rsa_ciphertext,
+        pqc_public_key,
+        oqs_ciphertext,
+        aes_ciphertext,
+        rsa_private_key_bytes(rsa_private_key),
+        pqc_secret_key
+    )
+    return "ok", row, rsa_time, pqc_time, None
+
+# ✅ Envelope mode: encrypt a whole batch under one data key (runs on the crypto executor)
+def encrypt_envelope(payloads):
+    """
+    Returns (header, results). header is the storage.insert_envelope_batch tuple
+    (batch_uid, rsa_public_key, rsa_encrypted_key, pqc_public_key, oqs_ciphertext, pqc_wrapped_key,
+    rsa_private_key, pqc_secret_key), or None if sealing the data key failed.
+    results are encrypt_payload-style (status, row, rsa_time, pqc_time, error) with row =
+    (transaction_json, seq, ciphertext). A row's rsa_time/pqc_time is its share of the batch's
+    RSA wrap / KEM encapsulation plus its own AES-GCM time.
+    """
+    data_key = AESGCM.generate_key(bit_length=256)
+    batch_uid = os.urandom(16)
+    count = max(len(payloads), 1)
+
+    # One RSA-OAEP wrap and one KEM encapsulation seal the data key for the whole batch
+    start_rsa = time.time()
+    try:
+        rsa_private_key, rsa_public_key = acquire_rsa_keys()
+        rsa_encrypted_key = rsa_encrypt(data_key, rsa_public_key)
+        rsa_share = (time.time() - start_rsa) * 1000 / count
+    except Exception as e:
+        telemetry.crypto_errors.inc(RSA_ALGORITHM, telemetry.current_endpoint.get())
+        return None, [("rsa_failed", None, None, None, str(e))] * len(payloads)
+
+    start_pqc = time.time()
+    try:
+        pqc_public_key, pqc_secret_key = encapsulation_keypair()
+        _, oqs_ciphertext, pqc_wrapped_key = pqc_kem_encrypt(data_key, pqc_public_key)
+        pqc_share = (time.time() - start_pqc) * 1000 / count
+    except Exception as e:
+        telemetry.crypto_errors.inc(KEM_ALGORITHM, telemetry.current_endpoint.get())
+        return None, [("pqc_failed", None, rsa_share, None, str(e))] * len(payloads)
+
+    aead = AESGCM(data_key)
+    results = []
+    for seq, data in enumerate(payloads):
+        start = time.time()
+        ciphertext = envelope_encrypt(aead, batch_uid, seq, data)
+        aes_time = (time.time() - start) * 1000
+        results.append(("ok", (storage_value(data), seq, ciphertext), rsa_share + aes_time, pqc_share + aes_time, None))
+
+    header = (
+        batch_uid,
+        rsa_public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo),
+        rsa_encrypted_key,
+        pqc_public_key,
+        oqs_ciphertext,
+        pqc_wrapped_key,
+        rsa_private_key_bytes(rsa_private_key),
+        pqc_secret_key
+    )
+    return header, results
+
+def encrypt_chunk(payloads):
+    results = [encrypt_payload(data) for data in payloads]
+    return os.getpid(), rsa_key_provider.stats(), results
+
+# ✅ Process-pool entry point: also ships the worker's stage timings back to the API process
+def encrypt_chunk_in_worker(payloads, endpoint):
+    token = telemetry.current_endpoint.set(endpoint)
+    try:
+        pid, key_stats, results = encrypt_chunk(payloads)
+    finally:
+        telemetry.current_endpoint.reset(token)
+    return pid, key_stats, results, telemetry.registry.drain()
+
+# ✅ Lazily created process pool shared by all bulk uploads
+def get_pool():
+    global _pool
+    if config.ENCRYPT_WORKERS <= 0:
+        return None
+    if _pool is None:
+        # spawn, not fork: worker processes must not inherit the API's threads and open sqlite handles
+        _pool = ProcessPoolExecutor(
+            max_workers=config.ENCRYPT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"⚙️ Encryption engine started with {config.ENCRYPT_WORKERS} worker processes")
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        worker_key_stats.clear()
+
+def split_chunks(payloads):
+    workers = max(config.ENCRYPT_WORKERS, 1)
+    num_chunks = workers * max(config.ENCRYPT_CHUNKS_PER_WORKER, 1)
+    chunk_size = max(math.ceil(len(payloads) / num_chunks), 1)
+    return [payloads[i:i + chunk_size] for i in range(0, len(payloads), chunk_size)]
+
+# ✅ Encrypt a batch across the worker pool, yielding results in input order
+async def iter_encrypted(payloads):
+    chunks = split_chunks(payloads)
+    pool = get_pool()
+
+    if pool is None:
+        futures = [asyncio.ensure_future(crypto_executor.run(encrypt_chunk, chunk)) for chunk in chunks]
+    else:
+        loop = asyncio.get_running_loop()
+        endpoint = telemetry.current_endpoint.get()
+        futures = [loop.run_in_executor(pool, encrypt_chunk_in_worker, chunk, endpoint) for chunk in chunks]
+    try:
+        for future in futures:
+            if pool is not None:
+                pid, key_stats, results, stage_metrics = await future
+                worker_key_stats[pid] = key_stats
+                telemetry.registry.merge(stage_metrics)
+            else:
+                pid, key_stats, results = await future
+            for result in results:
+                yield result
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM-killed); drop the pool so the next batch gets a fresh one
+        logger.error("❌ Encryption worker pool broke, restarting on next batch")
+        shutdown_pool()
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
@@ -3,6 +3,7 @@ from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi import Request
+from app.database import PoolTimeout
 
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     errors = jsonable_encoder(exc.errors())
@@ -20,3 +21,17 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
             }
         },
     )
+
+async def pool_timeout_exception_handler(request: Request, exc: PoolTimeout):
+    # Every pooled connection is busy: tell the client to back off instead of queueing forever
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": "1"},
+        content={
+            "success": False,
+            "error": {
+                "code": error_codes.DATABASE_CONNECTION_FAILED,
+                "message": str(exc)
+            }
+        },
+    )
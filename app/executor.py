@@ -0,0 +1,76 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app import config
+from app.metrics import Benchmark
+
+class CryptoExecutor:
+    """
+    Fixed-size thread pool for CPU-bound crypto called from async routes.
+    OpenSSL (cryptography) and liboqs release the GIL while they work, so threads
+    run RSA/Kyber/AES in parallel without blocking the event loop.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max(max_workers, 1)
+        self._pool = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.wait_benchmark = Benchmark()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="crypto")
+        return self._pool
+
+    def _wrap(self, fn, args, enqueued_at):
+        # Run in the caller's context, so e.g. telemetry.current_endpoint follows the work
+        context = contextvars.copy_context()
+
+        def task():
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+            self.wait_benchmark.record_latency((time.time() - enqueued_at) * 1000)
+            try:
+                return context.run(fn, *args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+        return task
+
+    # ✅ Run fn(*args) on the crypto pool and await its result
+    async def run(self, fn, *args):
+        with self._lock:
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        future = self._get_pool().submit(self._wrap(fn, args, time.time()))
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        wait = self.wait_benchmark.summary()
+        return {
+            "workers": self.max_workers,
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queue_depth,
+            "running": self.running,
+            "completed": self.completed,
+            "average_wait_ms": wait["average_latency"],
+            "max_wait_ms": wait["max_latency"]
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+# ✅ Global instance shared by all encryption/decryption entry points
+crypto_executor = CryptoExecutor(config.CRYPTO_EXECUTOR_WORKERS)
@@ -0,0 +1,112 @@
+"""
+Fleet-wide benchmarks.
+
+Every process (uvicorn worker, replica) periodically publishes a mergeable snapshot of its
+global RSA/PQC benchmarks to the metrics_snapshots table in METRICS_DB_PATH, keyed by
+instance. /benchmarks/aggregate merges the fresh snapshots into one latency distribution
+per algorithm. Locally:
+
+    uvicorn app.main:app --workers 4
+    curl localhost:8000/benchmarks/aggregate
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from app import config
+from app.database import connect
+from app.metrics import Benchmark, rsa_benchmark, pqc_benchmark, rsa_decrypt_benchmark, pqc_decrypt_benchmark
+
+logger = logging.getLogger("uvicorn")
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def build_snapshot():
+    return {
+        "version": SNAPSHOT_FORMAT_VERSION,
+        "instance": INSTANCE_ID,
+        "published_at": time.time(),
+        "benchmarks": {
+            "RSA": rsa_benchmark.snapshot(),
+            "PQC": pqc_benchmark.snapshot(),
+            "RSA_DECRYPT": rsa_decrypt_benchmark.snapshot(),
+            "PQC_DECRYPT": pqc_decrypt_benchmark.snapshot()
+        }
+    }
+
+def aggregate_snapshots(snapshots):
+    algorithms = []
+    for snapshot in snapshots:
+        algorithms.extend(algo for algo in snapshot["benchmarks"] if algo not in algorithms)
+    return {
+        "instances": [snapshot["instance"] for snapshot in snapshots],
+        **{
+            algo: Benchmark.merge_snapshots([s["benchmarks"][algo] for s in snapshots if algo in s["benchmarks"]])
+            for algo in algorithms
+        }
+    }
+
+class SnapshotStore:
+    """One row per instance in a (possibly shared) SQLite file, replaced on every publish."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = connect(self.db_path)
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS metrics_snapshots (
+                instance TEXT PRIMARY KEY,
+                published_at REAL NOT NULL,
+                snapshot TEXT NOT NULL
+            )
+            """)
+            self._conn.commit()
+        return self._conn
+
+    def publish(self, snapshot):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO metrics_snapshots (instance, published_at, snapshot) VALUES (?, ?, ?)",
+                (snapshot["instance"], snapshot["published_at"], json.dumps(snapshot))
+            )
+            conn.commit()
+
+    # ✅ Snapshots published within max_age seconds; older ones belong to dead processes and are pruned
+    def load(self, max_age):
+        cutoff = time.time() - max_age
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM metrics_snapshots WHERE published_at < ?", (cutoff,))
+            conn.commit()
+            rows = conn.execute("SELECT snapshot FROM metrics_snapshots ORDER BY instance").fetchall()
+        snapshots = [json.loads(row[0]) for row in rows]
+        return [s for s in snapshots if s.get("version") == SNAPSHOT_FORMAT_VERSION]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# ✅ Global store used by the periodic publisher and /benchmarks/aggregate
+snapshot_store = SnapshotStore(config.METRICS_DB_PATH)
+
+def publish_snapshot():
+    try:
+        snapshot_store.publish(build_snapshot())
+    except Exception as e:
+        logger.error(f"❌ Failed to publish metrics snapshot: {e}")
+
+def fleet_benchmarks():
+    # Include this process's latest numbers even if its last publish is a few seconds old
+    publish_snapshot()
+    return aggregate_snapshots(snapshot_store.load(config.METRICS_SNAPSHOT_TTL_SECONDS))
@@ -0,0 +1,169 @@
+import codecs
+import csv
+import json
+import pandas as pd
+from app.models import Transaction
+
+# Bytes read from the upload per parser step
+READ_CHUNK_SIZE = 64 * 1024
+
+# Bytes inspected for `,` vs `;` delimiter sniffing
+SNIFF_SIZE = 1024
+
+# Largest JSON array element buffered while waiting for its end
+MAX_JSON_RECORD_SIZE = 1024 * 1024
+
+# A JSON decode error this close to the end of the buffer may be a number/literal/escape cut in two
+CUT_TOKEN_SIZE = 32
+
+EXPECTED_FIELDS = set(Transaction.__annotations__.keys())
+
+class IngestError(ValueError):
+    pass
+
+def validate_fields(fields, source):
+    if not EXPECTED_FIELDS.issubset(set(fields)):
+        raise IngestError(f"{source} headers do not match Transaction schema")
+
+def sniff_delimiter(sample: str):
+    return ',' if sample.count(',') > sample.count(';') else ';'
+
+# ✅ Open an upload stream and return a generator of record batches.
+# Format detection and header validation run here, before any batch is encrypted.
+def open_record_batches(stream, filename, batch_size):
+    if filename.endswith(".csv"):
+        return open_csv_batches(stream, batch_size)
+    if filename.endswith(".ndjson") or filename.endswith(".jsonl"):
+        return open_json_batches(iter_ndjson(stream), batch_size)
+    if filename.endswith(".json"):
+        if _first_char(stream) == "[":
+            return open_json_batches(iter_json_array(stream), batch_size)
+        return open_json_batches(iter_ndjson(stream), batch_size)
+    raise IngestError("Unsupported file format.")
+
+def iter_list_batches(records, batch_size):
+    for start in range(0, len(records), batch_size):
+        yield records[start:start + batch_size]
+
+def _first_char(stream):
+    sample = stream.read(SNIFF_SIZE).decode(errors="ignore").lstrip("\ufeff \t\r\n")
+    stream.seek(0)
+    return sample[:1]
+
+# ✅ CSV: pandas chunked reader, so only one batch-sized DataFrame is alive at a time
+def open_csv_batches(stream, batch_size):
+    sample = stream.read(SNIFF_SIZE).decode(errors="ignore")
+    delimiter = sniff_delimiter(sample)
+
+    stream.seek(0)
+    header_line = stream.readline().decode(errors="ignore").lstrip("\ufeff")
+    header = next(csv.reader([header_line], delimiter=delimiter), [])
+    validate_fields([field.strip() for field in header], "CSV")
+
+    stream.seek(0)
+    reader = pd.read_csv(stream, delimiter=delimiter, chunksize=batch_size)
+    return _iter_csv_batches(reader)
+
+def _iter_csv_batches(reader):
+    try:
+        # DataFrame chunks go straight to app/validation.py, which works on columns
+        for df in reader:
+            yield df
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise IngestError(f"Malformed CSV: {e}")
+    finally:
+        reader.close()
+
+def open_json_batches(records, batch_size):
+    first = next(records, None)
+    if first is None:
+        return iter(())
+    if not isinstance(first, dict):
+        raise IngestError("JSON records must be objects")
+    validate_fields(first.keys(), "JSON")
+    return _iter_json_batches(first, records, batch_size)
+
+def _iter_json_batches(first, records, batch_size):
+    batch = [first]
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# ✅ NDJSON: one record per line
+def iter_ndjson(stream):
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise IngestError(f"Malformed NDJSON at line {line_no}: {e}")
+
+# ✅ JSON array: incremental element-by-element decoding of `[ {...}, {...} ]`
+def iter_json_array(stream):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        if len(buf) - pos > MAX_JSON_RECORD_SIZE:
+            raise IngestError(f"Malformed JSON array: record larger than {MAX_JSON_RECORD_SIZE} characters")
+        chunk = stream.read(READ_CHUNK_SIZE)
+        try:
+            buf = buf[pos:] + text_decoder.decode(chunk, final=not chunk)
+        except UnicodeDecodeError as e:
+            raise IngestError(f"Malformed JSON array: {e}")
+        pos = 0
+        eof = not chunk
+
+    def next_char():
+        # Skip whitespace; "" at end of input
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n\ufeff":
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos:pos + 1]
+            fill()
+
+    if next_char() != "[":
+        raise IngestError("JSON upload must be an array of records")
+    pos += 1
+    if next_char() == "]":
+        return
+
+    while True:
+        # Exactly one `,` between records: a second one, a trailing one or a missing record is an error
+        if next_char() in ("", ",", "]"):
+            raise IngestError("Malformed JSON array: expected a record")
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+            # A value ending exactly at the buffer edge may continue in the next chunk
+            if end >= len(buf) and not eof:
+                raise json.JSONDecodeError("Incomplete value", buf, end)
+        except json.JSONDecodeError as e:
+            if eof or not _may_be_cut(e):
+                raise IngestError(f"Malformed JSON array: {e.msg}")
+            fill()
+            continue
+        pos = end
+        yield record
+
+        char = next_char()
+        if char == "]":
+            return
+        if char != ",":
+            raise IngestError("Malformed JSON array: expected ',' or ']' after a record")
+        pos += 1
+
+def _may_be_cut(error):
+    """Whether a decode error could be a record cut by the chunk boundary (more input may fix it)."""
+    return error.pos >= len(error.doc) - CUT_TOKEN_SIZE or error.msg.startswith("Unterminated string")
@@ -0,0 +1,326 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import socket
+import time
+import uuid
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from app import config
+from app.bulk import BulkLoad
+from app.database import db_pool, db_writer
+from app.ingest import IngestError, open_record_batches
+from app.profiling import profiler
+
+logger = logging.getLogger("uvicorn")
+
+JOB_ACTIVE_STATUSES = ("queued", "running")
+
+# Written to bulk_jobs.owner for the jobs this process holds the lease on
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Live state of jobs running in this process
+_tasks = {}
+_progress = {}
+_semaphore = None
+
+class JobProgress:
+    """In-memory progress of a running job, used for rate/ETA reporting and cancellation."""
+
+    def __init__(self, bytes_total):
+        self.started_at = time.time()
+        self.bytes_total = bytes_total
+        self.bytes_read = 0
+        self.cancel_requested = False
+        self.load = None
+
+    def report(self):
+        elapsed = time.time() - self.started_at
+        rows = self.load.total_rows if self.load else 0
+        fraction = self.bytes_read / self.bytes_total if self.bytes_total else 0
+        eta = elapsed * (1 - fraction) / fraction if 0 < fraction < 1 else None
+        return {
+            "rows_per_sec": rows / elapsed if elapsed > 0 else 0,
+            "progress": min(fraction, 1.0),
+            "eta_seconds": eta,
+            "recent_errors": list(self.load.errors) if self.load else [],
+            "cancel_requested": self.cancel_requested
+        }
+
+class LeaseLost(Exception):
+    """Another process claimed the job after this one's lease expired."""
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(config.BULK_JOB_CONCURRENCY, 1))
+    return _semaphore
+
+# ✅ Spool uploads to disk so the job survives the request (and a pod restart)
+def spool_upload(src):
+    os.makedirs(config.BULK_JOB_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(config.BULK_JOB_SPOOL_DIR, f"{uuid.uuid4().hex}.upload")
+    with open(path, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    return path
+
+def spool_records(records):
+    os.makedirs(config.BULK_JOB_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(config.BULK_JOB_SPOOL_DIR, f"{uuid.uuid4().hex}.upload")
+    with open(path, "w") as dst:
+        for record in records:
+            dst.write(json.dumps(record) + "\n")
+    return path
+
+# ✅ Run format detection + header validation on a spooled upload before accepting the job
+def check_spooled_upload(path, filename, batch_size):
+    with open(path, "rb") as stream:
+        open_record_batches(stream, filename, batch_size)
+
+def create_job(db, filename, spool_path, batch_size):
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    db.execute("""
+        INSERT INTO bulk_jobs (id, status, filename, spool_path, batch_size, created_at, updated_at, owner, lease_until)
+        VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)
+    """, (job_id, filename, spool_path, batch_size, now, now, OWNER_ID, now + config.BULK_JOB_LEASE_SECONDS))
+    db.commit()
+    return job_id
+
+def get_job(db, job_id):
+    cursor = db.execute("SELECT * FROM bulk_jobs WHERE id = ?", (job_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    columns = [col[0] for col in cursor.description]
+    return dict(zip(columns, row))
+
+def job_status(db, job_id):
+    job = get_job(db, job_id)
+    if job is None:
+        return None
+    job.pop("spool_path", None)
+    job["cancel_requested"] = bool(job["cancel_requested"])
+    progress = _progress.get(job_id)
+    if progress is not None:
+        job.update(progress.report())
+    return job
+
+def list_jobs(db, limit=50):
+    cursor = db.execute("""
+        SELECT id, status, filename, batches_committed, rows_total, rows_success, rows_fail, created_at, updated_at
+        FROM bulk_jobs ORDER BY created_at DESC LIMIT ?
+    """, (limit,))
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def _load_job(job_id):
+    # Pooled connection held for this read only (runs in the threadpool)
+    db = db_pool.acquire()
+    try:
+        return get_job(db, job_id)
+    finally:
+        db_pool.release(db)
+
+# ✅ Take the job's lease if nobody holds a live one; only the process that gets the row runs the job
+def _claim(conn, job_id):
+    now = time.time()
+    cursor = conn.execute("""
+        UPDATE bulk_jobs SET owner = ?, lease_until = ?
+        WHERE id = ? AND status IN ('queued', 'running') AND (owner IS NULL OR lease_until < ?)
+    """, (OWNER_ID, now + config.BULK_JOB_LEASE_SECONDS, job_id, now))
+    return cursor.rowcount == 1
+
+def _renew_lease(conn, job_id):
+    cursor = conn.execute(
+        "UPDATE bulk_jobs SET lease_until = ? WHERE id = ? AND owner = ?",
+        (time.time() + config.BULK_JOB_LEASE_SECONDS, job_id, OWNER_ID)
+    )
+    return cursor.rowcount == 1
+
+def _release_leases(conn):
+    # Clean shutdown: unfinished jobs are free to resume right away instead of after the lease expires
+    conn.execute(
+        "UPDATE bulk_jobs SET owner = NULL, lease_until = NULL WHERE owner = ? AND status IN ('queued', 'running')",
+        (OWNER_ID,)
+    )
+
+def _mark_running(conn, job_id):
+    conn.execute(
+        "UPDATE bulk_jobs SET status = 'running', updated_at = ? WHERE id = ? AND owner = ?",
+        (time.time(), job_id, OWNER_ID)
+    )
+
+def _mark_finished(conn, job_id, status, error=None):
+    now = time.time()
+    # A job cancelled while nobody ran it stays cancelled
+    conn.execute("""
+        UPDATE bulk_jobs SET status = ?, error = ?, updated_at = ?, finished_at = ?, owner = NULL, lease_until = NULL
+        WHERE id = ? AND status NOT IN ('cancelled')
+    """, (status, error, now, now, job_id))
+
+def _finish(db, job_id, status, error=None):
+    _mark_finished(db, job_id, status, error)
+    db.commit()
+
+def _remove_spool(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# ✅ Schedule a job on this process's event loop
+def start_job(job_id):
+    if job_id in _tasks:
+        return
+    _tasks[job_id] = asyncio.get_running_loop().create_task(run_job(job_id))
+
+def cancel_job(db, job_id):
+    job = get_job(db, job_id)
+    if job is None:
+        return None
+    if job["status"] not in JOB_ACTIVE_STATUSES:
+        return job["status"]
+    # The job's owner (possibly another worker/replica) polls this between batches
+    db.execute("UPDATE bulk_jobs SET cancel_requested = 1, updated_at = ? WHERE id = ?", (time.time(), job_id))
+    progress = _progress.get(job_id)
+    if progress is not None:
+        progress.cancel_requested = True
+    if job_id not in _tasks and _claim(db, job_id):
+        # Nobody is running it: this process owns it now, so it finishes it and removes its spool file
+        _finish(db, job_id, "cancelled")
+        _remove_spool(job["spool_path"])
+        return "cancelled"
+    db.commit()
+    return "cancelling"
+
+async def _keep_lease(job_id):
+    while True:
+        await asyncio.sleep(config.BULK_JOB_LEASE_SECONDS / 3)
+        try:
+            renewed = await db_writer.write(_renew_lease, job_id)
+        except Exception as e:
+            logger.error(f"❌ Could not renew the lease on bulk job {job_id}: {e}")
+            continue
+        if not renewed:
+            # The next batch commit notices too and stops the job (see commit_progress)
+            logger.warning(f"⚠️ Lost the lease on bulk job {job_id}")
+            return
+
+async def run_job(job_id):
+    # Renewed from the moment the job is scheduled, including while it waits for the semaphore
+    lease = asyncio.create_task(_keep_lease(job_id))
+    try:
+        await _run_job(job_id)
+    finally:
+        lease.cancel()
+
+async def _run_job(job_id):
+    # No connection is held across the job: reads borrow one in the threadpool, writes go through the DB writer
+    async with _get_semaphore():
+        job = None
+        try:
+            job = await run_in_threadpool(_load_job, job_id)
+            if job is None or job["status"] not in JOB_ACTIVE_STATUSES or job["owner"] != OWNER_ID:
+                return
+
+            progress = _progress[job_id] = JobProgress(os.path.getsize(job["spool_path"]))
+            progress.cancel_requested = bool(job["cancel_requested"])
+            load = progress.load = BulkLoad(batches_done=job["batches_committed"])
+            base_rows, base_success, base_fail = job["rows_total"], job["rows_success"], job["rows_fail"]
+
+            await db_writer.write(_mark_running, job_id)
+
+            def commit_progress(cursor):
+                # Same transaction as the batch insert, so a restart resumes exactly after it
+                # Conditional on still owning the job: raising rolls the batch back with it
+                cursor.execute("""
+                    UPDATE bulk_jobs
+                    SET batches_committed = ?, rows_total = ?, rows_success = ?, rows_fail = ?, updated_at = ?
+                    WHERE id = ? AND owner = ?
+                """, (
+                    load.batches, base_rows + load.total_rows, base_success + load.success,
+                    base_fail + load.fail, time.time(), job_id, OWNER_ID
+                ))
+                if cursor.rowcount != 1:
+                    raise LeaseLost(job_id)
+                cursor.execute("SELECT cancel_requested FROM bulk_jobs WHERE id = ?", (job_id,))
+                if cursor.fetchone()[0]:
+                    progress.cancel_requested = True
+
+            if job["batches_committed"]:
+                logger.info(f"♻️ Resuming bulk job {job_id} after batch {job['batches_committed']}")
+
+            with open(job["spool_path"], "rb") as stream:
+                batches = await run_in_threadpool(open_record_batches, stream, job["filename"], job["batch_size"])
+                skip = job["batches_committed"]
+                async for batch_records in iterate_in_threadpool(profiler.iter_span("parse", batches)):
+                    if skip:
+                        # Committed before the restart: parse past it without re-encrypting
+                        skip -= 1
+                        continue
+                    if progress.cancel_requested:
+                        break
+                    await load.process_batch(batch_records, on_commit=commit_progress)
+                    progress.bytes_read = stream.tell()
+
+            load.record_session_benchmarks()
+            status = "cancelled" if progress.cancel_requested else "completed"
+            await db_writer.write(_mark_finished, job_id, status)
+            _remove_spool(job["spool_path"])
+            logger.info(f"🎯 Bulk job {job_id} {status}. ✅ Success: {load.success}, ❌ Fail: {load.fail}")
+        except asyncio.CancelledError:
+            # Shutdown: leave the job 'running' so resume_jobs() picks it up on next start
+            raise
+        except LeaseLost:
+            # The new owner carries on from the last batch this process committed
+            logger.warning(f"⚠️ Bulk job {job_id} stopped: another process owns it now")
+        except IngestError as e:
+            logger.error(f"❌ Bulk job {job_id} failed: {e}")
+            await db_writer.write(_mark_finished, job_id, "failed", str(e))
+            _remove_spool(job["spool_path"])
+        except Exception as e:
+            logger.exception(f"❌ Bulk job {job_id} failed")
+            await db_writer.write(_mark_finished, job_id, "failed", str(e))
+            _remove_spool(job["spool_path"])
+        finally:
+            _tasks.pop(job_id, None)
+            _progress.pop(job_id, None)
+
+def _claim_orphaned_jobs():
+    db = db_pool.acquire()
+    try:
+        cursor = db.execute("""
+            SELECT id, spool_path FROM bulk_jobs
+            WHERE status IN ('queued', 'running') AND (owner IS NULL OR lease_until < ?)
+            ORDER BY created_at
+        """, (time.time(),))
+        claimed = []
+        for job_id, spool_path in cursor.fetchall():
+            if not _claim(db, job_id):
+                # Another worker/replica got there first
+                continue
+            if not os.path.exists(spool_path):
+                _finish(db, job_id, "failed", "Upload spool file missing, cannot resume")
+                continue
+            db.commit()
+            claimed.append(job_id)
+        return claimed
+    finally:
+        db_pool.release(db)
+
+# ✅ Restart jobs interrupted by a shutdown or crash (here or in a process whose lease ran out)
+async def resume_jobs():
+    for job_id in await run_in_threadpool(_claim_orphaned_jobs):
+        start_job(job_id)
+
+def get_job_task(job_id):
+    return _tasks.get(job_id)
+
+async def stop_jobs():
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await db_writer.write(_release_leases)
@@ -0,0 +1,101 @@
+import threading
+from collections import OrderedDict
+import oqs
+from app import config
+from app.telemetry import stage
+
+# Kyber round-3 names and their FIPS 203 ML-KEM equivalents
+KEM_EQUIVALENTS = {
+    "Kyber512": "ML-KEM-512",
+    "Kyber768": "ML-KEM-768",
+    "Kyber1024": "ML-KEM-1024",
+    "ML-KEM-512": "Kyber512",
+    "ML-KEM-768": "Kyber768",
+    "ML-KEM-1024": "Kyber1024",
+}
+
+# Decapsulation contexts kept per thread (one per recipient secret key)
+MAX_DECAP_CONTEXTS = 8
+
+_local = threading.local()
+_recipient = None
+_recipient_lock = threading.Lock()
+
+# ✅ Resolve a configured parameter set to one this liboqs build supports
+def resolve_kem_algorithm(name):
+    enabled = oqs.get_enabled_kem_mechanisms()
+    if name in enabled:
+        return name
+    equivalent = KEM_EQUIVALENTS.get(name)
+    if equivalent in enabled:
+        return equivalent
+    raise ValueError(f"KEM algorithm {name} is not enabled in this liboqs build")
+
+KEM_ALGORITHM = resolve_kem_algorithm(config.PQC_KEM_ALGORITHM)
+
+if config.PQC_KEY_MODE not in ("recipient", "per_message"):
+    raise ValueError(f"Unknown PQC_KEY_MODE: {config.PQC_KEY_MODE}")
+
+def _contexts():
+    if not hasattr(_local, "encap"):
+        _local.encap = {}
+        _local.decap = OrderedDict()
+    return _local
+
+# ✅ Cached encapsulation context for the calling thread
+def get_encap_kem(algorithm=None):
+    algorithm = algorithm or KEM_ALGORITHM
+    contexts = _contexts().encap
+    kem = contexts.get(algorithm)
+    if kem is None:
+        kem = contexts[algorithm] = oqs.KeyEncapsulation(algorithm)
+    return kem
+
+# ✅ Cached decapsulation context for the calling thread, bounded LRU by secret key
+def get_decap_kem(secret_key, algorithm=None):
+    algorithm = algorithm or KEM_ALGORITHM
+    contexts = _contexts().decap
+    cache_key = (algorithm, bytes(secret_key))
+    kem = contexts.get(cache_key)
+    if kem is not None:
+        contexts.move_to_end(cache_key)
+        return kem
+    kem = contexts[cache_key] = oqs.KeyEncapsulation(algorithm, secret_key=bytes(secret_key))
+    if len(contexts) > MAX_DECAP_CONTEXTS:
+        _, evicted = contexts.popitem(last=False)
+        evicted.free()
+    return kem
+
+class KEMRecipient:
+    """Long-lived KEM keypair that messages are encapsulated to."""
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        with oqs.KeyEncapsulation(algorithm) as kem, stage("kem_keygen", algorithm):
+            self.public_key = kem.generate_keypair()
+            self.secret_key = kem.export_secret_key()
+
+# ✅ Process-wide recipient keypair, generated on first use
+def get_recipient():
+    global _recipient
+    if _recipient is None:
+        with _recipient_lock:
+            if _recipient is None:
+                _recipient = KEMRecipient(KEM_ALGORITHM)
+    return _recipient
+
+def generate_kem_keypair(algorithm=None):
+    algorithm = algorithm or KEM_ALGORITHM
+    with oqs.KeyEncapsulation(algorithm) as kem, stage("kem_keygen", algorithm):
+        public_key = kem.generate_keypair()
+        return public_key, kem.export_secret_key()
+
+# ✅ Keypair to encapsulate the next message to (the secret key is persisted for decryption)
+def encapsulation_keypair():
+    if config.PQC_KEY_MODE == "per_message":
+        return generate_kem_keypair()
+    recipient = get_recipient()
+    return recipient.public_key, recipient.secret_key
+
+def encapsulation_public_key():
+    return encapsulation_keypair()[0]
@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import deque
+from app import config
+
+logger = logging.getLogger("uvicorn")
+
+# Window used to report the refill rate (keys/sec)
+REFILL_RATE_WINDOW_SECONDS = 60
+
+class RSAKeyPool:
+    """Pre-generated keypairs handed out once each, refilled by background threads between watermarks."""
+
+    mode = "pool"
+
+    def __init__(self, generate, low_watermark, high_watermark, workers=1):
+        self.generate = generate
+        self.low_watermark = low_watermark
+        self.high_watermark = max(high_watermark, low_watermark + 1)
+        self.workers = max(workers, 1)
+        self._keys = deque()
+        self._lock = threading.Lock()
+        self._refill = threading.Event()
+        self._threads = []
+        self._generated_at = deque(maxlen=4096)
+        self.generated = 0
+        self.acquired = 0
+        self.misses = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._refill_loop, name=f"rsa-key-refill-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self._refill.set()
+
+    def _refill_loop(self):
+        while True:
+            self._refill.wait()
+            while True:
+                with self._lock:
+                    # Cleared under the lock before the size check: an acquire() that drains the
+                    # pool after this sets the event again instead of being overwritten by a late clear()
+                    self._refill.clear()
+                    if len(self._keys) >= self.high_watermark:
+                        break
+                keypair = self.generate()
+                with self._lock:
+                    self._keys.append(keypair)
+                    self.generated += 1
+                    self._generated_at.append(time.time())
+
+    def acquire(self):
+        if not self._threads:
+            self.start()
+        with self._lock:
+            self.acquired += 1
+            keypair = self._keys.popleft() if self._keys else None
+            depth = len(self._keys)
+            if keypair is None:
+                self.misses += 1
+        if depth < self.low_watermark:
+            self._refill.set()
+        if keypair is None:
+            # Pool drained faster than it refills: fall back to inline keygen
+            keypair = self.generate()
+        return keypair
+
+    def refill_rate(self):
+        cutoff = time.time() - REFILL_RATE_WINDOW_SECONDS
+        with self._lock:
+            recent = sum(1 for t in self._generated_at if t >= cutoff)
+        return recent / REFILL_RATE_WINDOW_SECONDS
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "depth": len(self._keys),
+            "low_watermark": self.low_watermark,
+            "high_watermark": self.high_watermark,
+            "refill_workers": self.workers,
+            "refill_rate": self.refill_rate(),
+            "generated": self.generated,
+            "acquired": self.acquired,
+            "misses": self.misses
+        }
+
+class RotatingRSAKey:
+    """One long-lived recipient keypair, replaced after max_uses encryptions or max_age seconds."""
+
+    mode = "rotating"
+
+    def __init__(self, generate, max_uses, max_age_seconds):
+        self.generate = generate
+        self.max_uses = max_uses
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._keypair = None
+        self._created_at = 0
+        self.uses = 0
+        self.rotations = 0
+        self.acquired = 0
+
+    def _expired(self):
+        if self._keypair is None:
+            return True
+        if self.max_uses > 0 and self.uses >= self.max_uses:
+            return True
+        return self.max_age_seconds > 0 and time.time() - self._created_at >= self.max_age_seconds
+
+    def acquire(self):
+        with self._lock:
+            if self._expired():
+                self._keypair = self.generate()
+                self._created_at = time.time()
+                self.uses = 0
+                self.rotations += 1
+                logger.info(f"🔑 Rotated RSA recipient key (rotation #{self.rotations})")
+            self.uses += 1
+            self.acquired += 1
+            return self._keypair
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "uses": self.uses,
+            "max_uses": self.max_uses,
+            "key_age_seconds": time.time() - self._created_at if self._keypair else 0,
+            "max_age_seconds": self.max_age_seconds,
+            "rotations": self.rotations,
+            "acquired": self.acquired
+        }
+
+# ✅ Build the provider selected by RSA_KEY_MODE
+def build_key_provider(generate):
+    if config.RSA_KEY_MODE == "rotating":
+        return RotatingRSAKey(generate, config.RSA_KEY_MAX_USES, config.RSA_KEY_MAX_AGE_SECONDS)
+    if config.RSA_KEY_MODE != "pool":
+        raise ValueError(f"Unknown RSA_KEY_MODE: {config.RSA_KEY_MODE}")
+    return RSAKeyPool(
+        generate,
+        low_watermark=config.RSA_POOL_LOW_WATERMARK,
+        high_watermark=config.RSA_POOL_HIGH_WATERMARK,
+        workers=config.RSA_POOL_REFILL_WORKERS
+    )
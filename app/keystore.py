@@ -0,0 +1,129 @@
+"""
+Persisted private key material for decryption.
+
+RSA private keys (PKCS#8 DER) and KEM secret keys are stored in key_secrets, one row per
+public_keys row, wrapped with AES-256-GCM under the master key; the public key fingerprint
+is the associated data, so a wrapped secret can't be swapped onto another key.
+KeyCache keeps unwrapped, parsed keys in a bounded LRU for the decryption routes.
+"""
+import base64
+import logging
+import os
+import threading
+from collections import OrderedDict
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.serialization import load_der_private_key
+from app import config
+
+logger = logging.getLogger("uvicorn")
+
+_master_key = None
+_master_key_lock = threading.Lock()
+
+def _load_master_key():
+    if config.KEY_STORE_MASTER_KEY:
+        key = base64.b64decode(config.KEY_STORE_MASTER_KEY)
+    elif os.path.exists(config.KEY_STORE_MASTER_KEY_FILE):
+        with open(config.KEY_STORE_MASTER_KEY_FILE, "rb") as f:
+            key = base64.b64decode(f.read().strip())
+    else:
+        key = AESGCM.generate_key(bit_length=256)
+        # O_EXCL: if another worker won the race, use its key instead
+        try:
+            fd = os.open(config.KEY_STORE_MASTER_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            return _load_master_key()
+        with os.fdopen(fd, "wb") as f:
+            f.write(base64.b64encode(key))
+        logger.warning(f"🔑 Generated key store master key in {config.KEY_STORE_MASTER_KEY_FILE}; set KEY_STORE_MASTER_KEY in production")
+    if len(key) != 32:
+        raise ValueError("Key store master key must be 32 bytes")
+    return key
+
+def _aead():
+    global _master_key
+    if _master_key is None:
+        with _master_key_lock:
+            if _master_key is None:
+                _master_key = AESGCM(_load_master_key())
+    return _master_key
+
+def wrap_secret(fingerprint: bytes, secret: bytes):
+    nonce = os.urandom(12)
+    return nonce + _aead().encrypt(nonce, secret, fingerprint)
+
+def unwrap_secret(fingerprint: bytes, wrapped: bytes):
+    return _aead().decrypt(wrapped[:12], wrapped[12:], fingerprint)
+
+# ✅ Persist the secret for key_id once (caller commits)
+def store_key_secret(cursor, key_id, fingerprint, secret: bytes):
+    cursor.execute(
+        "INSERT OR IGNORE INTO key_secrets (key_id, wrapped_secret) VALUES (?, ?)",
+        (key_id, wrap_secret(fingerprint, secret))
+    )
+
+def load_wrapped_secrets(db, key_ids):
+    """{key_id: (algorithm, fingerprint, wrapped_secret)} for the ids that have a stored secret."""
+    key_ids = [key_id for key_id in set(key_ids) if key_id is not None]
+    if not key_ids:
+        return {}
+    placeholders = ",".join("?" * len(key_ids))
+    cursor = db.execute(f"""
+        SELECT k.id, k.algorithm, k.fingerprint, s.wrapped_secret
+        FROM key_secrets s JOIN public_keys k ON k.id = s.key_id
+        WHERE s.key_id IN ({placeholders})
+    """, key_ids)
+    return {key_id: (algorithm, bytes(fingerprint), bytes(wrapped)) for key_id, algorithm, fingerprint, wrapped in cursor.fetchall()}
+
+class KeyCache:
+    """Bounded LRU of unwrapped keys: RSA private key objects and KEM secret key bytes, by key id."""
+
+    def __init__(self, capacity):
+        self.capacity = max(capacity, 1)
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key_ids):
+        """Returns ({key_id: key} for cached ids, [uncached ids]); the caller keeps the found keys, so later evictions can't lose them."""
+        found = {}
+        missing = []
+        with self._lock:
+            for key_id in set(key_ids):
+                if key_id is None:
+                    continue
+                key = self._keys.get(key_id)
+                if key is None:
+                    self.misses += 1
+                    missing.append(key_id)
+                else:
+                    self._keys.move_to_end(key_id)
+                    self.hits += 1
+                    found[key_id] = key
+        return found, missing
+
+    # ✅ Unwrap and parse a stored secret, then cache it
+    def load(self, key_id, algorithm, fingerprint, wrapped):
+        secret = unwrap_secret(fingerprint, wrapped)
+        key = load_der_private_key(secret, password=None) if algorithm.startswith("RSA") else secret
+        with self._lock:
+            self._keys[key_id] = key
+            self._keys.move_to_end(key_id)
+            while len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+                self.evictions += 1
+        return key
+
+    def stats(self):
+        return {
+            "size": len(self._keys),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+# ✅ Global cache used by the decryption routes
+key_cache = KeyCache(config.DECRYPT_KEY_CACHE_SIZE)
@@ -0,0 +1,271 @@
+"""
+HTTP load generator for /encrypt-transaction/ and /pushBulk.
+
+Open loop (--mode open --rate R): requests are scheduled at a fixed arrival rate whatever
+the server does, and latency is measured from each request's *scheduled* send time, so
+queueing behind a slow server is counted (no coordinated omission).
+Closed loop (--mode closed --concurrency C): C clients each send the next request when the
+previous one returns. With --expected-interval-ms, latencies are also corrected the way
+HdrHistogram does (synthetic samples for the requests a stalled client would have sent).
+
+Only localhost is allowed unless --allow-remote is given. --spawn-server starts its own
+uvicorn on a free port for the run:
+
+    python -m app.loadgen --spawn-server --mode open --rate 200 --duration 30 --output load.json
+"""
+import argparse
+import io
+import json
+import logging
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from app.metrics import Benchmark, LatencyHistogram
+
+logger = logging.getLogger("uvicorn")
+
+RESULTS_FORMAT_VERSION = 1
+
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+CATEGORIES = ["misc_net", "grocery_pos", "entertainment", "gas_transport", "shopping_net", "food_dining"]
+STATES = ["NC", "WA", "ID", "MT", "VA", "PA", "KY"]
+
+# ✅ Synthetic Transaction payload (same fields and types as app.models.Transaction)
+def make_transaction(rng):
+    unix_time = rng.randint(1325376000, 1388534399)
+    return {
+        "trans_date_trans_time": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(unix_time)),
+        "cc_num": str(rng.randint(10 ** 15, 10 ** 16 - 1)),
+        "merchant": f"fraud_Merchant {rng.randint(1, 700)}",
+        "category": rng.choice(CATEGORIES),
+        "amt": round(rng.uniform(1, 2000), 2),
+        "first": rng.choice(["Jennifer", "Stephanie", "Edward", "Jeremy", "Tyler"]),
+        "last": rng.choice(["Banks", "Gill", "Sanchez", "White", "Garcia"]),
+        "gender": rng.choice(["F", "M"]),
+        "street": f"{rng.randint(1, 9999)} Perry Cove",
+        "city": "Moravian Falls",
+        "state": rng.choice(STATES),
+        "zip": rng.randint(10000, 99999),
+        "lat": round(rng.uniform(25, 48), 4),
+        "long": round(rng.uniform(-124, -67), 4),
+        "city_pop": rng.randint(100, 2000000),
+        "job": "Psychologist, counselling",
+        "dob": f"{rng.randint(1930, 2000)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+        "trans_num": "%032x" % rng.getrandbits(128),
+        "unix_time": unix_time,
+        "merch_lat": round(rng.uniform(25, 48), 6),
+        "merch_long": round(rng.uniform(-124, -67), 6),
+        "is_fraud": int(rng.random() < 0.01)
+    }
+
+class Target:
+    """Builds and sends one request for the chosen endpoint on a per-thread session."""
+
+    def __init__(self, base_url, endpoint, bulk_rows, seed):
+        self.base_url = base_url.rstrip("/")
+        self.endpoint = endpoint
+        self.bulk_rows = bulk_rows
+        self._seed = seed
+        self._local = threading.local()
+
+    def _state(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+            self._local.rng = random.Random(f"{self._seed}-{threading.get_ident()}")
+        return self._local
+
+    def send(self):
+        state = self._state()
+        if self.endpoint == "encrypt":
+            response = state.session.post(f"{self.base_url}/encrypt-transaction/", json=make_transaction(state.rng))
+        else:
+            body = "\n".join(json.dumps(make_transaction(state.rng)) for _ in range(self.bulk_rows)).encode()
+            response = state.session.post(
+                f"{self.base_url}/pushBulk",
+                files={"file": ("load.ndjson", io.BytesIO(body), "application/x-ndjson")}
+            )
+        # /pushBulk reports ingest failures as 200 + {"error": ...}
+        return response.status_code == 200 and "error" not in response.json()
+
+class Recorder:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.corrected = LatencyHistogram()
+        self.errors = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def record(self, service_ms, corrected_ms, ok, expected_interval_ms=None):
+        with self._lock:
+            self.completed += 1
+            if not ok:
+                self.errors += 1
+            self.latency.record(service_ms)
+            self.corrected.record(corrected_ms)
+            if expected_interval_ms:
+                # HdrHistogram recordValueWithExpectedInterval: back-fill the requests a
+                # stalled closed-loop client never sent
+                missed = corrected_ms - expected_interval_ms
+                while missed >= expected_interval_ms:
+                    self.corrected.record(missed)
+                    missed -= expected_interval_ms
+
+# latency: from the actual send; corrected: from the intended send (open loop) plus back-fill (closed loop)
+def _timed_send(target, recorder, intended_start, expected_interval_ms=None):
+    sent_at = time.perf_counter()
+    try:
+        ok = target.send()
+    except requests.RequestException:
+        ok = False
+    done = time.perf_counter()
+    recorder.record((done - sent_at) * 1000, (done - intended_start) * 1000, ok, expected_interval_ms)
+
+def run_open_loop(target, rate, duration, max_in_flight):
+    recorder = Recorder()
+    interval = 1 / rate
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        started = time.perf_counter()
+        sent = 0
+        while True:
+            scheduled = started + sent * interval
+            if scheduled - started >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # Latency counts from `scheduled`: time spent waiting for a free client thread is the server's fault
+            pool.submit(_timed_send, target, recorder, scheduled)
+            sent += 1
+    return recorder, time.perf_counter() - started, sent
+
+def run_closed_loop(target, concurrency, duration, expected_interval_ms):
+    recorder = Recorder()
+    started = time.perf_counter()
+    deadline = started + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            _timed_send(target, recorder, time.perf_counter(), expected_interval_ms)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started, recorder.completed
+
+def latency_report(histogram):
+    percentiles = histogram.percentiles([q for _, q in Benchmark.PERCENTILES])
+    return {
+        "count": histogram.count,
+        "mean_ms": histogram.mean(),
+        **{name.replace("_latency", "_ms"): value for (name, _), value in zip(Benchmark.PERCENTILES, percentiles)},
+        "max_ms": histogram.max if histogram.count else 0
+    }
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# ✅ Local uvicorn for the run, on a free port; returns (process, base_url)
+def spawn_server(workers, startup_timeout=60):
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"]
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+        try:
+            requests.get(f"{base_url}/", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("uvicorn did not start in time")
+
+def fetch_server_snapshot(base_url):
+    snapshot = {}
+    for name in ("live", "rolling"):
+        try:
+            snapshot[name] = requests.get(f"{base_url}/benchmarks/{name}", timeout=10).json()
+        except (requests.RequestException, ValueError) as e:
+            snapshot[name] = {"error": str(e)}
+    return snapshot
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the local API with synthetic transactions")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of a running local API")
+    parser.add_argument("--spawn-server", action="store_true", help="Start a local uvicorn on a free port for the run")
+    parser.add_argument("--server-workers", type=int, default=1, help="uvicorn --workers for --spawn-server")
+    parser.add_argument("--allow-remote", action="store_true", help="Allow a non-localhost --url")
+    parser.add_argument("--endpoint", choices=["encrypt", "bulk"], default="encrypt")
+    parser.add_argument("--bulk-rows", type=int, default=1000, help="Rows per /pushBulk request")
+    parser.add_argument("--mode", choices=["open", "closed"], default="open")
+    parser.add_argument("--rate", type=float, default=50, help="Open loop: requests per second")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open loop: client threads")
+    parser.add_argument("--concurrency", type=int, default=8, help="Closed loop: concurrent clients")
+    parser.add_argument("--expected-interval-ms", type=float, help="Closed loop: interval for coordinated-omission correction")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for synthetic transactions")
+    parser.add_argument("--output", help="Write client results and the server snapshot as JSON to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    process = None
+    base_url = args.url
+    if args.spawn_server:
+        process, base_url = spawn_server(args.server_workers)
+        logger.info(f"⚙️ Started uvicorn at {base_url}")
+    elif urlparse(base_url).hostname not in LOCAL_HOSTS and not args.allow_remote:
+        parser.error("refusing to load a non-local URL without --allow-remote")
+
+    try:
+        target = Target(base_url, args.endpoint, args.bulk_rows, args.seed)
+        logger.info(f"🚀 {args.mode}-loop load on {args.endpoint} for {args.duration}s")
+        if args.mode == "open":
+            recorder, elapsed, sent = run_open_loop(target, args.rate, args.duration, args.max_in_flight)
+        else:
+            recorder, elapsed, sent = run_closed_loop(target, args.concurrency, args.duration, args.expected_interval_ms)
+        server = fetch_server_snapshot(base_url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    rows_per_request = args.bulk_rows if args.endpoint == "bulk" else 1
+    client = {
+        "requests": sent,
+        "completed": recorder.completed,
+        "errors": recorder.errors,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": recorder.completed / elapsed if elapsed else 0,
+        "throughput_rows_per_sec": recorder.completed * rows_per_request / elapsed if elapsed else 0,
+        "latency": latency_report(recorder.latency),
+        "corrected_latency": latency_report(recorder.corrected)
+    }
+
+    print(json.dumps({"client": client}, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "version": RESULTS_FORMAT_VERSION,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "config": {key: value for key, value in vars(args).items() if key != "output"},
+                "client": client,
+                "server": server
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
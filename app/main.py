@@ -6,11 +6,21 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi_utils.tasks import repeat_every
 from app.metrics import rsa_benchmark, pqc_benchmark
-from app.database import get_db
-from app.benchmarks import record_benchmark
+from app.database import db_writer
+from app.benchmarks import record_summary, benchmark_sink, compact_benchmarks
+from app.benchmarks import router as benchmarks_router
 from app.routes import router
 from app.database import init_db
-from app.exceptions import validation_exception_handler
+from app.exceptions import validation_exception_handler, pool_timeout_exception_handler
+from app.database import PoolTimeout
+from app.engine import shutdown_pool
+from app.executor import crypto_executor
+from app.coalescer import encryption_coalescer
+from app.jobs import resume_jobs, stop_jobs
+from app.fleet import publish_snapshot, snapshot_store
+from app.telemetry import RequestMetricsMiddleware
+from app.storage import transaction_store
+from app import config
 
 # ✅ Initialize DB tables at app startup
 init_db()
@@ -22,6 +32,9 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# ✅ Request timing for /metrics; also tags crypto/DB work with the endpoint that caused it
+app.add_middleware(RequestMetricsMiddleware)
+
 # ✅ Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -30,6 +43,7 @@ templates = Jinja2Templates(directory="app/templates")
 
 # ✅ Include API routes
 app.include_router(router)
+app.include_router(benchmarks_router)
 
 # ✅ Root health check route
 @app.get("/")
@@ -38,41 +52,62 @@ async def root():
 
 # ✅ Global exception handler for validation errors with precise error messages
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
+app.add_exception_handler(PoolTimeout, pool_timeout_exception_handler)
 
 @app.on_event("startup")
 @repeat_every(seconds=3600)  # every hour
 def persist_global_benchmarks() -> None:
     print("[Periodic Task] Persisting global benchmarks to DB...")
-    db = next(get_db())
-
-    # Persist RSA
-    rsa_summary = rsa_benchmark.summary()
-    record_benchmark(
-        db,
-        type="persisted_rsa",
-        latency=rsa_summary["average_latency"],
-        stddev=rsa_summary["stddev_latency"],
-        min_latency=rsa_summary["min_latency"],
-        max_latency=rsa_summary["max_latency"],
-        throughput=rsa_summary["throughput"],
-        error_rate=rsa_summary["error_rate"],
-        encryption_time=0,  # Adjust if you measure it here
-        algorithm="RSA"
-    )
-
-    # Persist PQC
-    pqc_summary = pqc_benchmark.summary()
-    record_benchmark(
-        db,
-        type="persisted_pqc",
-        latency=pqc_summary["average_latency"],
-        stddev=pqc_summary["stddev_latency"],
-        min_latency=pqc_summary["min_latency"],
-        max_latency=pqc_summary["max_latency"],
-        throughput=pqc_summary["throughput"],
-        error_rate=pqc_summary["error_rate"],
-        encryption_time=0,
-        algorithm="PQC"
-    )
-
-    print("[Periodic Task] Global benchmarks persisted successfully.")
\ No newline at end of file
+
+    # Queued on the benchmark sink like every other benchmark row
+    record_summary(rsa_benchmark.summary(), type="persisted_rsa", algorithm="RSA", encryption_time=0)
+    record_summary(pqc_benchmark.summary(), type="persisted_pqc", algorithm="PQC", encryption_time=0)
+
+    print("[Periodic Task] Global benchmarks persisted successfully.")
+
+@app.on_event("startup")
+@repeat_every(seconds=config.METRICS_PUBLISH_INTERVAL_SECONDS)
+def publish_metrics_snapshot() -> None:
+    # Lets /benchmarks/aggregate on any worker/replica see this process's benchmarks
+    publish_snapshot()
+
+@app.on_event("startup")
+@repeat_every(seconds=config.BENCHMARK_COMPACT_INTERVAL_SECONDS)
+def compact_old_benchmarks() -> None:
+    # Rollups keep the history; raw rows only need to cover recent sessions
+    deleted = compact_benchmarks()
+    if deleted:
+        print(f"[Periodic Task] Compacted {deleted} expired benchmark rows.")
+
+@app.on_event("startup")
+@repeat_every(seconds=config.SEGMENT_COMPACT_INTERVAL_SECONDS)
+def compact_segments() -> None:
+    # Segment backend only: truncates torn tails left by crashed writers, then rewrites sparse/small segments
+    reclaimed = transaction_store.compact()
+    if reclaimed:
+        print(f"[Periodic Task] Reclaimed {reclaimed} bytes of segment storage.")
+
+@app.on_event("startup")
+@repeat_every(seconds=config.BULK_JOB_LEASE_SECONDS)
+async def resume_bulk_jobs() -> None:
+    # Also picks up jobs whose owner (another worker/replica) died and stopped renewing its lease
+    await resume_jobs()
+
+@app.on_event("shutdown")
+async def stop_bulk_jobs() -> None:
+    await stop_jobs()
+
+@app.on_event("shutdown")
+async def drain_coalescer() -> None:
+    await encryption_coalescer.drain()
+
+@app.on_event("shutdown")
+def stop_encryption_engine() -> None:
+    shutdown_pool()
+    crypto_executor.shutdown()
+    # Flush buffered benchmarks while the DB writer is still running
+    benchmark_sink.stop()
+    db_writer.stop()
+    transaction_store.stop()
+    publish_snapshot()
+    snapshot_store.close()
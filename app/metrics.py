@@ -1,42 +1,309 @@
+import math
+import threading
 import time
-import statistics
+from app import config
+
+class LatencyHistogram:
+    """
+    Fixed-size log-bucketed latency histogram (HDR-style).
+
+    Buckets grow geometrically by PRECISION, so any reported percentile is within ~1% of
+    the true value, from MIN_VALUE up to MAX_VALUE milliseconds. Memory is bounded
+    whatever the traffic, recording is O(1), and two histograms merge by adding counts.
+    Counts are kept sparse ({bucket index: count}): latencies cluster in a few dozen of the
+    BUCKETS, so creating, merging, resetting and reading percentiles only touch those.
+    """
+
+    MIN_VALUE = 0.001           # 1 µs, in ms
+    MAX_VALUE = 3_600_000.0     # 1 hour, in ms
+    PRECISION = 0.01
+    _LOG_BASE = math.log1p(PRECISION)
+    BUCKETS = int(math.log(MAX_VALUE / MIN_VALUE) / _LOG_BASE) + 2
 
-class Benchmark:
     def __init__(self):
-        self.latencies = []
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @classmethod
+    def bucket_index(cls, value):
+        if value <= cls.MIN_VALUE:
+            return 0
+        return min(int(math.log(value / cls.MIN_VALUE) / cls._LOG_BASE) + 1, cls.BUCKETS - 1)
+
+    @classmethod
+    def bucket_value(cls, index):
+        # Geometric midpoint of the bucket
+        if index == 0:
+            return cls.MIN_VALUE
+        return cls.MIN_VALUE * math.exp((index - 0.5) * cls._LOG_BASE)
+
+    def record(self, value):
+        index = self.bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        counts = self.counts
+        for index, n in other.counts.items():
+            counts[index] = counts.get(index, 0) + n
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentiles(self, quantiles):
+        """Values at each quantile (0..1), clamped to the exact min/max seen."""
+        if not self.count:
+            return [0 for _ in quantiles]
+        targets = sorted((max(math.ceil(q * self.count), 1), i) for i, q in enumerate(quantiles))
+        results = [0] * len(quantiles)
+        seen = 0
+        t = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while t < len(targets) and targets[t][0] <= seen:
+                results[targets[t][1]] = min(max(self.bucket_value(index), self.min), self.max)
+                t += 1
+            if t == len(targets):
+                break
+        return results
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def stddev(self):
+        # Sample standard deviation, as statistics.stdev
+        if self.count < 2:
+            return 0
+        variance = (self.total_sq - self.total * self.total / self.count) / (self.count - 1)
+        return math.sqrt(variance) if variance > 0 else 0
+
+    # ✅ Sparse, JSON-friendly form: only non-empty buckets are kept
+    def to_dict(self):
+        return {
+            "buckets": [[index, self.counts[index]] for index in sorted(self.counts)],
+            "count": self.count,
+            "total": self.total,
+            "total_sq": self.total_sq,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        for index, n in data["buckets"]:
+            histogram.counts[index] = histogram.counts.get(index, 0) + n
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.total_sq = data["total_sq"]
+        if histogram.count:
+            histogram.min = data["min"]
+            histogram.max = data["max"]
+        return histogram
+
+    def reset(self):
+        # In place: ring slots are reused, never reallocated
+        self.counts.clear()
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+def window_label(seconds):
+    return f"{seconds // 60}m" if seconds % 60 == 0 else f"{seconds}s"
+
+class RollingWindow:
+    """
+    Latencies and errors over the last `seconds`, as a ring of `slots` time buckets.
+    Each slot holds a preallocated histogram that is cleared in place when the ring
+    wraps onto it, so recording never allocates; expiry is accurate to one slot.
+    """
+
+    def __init__(self, seconds, slots):
+        self.seconds = seconds
+        self.slots = max(slots, 1)
+        self.slot_width = seconds / self.slots
+        self.histograms = [LatencyHistogram() for _ in range(self.slots)]
+        self.errors = [0] * self.slots
+        self.epochs = [-1] * self.slots
+        self._merged = LatencyHistogram()
+
+    def _slot(self, now):
+        epoch = int(now // self.slot_width)
+        index = epoch % self.slots
+        if self.epochs[index] != epoch:
+            self.histograms[index].reset()
+            self.errors[index] = 0
+            self.epochs[index] = epoch
+        return index
+
+    def record(self, value, now):
+        self.histograms[self._slot(now)].record(value)
+
+    def record_error(self, now):
+        self.errors[self._slot(now)] += 1
+
+    def summary(self, now, started_at, quantiles):
+        oldest = int(now // self.slot_width) - self.slots + 1
+        merged = self._merged
+        merged.reset()
+        errors = 0
+        for index in range(self.slots):
+            if self.epochs[index] >= oldest:
+                merged.merge(self.histograms[index])
+                errors += self.errors[index]
+        # Time the merged slots actually cover: from the oldest slot's start (the ring holds up to
+        # one slot less than `seconds`) or from when recording started, if that is later
+        elapsed = now - max(oldest * self.slot_width, started_at)
+        count = merged.count
+        return merged, errors, count / elapsed if elapsed > 0 else 0
+
+class Benchmark:
+    PERCENTILES = (("p50_latency", 0.5), ("p90_latency", 0.9), ("p99_latency", 0.99), ("p999_latency", 0.999))
+
+    def __init__(self, windows=()):
+        self.histogram = LatencyHistogram()
         self.errors = 0
         self.start_time = time.time()
-    
+        self._lock = threading.Lock()
+        # Opt-in: only the long-lived global benchmarks need rolling windows
+        self.windows = [RollingWindow(seconds, config.ROLLING_SLOTS) for seconds in windows]
+
     def record_latency(self, latency):
-        self.latencies.append(latency)
-    
+        with self._lock:
+            self.histogram.record(latency)
+            if self.windows:
+                now = time.time()
+                for window in self.windows:
+                    window.record(latency, now)
+
     def record_error(self):
-        self.errors += 1
-    
+        with self._lock:
+            self.errors += 1
+            if self.windows:
+                now = time.time()
+                for window in self.windows:
+                    window.record_error(now)
+
+    # ✅ Fold another benchmark in (e.g. per-worker or per-session counters)
+    def merge(self, other):
+        with self._lock:
+            self.histogram.merge(other.histogram)
+            self.errors += other.errors
+            self.start_time = min(self.start_time, other.start_time)
+
     def summary(self):
-        total_time = time.time() - self.start_time
-        count = len(self.latencies)
-        throughput = count / total_time if total_time > 0 else 0
-        avg = statistics.mean(self.latencies) if count else 0
-        stddev = statistics.stdev(self.latencies) if count > 1 else 0
-        min_l = min(self.latencies) if count else 0
-        max_l = max(self.latencies) if count else 0
-        error_rate = (self.errors / (count + self.errors)) * 100 if (count + self.errors) else 0
+        with self._lock:
+            histogram = self.histogram
+            total_time = time.time() - self.start_time
+            count = histogram.count
+            throughput = count / total_time if total_time > 0 else 0
+            percentiles = histogram.percentiles([q for _, q in self.PERCENTILES])
+            return self._summary(histogram, count, throughput, self.errors, percentiles)
 
-        return {
-            "average_latency": avg,
-            "stddev_latency": stddev,
-            "min_latency": min_l,
-            "max_latency": max_l,
+    @classmethod
+    def _summary(cls, histogram, count, throughput, errors, percentiles):
+        summary = {
+            "average_latency": histogram.mean(),
+            "stddev_latency": histogram.stddev(),
+            "min_latency": histogram.min if count else 0,
+            "max_latency": histogram.max if count else 0,
             "throughput": throughput,
-            "error_rate": error_rate
+            "error_rate": (errors / (count + errors)) * 100 if (count + errors) else 0
         }
+        summary.update(zip([name for name, _ in cls.PERCENTILES], percentiles))
+        summary["count"] = count
+        return summary
+
+    # ✅ Same keys as summary(), over the last 1/5/60 minutes (or whatever windows are configured)
+    def rolling_summary(self):
+        quantiles = [q for _, q in self.PERCENTILES]
+        results = {}
+        with self._lock:
+            now = time.time()
+            for window in self.windows:
+                histogram, errors, throughput = window.summary(now, self.start_time, quantiles)
+                results[window_label(window.seconds)] = self._summary(
+                    histogram, histogram.count, throughput, errors, histogram.percentiles(quantiles)
+                )
+        return results
+
+    # ✅ Mergeable snapshot: lifetime histogram plus each rolling window's merged histogram
+    def snapshot(self):
+        quantiles = [q for _, q in self.PERCENTILES]
+        with self._lock:
+            now = time.time()
+            windows = {}
+            for window in self.windows:
+                histogram, errors, throughput = window.summary(now, self.start_time, quantiles)
+                windows[window_label(window.seconds)] = {
+                    "histogram": histogram.to_dict(),
+                    "errors": errors,
+                    "throughput": throughput
+                }
+            return {
+                "histogram": self.histogram.to_dict(),
+                "errors": self.errors,
+                "start_time": self.start_time,
+                "throughput": self.histogram.count / (now - self.start_time) if now > self.start_time else 0,
+                "windows": windows
+            }
+
+    # ✅ Fleet-wide summary of several snapshots; throughput is the sum over processes
+    @classmethod
+    def merge_snapshots(cls, snapshots):
+        quantiles = [q for _, q in cls.PERCENTILES]
+
+        def merged_summary(parts):
+            histogram = LatencyHistogram()
+            errors = 0
+            throughput = 0
+            for part in parts:
+                histogram.merge(LatencyHistogram.from_dict(part["histogram"]))
+                errors += part["errors"]
+                throughput += part["throughput"]
+            return cls._summary(histogram, histogram.count, throughput, errors, histogram.percentiles(quantiles))
+
+        summary = merged_summary(snapshots)
+        labels = []
+        for snapshot in snapshots:
+            labels.extend(label for label in snapshot["windows"] if label not in labels)
+        summary["windows"] = {
+            label: merged_summary([s["windows"][label] for s in snapshots if label in s["windows"]])
+            for label in labels
+        }
+        return summary
+
+    def clear(self):
+        """Drop the samples but keep start_time, so throughput is still measured from creation."""
+        with self._lock:
+            self.histogram.reset()
+            self.errors = 0
 
-def reset(self):
-    self.latencies.clear()
-    self.errors = 0
-    self.start_time = time.time()
+    def reset(self):
+        with self._lock:
+            self.histogram.reset()
+            self.errors = 0
+            self.start_time = time.time()
+            for window in self.windows:
+                for index in range(window.slots):
+                    window.epochs[index] = -1
 
 # ✅ Global instances
-rsa_benchmark = Benchmark()
-pqc_benchmark = Benchmark()
+rsa_benchmark = Benchmark(windows=config.ROLLING_WINDOWS_SECONDS)
+pqc_benchmark = Benchmark(windows=config.ROLLING_WINDOWS_SECONDS)
+rsa_decrypt_benchmark = Benchmark(windows=config.ROLLING_WINDOWS_SECONDS)
+pqc_decrypt_benchmark = Benchmark(windows=config.ROLLING_WINDOWS_SECONDS)
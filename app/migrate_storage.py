@@ -0,0 +1,105 @@
+"""
+Online migration of secure_transactions rows from storage format v1 (hex TEXT) to v2 (BLOB + public_keys).
+
+Moves rows in small chunks, each in its own short write transaction, so the API keeps serving
+reads and writes meanwhile; the storage read path finds every id in whichever table it is in.
+Safe to interrupt and re-run.
+
+    python -m app.migrate_storage --db creditcard.db --chunk-size 2000
+"""
+import argparse
+import logging
+import sqlite3
+import time
+from app import config
+from app.database import init_db
+from app.storage import resolve_key_id
+
+logger = logging.getLogger("uvicorn")
+
+# Legacy rows were always encrypted with Kyber512
+LEGACY_KEM_ALGORITHM = "Kyber512"
+
+def migrate_chunk(conn, chunk_size):
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute("""
+            SELECT id, transaction_json, rsa_encrypted_key, rsa_ciphertext, pqc_public_key, oqs_ciphertext, aes_ciphertext
+            FROM secure_transactions ORDER BY id LIMIT ?
+        """, (chunk_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+
+        key_ids = {}
+        insert_data = []
+        for row_id, transaction_json, rsa_encrypted_key, rsa_ciphertext, pqc_public_key, oqs_ciphertext, aes_ciphertext in rows:
+            insert_data.append((
+                row_id,
+                transaction_json,
+                None,  # v1 never stored the RSA public key
+                bytes.fromhex(rsa_encrypted_key),
+                bytes.fromhex(rsa_ciphertext),
+                resolve_key_id(cursor, LEGACY_KEM_ALGORITHM, bytes.fromhex(pqc_public_key), key_ids),
+                bytes.fromhex(oqs_ciphertext),
+                bytes.fromhex(aes_ciphertext)
+            ))
+
+        cursor.executemany("""
+            INSERT INTO secure_transactions_v2
+            (id, transaction_json, rsa_key_id, rsa_encrypted_key, rsa_ciphertext, pqc_key_id, oqs_ciphertext, aes_ciphertext)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, insert_data)
+        cursor.executemany("DELETE FROM secure_transactions WHERE id = ?", [(row[0],) for row in rows])
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+
+def migrate(db_path, chunk_size=2000, pause_seconds=0.0, vacuum=False):
+    init_db(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM secure_transactions")
+        remaining = cursor.fetchone()[0]
+        logger.info(f"🔄 Migrating {remaining} legacy rows to storage format v2...")
+
+        migrated = 0
+        started = time.time()
+        while True:
+            moved = migrate_chunk(conn, chunk_size)
+            if not moved:
+                break
+            migrated += moved
+            logger.info(f"✅ Migrated {migrated}/{remaining} rows ({migrated / (time.time() - started):.0f} rows/sec)")
+            if pause_seconds:
+                # Yield the write lock to the API between chunks
+                time.sleep(pause_seconds)
+
+        if vacuum:
+            # Reclaims the freed pages; takes an exclusive lock, so run it off-peak
+            logger.info("🧹 Vacuuming database...")
+            cursor.execute("VACUUM")
+
+        logger.info(f"🎯 Migration complete: {migrated} rows moved.")
+        return migrated
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate secure_transactions to storage format v2")
+    parser.add_argument("--db", default=config.DB_PATH, help="SQLite database file")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Rows moved per write transaction")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between chunks")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM after migrating to shrink the file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    migrate(args.db, args.chunk_size, args.pause, args.vacuum)
+
+if __name__ == "__main__":
+    main()
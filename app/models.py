@@ -1,3 +1,4 @@
+from typing import List
 from pydantic import BaseModel
 
 class Transaction(BaseModel):
@@ -30,4 +31,7 @@ class UserRegister(BaseModel):
 
 class UserLogin(BaseModel):
     username: str
-    password: str
\ No newline at end of file
+    password: str
+class DecryptRequest(BaseModel):
+    ids: List[int]
+    scheme: str = "pqc"
@@ -0,0 +1,182 @@
+"""
+On-demand profiling for a running API process.
+
+A session samples every thread's Python stack at PROFILING_SAMPLE_INTERVAL_MS and returns
+them as collapsed stacks ("thread;module:function;... count" lines, the input format of
+flamegraph.pl and speedscope), plus a per-span timing breakdown:
+
+    parse, validate,  spans recorded by the code paths below while a session is active
+    serialize
+    keygen, encrypt   from the telemetry crypto stage histograms (includes process-pool workers)
+    insert, commit    from the telemetry DB writer histograms
+
+Outside a session span() returns a shared no-op context manager and nothing is sampled,
+so the cost of the instrumentation is one attribute check per call.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from app import config, telemetry
+
+# Leaf frames of threads that are parked, not working; left out unless include_idle
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+
+# Telemetry crypto stages folded into the keygen / encrypt spans
+KEYGEN_STAGES = ("rsa_keygen", "kem_keygen")
+ENCRYPT_STAGES = ("rsa_oaep_wrap", "aes_gcm", "kem_encap", "sha256_kdf")
+
+_NULL_SPAN = nullcontext()
+
+class ProfileBusy(RuntimeError):
+    pass
+
+class Profiler:
+    def __init__(self):
+        self.active = False
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._stacks = Counter()
+        self._samples = 0
+        self._stop = threading.Event()
+        self._sampler = None
+
+    # ✅ Time a block under `name` while a session runs
+    def span(self, name):
+        if not self.active:
+            return _NULL_SPAN
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                span = self._spans.setdefault(name, [0, 0.0])
+                span[0] += 1
+                span[1] += elapsed
+
+    def iter_span(self, name, iterator):
+        """Yield from iterator, timing each next() under `name` (e.g. parsing the next batch)."""
+        iterator = iter(iterator)
+        while True:
+            with self.span(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def start(self, include_idle=False):
+        with self._lock:
+            if self.active:
+                raise ProfileBusy("A profiling session is already running")
+            self._spans = {}
+            self._stacks = Counter()
+            self._samples = 0
+            self._stop.clear()
+            self._baseline = _stage_totals()
+            self._started_at = time.perf_counter()
+            self.active = True
+        self._sampler = threading.Thread(target=self._sample_loop, args=(include_idle,), name="profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self._sampler = None
+        with self._lock:
+            self.active = False
+            duration = time.perf_counter() - self._started_at
+            spans = {name: {"count": count, "total_ms": total * 1000} for name, (count, total) in self._spans.items()}
+            stacks = self._stacks
+        spans.update(_stage_spans(self._baseline, _stage_totals()))
+        return {
+            "duration_seconds": duration,
+            "samples": self._samples,
+            "sample_interval_ms": config.PROFILING_SAMPLE_INTERVAL_MS,
+            "spans": spans,
+            "folded": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        }
+
+    def _sample_loop(self, include_idle):
+        interval = config.PROFILING_SAMPLE_INTERVAL_MS / 1000
+        own = threading.get_ident()
+        while not self._stop.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = Counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                if not include_idle and leaf in IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                sampled[";".join(reversed(stack))] += 1
+            with self._lock:
+                self._stacks.update(sampled)
+                self._samples += 1
+
+def _stage_totals():
+    return (
+        telemetry.crypto_stage_seconds.totals(),
+        telemetry.db_write_seconds.totals(),
+        telemetry.db_commit_seconds.totals()
+    )
+
+def _delta(before, after, match):
+    count = 0
+    total = 0.0
+    for labels, (n, seconds) in after.items():
+        if match(labels):
+            n0, seconds0 = before.get(labels, (0, 0.0))
+            count += n - n0
+            total += seconds - seconds0
+    return {"count": count, "total_ms": total * 1000}
+
+def _stage_spans(before, after):
+    stages_before, writes_before, commits_before = before
+    stages_after, writes_after, commits_after = after
+    return {
+        "keygen": _delta(stages_before, stages_after, lambda labels: labels[0] in KEYGEN_STAGES),
+        "encrypt": _delta(stages_before, stages_after, lambda labels: labels[0] in ENCRYPT_STAGES),
+        "insert": _delta(writes_before, writes_after, lambda labels: True),
+        "commit": _delta(commits_before, commits_after, lambda labels: True)
+    }
+
+# ✅ Global profiler; call sites use profiler.span(...)
+profiler = Profiler()
+
+async def profile_for(seconds, include_idle=False):
+    profiler.start(include_idle)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        result = profiler.stop()
+    return result
+
+async def profile_task(task, timeout, include_idle=False):
+    """Profile until task (e.g. a bulk job) finishes or timeout seconds pass."""
+    profiler.start(include_idle)
+    try:
+        await asyncio.wait({task}, timeout=timeout)
+    finally:
+        result = profiler.stop()
+    result["completed"] = task.done()
+    return result
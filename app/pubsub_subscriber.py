@@ -0,0 +1,501 @@
+"""
+Queue-driven ingestion worker.
+
+Pulls transaction messages (one JSON object each) from a queue, encrypts them in batches
+through the same BulkLoad path as /pushBulk, and acks each batch only after its insert has
+committed, so a crash redelivers instead of losing messages (at-least-once). Runs as its
+own process, decoupled from the API pods:
+
+    python -m app.pubsub_subscriber                         # SUBSCRIBER_* settings from config
+    python -m app.pubsub_subscriber --backend spool --spool-dir incoming/
+
+Backends implement pull(max_messages, timeout) / ack(ack_ids) / nack(ack_ids) / close():
+
+    spool   NDJSON files in SUBSCRIBER_SPOOL_DIR, consumed in name order (local stand-in)
+    memory  in-process emulator with publish(), ack deadlines and redelivery (tests)
+    pubsub  Google Cloud Pub/Sub subscription (needs the google-cloud-pubsub package)
+
+Flow control: at most SUBSCRIBER_MAX_OUTSTANDING messages are pulled but not yet acked, and
+at most SUBSCRIBER_CONCURRENCY batches encrypt at once; when either limit is reached the
+worker stops pulling, so a slow DB or crypto stage pushes back on the queue instead of
+buffering in memory. Messages that aren't JSON objects or fail app/validation.py are logged
+and acked (they would never succeed); rows that fail encryption are nacked for redelivery.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from collections import deque, namedtuple
+from starlette.concurrency import run_in_threadpool
+from app import config
+from app.benchmarks import benchmark_sink
+from app.bulk import BulkLoad
+from app.database import init_db, db_writer
+from app.engine import shutdown_pool
+from app.executor import crypto_executor
+from app.fleet import publish_snapshot, snapshot_store
+from app.storage import transaction_store
+
+logger = logging.getLogger("uvicorn")
+
+Message = namedtuple("Message", "ack_id data")
+
+# Pub/Sub caps the ack ids per acknowledge / modifyAckDeadline request, and the ack deadline
+PUBSUB_MAX_ACK_IDS = 1000
+PUBSUB_MAX_ACK_DEADLINE_SECONDS = 600
+
+class MemoryQueue:
+    """In-process queue emulator: unacked messages are redelivered after their ack deadline or on nack."""
+
+    def __init__(self, ack_deadline_seconds=config.SUBSCRIBER_ACK_DEADLINE_SECONDS):
+        self.ack_deadline = ack_deadline_seconds
+        self._ready = deque()
+        self._leased = {}
+        self._cond = threading.Condition()
+        self._next_id = 0
+        self.published = 0
+        self.acked = 0
+        self.redelivered = 0
+
+    def publish(self, data: bytes):
+        with self._cond:
+            self._next_id += 1
+            self._ready.append((self._next_id, data))
+            self.published += 1
+            self._cond.notify()
+
+    def _expire_leases(self):
+        now = time.monotonic()
+        for ack_id, (deadline, data) in list(self._leased.items()):
+            if deadline <= now:
+                del self._leased[ack_id]
+                self._ready.append((ack_id, data))
+                self.redelivered += 1
+
+    def pull(self, max_messages, timeout):
+        with self._cond:
+            self._expire_leases()
+            if not self._ready:
+                self._cond.wait(timeout)
+                self._expire_leases()
+            messages = []
+            deadline = time.monotonic() + self.ack_deadline
+            while self._ready and len(messages) < max_messages:
+                ack_id, data = self._ready.popleft()
+                self._leased[ack_id] = (deadline, data)
+                messages.append(Message(ack_id, data))
+            return messages
+
+    def ack(self, ack_ids):
+        with self._cond:
+            for ack_id in ack_ids:
+                if self._leased.pop(ack_id, None) is not None:
+                    self.acked += 1
+
+    def nack(self, ack_ids):
+        with self._cond:
+            for ack_id in ack_ids:
+                leased = self._leased.pop(ack_id, None)
+                if leased is not None:
+                    self._ready.appendleft((ack_id, leased[1]))
+                    self.redelivered += 1
+            self._cond.notify_all()
+
+    def backlog(self):
+        with self._cond:
+            return len(self._ready) + len(self._leased)
+
+    def close(self):
+        pass
+
+class _SpoolFile:
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.committed = 0
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path) as f:
+                self.committed = int(f.read().strip() or 0)
+        self.handle = open(path, "rb")
+        self.handle.seek(self.committed)
+        self.position = self.committed
+        # Delivered but not yet acked lines: start offset -> line
+        self.pending = {}
+        self.eof = False
+
+class SpoolQueue:
+    """
+    *.ndjson files in a directory, one message per line, consumed in name order. Producers
+    must write under another name and rename into place. Each file's committed offset (the
+    end of its longest fully acked prefix) is kept in <file>.offset, so a restart redelivers
+    only unacked lines; a fully acked file is deleted.
+    """
+
+    def __init__(self, directory, poll_interval=0.5):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+        self._files = {}
+        self._redeliver = deque()
+        self._lock = threading.Lock()
+
+    def pull(self, max_messages, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                messages = self._take(max_messages)
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0:
+                return messages
+            time.sleep(min(self.poll_interval, remaining))
+
+    def _take(self, max_messages):
+        messages = []
+        while self._redeliver and len(messages) < max_messages:
+            messages.append(self._redeliver.popleft())
+        for name in sorted(os.listdir(self.directory)):
+            if len(messages) >= max_messages:
+                break
+            if not name.endswith(".ndjson"):
+                continue
+            spool = self._files.get(name)
+            if spool is None:
+                spool = self._files[name] = _SpoolFile(os.path.join(self.directory, name))
+            while not spool.eof and len(messages) < max_messages:
+                line = spool.handle.readline()
+                if not line:
+                    spool.eof = True
+                    break
+                start = spool.position
+                spool.position += len(line)
+                if line.strip():
+                    spool.pending[start] = line
+                    messages.append(Message((name, start), line))
+            self._commit(name)
+        return messages
+
+    def _commit(self, name):
+        spool = self._files[name]
+        committed = min(spool.pending) if spool.pending else spool.position
+        if spool.eof and not spool.pending:
+            spool.handle.close()
+            os.remove(spool.path)
+            if os.path.exists(spool.offset_path):
+                os.remove(spool.offset_path)
+            del self._files[name]
+            return
+        if committed != spool.committed:
+            tmp_path = spool.offset_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(committed))
+            os.replace(tmp_path, spool.offset_path)
+            spool.committed = committed
+
+    def ack(self, ack_ids):
+        with self._lock:
+            touched = set()
+            for name, start in ack_ids:
+                spool = self._files.get(name)
+                if spool is not None and spool.pending.pop(start, None) is not None:
+                    touched.add(name)
+            for name in touched:
+                self._commit(name)
+
+    def nack(self, ack_ids):
+        # Still pending, so the committed offset can't move past them until they're acked
+        with self._lock:
+            for name, start in ack_ids:
+                spool = self._files.get(name)
+                if spool is not None and start in spool.pending:
+                    self._redeliver.append(Message((name, start), spool.pending[start]))
+
+    def close(self):
+        with self._lock:
+            for spool in self._files.values():
+                spool.handle.close()
+            self._files.clear()
+
+class PubSubQueue:
+    """
+    Synchronous pull on a Google Cloud Pub/Sub subscription (projects/<p>/subscriptions/<s>).
+    Pulled messages are leased for ack_deadline_seconds, and a background thread keeps extending
+    the lease of every message not yet acked or nacked, so a slow batch isn't redelivered (and
+    inserted twice) while it is still being processed.
+    """
+
+    def __init__(self, subscription, ack_deadline_seconds=config.SUBSCRIBER_ACK_DEADLINE_SECONDS):
+        try:
+            from google.api_core.exceptions import DeadlineExceeded
+            from google.cloud import pubsub_v1
+        except ImportError:
+            raise RuntimeError("The pubsub backend needs the google-cloud-pubsub package")
+        if not subscription:
+            raise RuntimeError("SUBSCRIBER_SUBSCRIPTION is not set")
+        self._deadline_exceeded = DeadlineExceeded
+        self._client = pubsub_v1.SubscriberClient()
+        self.subscription = subscription
+        self.ack_deadline = min(ack_deadline_seconds, PUBSUB_MAX_ACK_DEADLINE_SECONDS)
+        self._leased = set()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._renewer = threading.Thread(target=self._renew_leases, name="pubsub-lease", daemon=True)
+        self._renewer.start()
+
+    def pull(self, max_messages, timeout):
+        try:
+            response = self._client.pull(
+                request={"subscription": self.subscription, "max_messages": max_messages},
+                timeout=timeout
+            )
+        except self._deadline_exceeded:
+            return []
+        messages = [Message(received.ack_id, received.message.data) for received in response.received_messages]
+        ack_ids = [message.ack_id for message in messages]
+        with self._lock:
+            self._leased.update(ack_ids)
+        # The subscription's own deadline may be shorter than the time a batch takes
+        self._modify_ack_deadline(ack_ids, self.ack_deadline)
+        return messages
+
+    def _modify_ack_deadline(self, ack_ids, seconds):
+        for start in range(0, len(ack_ids), PUBSUB_MAX_ACK_IDS):
+            self._client.modify_ack_deadline(request={
+                "subscription": self.subscription,
+                "ack_ids": ack_ids[start:start + PUBSUB_MAX_ACK_IDS],
+                "ack_deadline_seconds": seconds
+            })
+
+    def _renew_leases(self):
+        # A third of the deadline leaves two more tries if an extension fails
+        while not self._closed.wait(self.ack_deadline / 3):
+            # Under the lock, so an extension can't land after a nack has reset the deadline to 0
+            with self._lock:
+                try:
+                    self._modify_ack_deadline(list(self._leased), self.ack_deadline)
+                except Exception as e:
+                    logger.error(f"❌ Could not extend ack deadlines of {len(self._leased)} messages: {e}")
+
+    def ack(self, ack_ids):
+        with self._lock:
+            self._leased.difference_update(ack_ids)
+        for start in range(0, len(ack_ids), PUBSUB_MAX_ACK_IDS):
+            self._client.acknowledge(
+                request={"subscription": self.subscription, "ack_ids": ack_ids[start:start + PUBSUB_MAX_ACK_IDS]}
+            )
+
+    def nack(self, ack_ids):
+        with self._lock:
+            self._leased.difference_update(ack_ids)
+            self._modify_ack_deadline(ack_ids, 0)
+
+    def close(self):
+        self._closed.set()
+        self._renewer.join()
+        self._client.close()
+
+def build_queue(backend, spool_dir=None, subscription=None):
+    if backend == "spool":
+        return SpoolQueue(spool_dir or config.SUBSCRIBER_SPOOL_DIR)
+    if backend == "memory":
+        return MemoryQueue()
+    if backend == "pubsub":
+        return PubSubQueue(subscription or config.SUBSCRIBER_SUBSCRIPTION)
+    raise ValueError(f"Unknown subscriber backend: {backend}")
+
+def decode_message(data):
+    """Record from a message body (validated with the rest of its batch), or None if it isn't a JSON object."""
+    try:
+        record = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    return record
+
+class Subscriber:
+    """Pull -> batch -> encrypt/insert -> ack loop over one queue."""
+
+    def __init__(self, queue, batch_size=config.SUBSCRIBER_BATCH_SIZE, batch_wait_ms=config.SUBSCRIBER_BATCH_WAIT_MS,
+                 concurrency=config.SUBSCRIBER_CONCURRENCY, max_outstanding=config.SUBSCRIBER_MAX_OUTSTANDING,
+                 pull_timeout=1.0):
+        self.queue = queue
+        self.batch_size = max(batch_size, 1)
+        self.batch_wait = batch_wait_ms / 1000
+        self.concurrency = max(concurrency, 1)
+        self.max_outstanding = max(max_outstanding, self.batch_size)
+        self.pull_timeout = pull_timeout
+        # Totals over every batch; each in-flight batch gets its own BulkLoad, merged in once it commits
+        self.load = BulkLoad()
+        self.batches = 0
+        self.outstanding = 0
+        self.acked = 0
+        self.nacked = 0
+        self.rejected = 0
+        self.paused = 0
+
+    async def run(self, stop: asyncio.Event):
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        released = asyncio.Event()
+        tasks = set()
+        buffer = []
+        flush_at = None
+
+        def dispatch(messages):
+            task = asyncio.create_task(self._process(messages, slots, released))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        while not stop.is_set():
+            room = self.max_outstanding - self.outstanding
+            if room <= 0:
+                if buffer:
+                    await slots.acquire()
+                    dispatch(buffer)
+                    buffer, flush_at = [], None
+                    continue
+                # Backpressure: wait for a batch to be acked before pulling more
+                self.paused += 1
+                released.clear()
+                try:
+                    await asyncio.wait_for(released.wait(), self.pull_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            timeout = self.pull_timeout if flush_at is None else max(flush_at - loop.time(), 0)
+            messages = await run_in_threadpool(self.queue.pull, min(room, self.batch_size - len(buffer)), timeout)
+            self.outstanding += len(messages)
+            buffer.extend(messages)
+            if buffer and flush_at is None:
+                flush_at = loop.time() + self.batch_wait
+
+            if buffer and (len(buffer) >= self.batch_size or loop.time() >= flush_at):
+                # Bounded concurrency: with every slot busy we stop pulling until one frees up
+                await slots.acquire()
+                dispatch(buffer)
+                buffer, flush_at = [], None
+
+        # Shutting down: hand back what hasn't started, finish what has
+        if buffer:
+            await run_in_threadpool(self.queue.nack, [message.ack_id for message in buffer])
+            self.outstanding -= len(buffer)
+            self.nacked += len(buffer)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _process(self, messages, slots, released):
+        ack_ids = []
+        retry_ids = []
+        try:
+            records = []
+            record_ack_ids = []
+            for message in messages:
+                record = decode_message(message.data)
+                if record is None:
+                    logger.warning(f"⚠️ Dropping message {message.ack_id}: not a JSON object")
+                    self.rejected += 1
+                    ack_ids.append(message.ack_id)
+                else:
+                    records.append(record)
+                    record_ack_ids.append(message.ack_id)
+
+            failed = set()
+            if records:
+                load = BulkLoad(batches_done=self.batches)
+                self.batches += 1
+                failed = set(await load.process_batch(records))
+                self.load.merge(load)
+            # process_batch returns once the insert has committed; only now is acking safe
+            for idx, ack_id in enumerate(record_ack_ids):
+                (retry_ids if idx in failed else ack_ids).append(ack_id)
+        except Exception as e:
+            logger.error(f"❌ Subscriber batch of {len(messages)} failed, requeueing: {e}")
+            ack_ids = []
+            retry_ids = [message.ack_id for message in messages]
+        finally:
+            try:
+                if ack_ids:
+                    await run_in_threadpool(self.queue.ack, ack_ids)
+                if retry_ids:
+                    await run_in_threadpool(self.queue.nack, retry_ids)
+            except Exception as e:
+                # Unacked messages come back after their ack deadline
+                logger.error(f"❌ Subscriber ack/nack failed: {e}")
+            self.acked += len(ack_ids)
+            self.nacked += len(retry_ids)
+            self.outstanding -= len(messages)
+            slots.release()
+            released.set()
+        logger.info(f"📬 Acked {len(ack_ids)} messages, requeued {len(retry_ids)} (outstanding {self.outstanding})")
+
+    def stats(self):
+        return {
+            "outstanding": self.outstanding,
+            "acked": self.acked,
+            "nacked": self.nacked,
+            "rejected": self.rejected,
+            "backpressure_pauses": self.paused,
+            "batches": self.batches,
+            "rows_success": self.load.success,
+            "rows_fail": self.load.fail
+        }
+
+async def serve(subscriber):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def publish_metrics():
+        # Same fleet snapshots as the API, so /benchmarks/aggregate includes this worker
+        while not stop.is_set():
+            await run_in_threadpool(publish_snapshot)
+            try:
+                await asyncio.wait_for(stop.wait(), config.METRICS_PUBLISH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    publisher = asyncio.create_task(publish_metrics())
+    logger.info(f"🚀 Subscriber started (batch {subscriber.batch_size}, concurrency {subscriber.concurrency}, "
+                f"max outstanding {subscriber.max_outstanding})")
+    try:
+        await subscriber.run(stop)
+    finally:
+        stop.set()
+        await publisher
+        logger.info(f"🛑 Subscriber stopped: {subscriber.stats()}")
+        subscriber.queue.close()
+        shutdown_pool()
+        crypto_executor.shutdown()
+        if subscriber.load.total_rows:
+            subscriber.load.record_session_benchmarks()
+        benchmark_sink.stop()
+        db_writer.stop()
+        transaction_store.stop()
+        publish_snapshot()
+        snapshot_store.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Encrypt and store transactions pulled from a queue")
+    parser.add_argument("--backend", choices=["spool", "pubsub"], default=config.SUBSCRIBER_BACKEND)
+    parser.add_argument("--spool-dir", default=config.SUBSCRIBER_SPOOL_DIR, help="Directory of *.ndjson files (spool backend)")
+    parser.add_argument("--subscription", default=config.SUBSCRIBER_SUBSCRIPTION, help="projects/<p>/subscriptions/<s> (pubsub backend)")
+    parser.add_argument("--batch-size", type=int, default=config.SUBSCRIBER_BATCH_SIZE)
+    parser.add_argument("--batch-wait-ms", type=float, default=config.SUBSCRIBER_BATCH_WAIT_MS)
+    parser.add_argument("--concurrency", type=int, default=config.SUBSCRIBER_CONCURRENCY)
+    parser.add_argument("--max-outstanding", type=int, default=config.SUBSCRIBER_MAX_OUTSTANDING)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    queue = build_queue(args.backend, args.spool_dir, args.subscription)
+    subscriber = Subscriber(queue, args.batch_size, args.batch_wait_ms, args.concurrency, args.max_outstanding)
+    asyncio.run(serve(subscriber))
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File, Body
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
-from app.models import Transaction, UserLogin, UserRegister
-from app.crypto import pqc_kem_encrypt, generate_rsa_keys, rsa_hybrid_encrypt
-from app.database import get_db
-from app.benchmarks import record_benchmark
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from app.models import Transaction, UserLogin, UserRegister, DecryptRequest
+from app.codec import encode_transaction
+from app.crypto import rsa_key_provider
+from app.engine import encrypt_payload, worker_key_stats
+from app.executor import crypto_executor
+from app.coalescer import encryption_coalescer
+from app.storage import transaction_store
+from app.bulk import BulkLoad
+from app.fleet import fleet_benchmarks
+from app import telemetry
+from app.jobs import spool_upload, spool_records, check_spooled_upload, create_job, start_job, job_status, list_jobs, cancel_job, get_job_task
+from app.profiling import profiler, profile_for, profile_task, ProfileBusy
+from app.decrypt import DECRYPT_SCHEMES, decrypt_transactions
+from app.keystore import key_cache
+from app.ingest import IngestError, open_record_batches, iter_list_batches
+from app import config
+from app.database import get_db, db_writer, db_pool
+from app.benchmarks import record_summary, benchmark_sink
 from app.utils import hash_password, verify_password
-from app.metrics import Benchmark, rsa_benchmark, pqc_benchmark
-import json, sqlite3, time, math, io, logging, pandas as pd, statistics
+from app.metrics import Benchmark, rsa_benchmark, pqc_benchmark, rsa_decrypt_benchmark, pqc_decrypt_benchmark
+import os, sqlite3, logging, statistics, hmac
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("uvicorn")
@@ -79,231 +94,280 @@ async def secure_script(request: Request):
 
 # ✅ Single transaction encryption route
 @router.post("/encrypt-transaction/")
-async def encrypt_transaction(transaction: Transaction, db: sqlite3.Connection = Depends(get_db)):
-    session_bm_rsa = Benchmark()
-    session_bm_pqc = Benchmark()
-    data = transaction.json().encode()
+async def encrypt_transaction(transaction: Transaction):
+    with profiler.span("serialize"):
+        data = encode_transaction(transaction)
 
-    rsa_time = None
-    pqc_time = None
+    # Opt-in: share key setup, insert and commit with concurrent requests
+    if config.COALESCE_ENABLED:
+        await encryption_coalescer.submit(data)
+        return {"status": "Transaction processed. Session benchmarks recorded."}
 
-    # RSA encryption
-    rsa_private_key, rsa_public_key = generate_rsa_keys()
-    start_rsa = time.time()
-    try:
-        rsa_encrypted_key, rsa_ciphertext = rsa_hybrid_encrypt(data, rsa_public_key)
-        rsa_time = (time.time() - start_rsa) * 1000
+    # One session benchmark per request, summarized once per algorithm below
+    session_bm = Benchmark()
+
+    # RSA + PQC encryption on the crypto executor, off the event loop
+    status, row, rsa_time, pqc_time, error = await crypto_executor.run(encrypt_payload, data)
+
+    if rsa_time is not None:
         rsa_benchmark.record_latency(rsa_time)
-        session_bm_rsa.record_latency(rsa_time)
-    except Exception as e:
-        logger.error(f"RSA encryption failed: {e}")
+    if status == "rsa_failed":
+        logger.error(f"RSA encryption failed: {error}")
         rsa_benchmark.record_error()
-        session_bm_rsa.record_error()
 
-    # PQC encryption
-    start_pqc = time.time()
-    try:
-        pqc_public_key, oqs_ciphertext, aes_ciphertext = pqc_kem_encrypt(data)
-        pqc_time = (time.time() - start_pqc) * 1000
+    if pqc_time is not None:
         pqc_benchmark.record_latency(pqc_time)
-        session_bm_pqc.record_latency(pqc_time)
-    except Exception as e:
-        logger.error(f"PQC encryption failed: {e}")
+    if status == "pqc_failed":
+        logger.error(f"PQC encryption failed: {error}")
         pqc_benchmark.record_error()
-        session_bm_pqc.record_error()
-
-    # Store transaction if successful
-    if rsa_time is not None and pqc_time is not None:
-        cursor = db.cursor()
-        cursor.execute("""
-            INSERT INTO secure_transactions 
-            (transaction_json, rsa_encrypted_key, rsa_ciphertext, pqc_public_key, oqs_ciphertext, aes_ciphertext)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            data.decode(),
-            rsa_encrypted_key.hex(),
-            rsa_ciphertext.hex(),
-            pqc_public_key.hex(),
-            oqs_ciphertext.hex(),
-            aes_ciphertext.hex()
-        ))
-        db.commit()
 
-    # Record session summary benchmarks
-    for bm, algo, time_taken in [(session_bm_rsa, "RSA", rsa_time), (session_bm_pqc, "PQC", pqc_time)]:
-        summary = bm.summary()
-        record_benchmark(
-            db,
-            type=f"session_{algo.lower()}",
-            latency=summary["average_latency"],
-            stddev=summary["stddev_latency"],
-            min_latency=summary["min_latency"],
-            max_latency=summary["max_latency"],
-            throughput=summary["throughput"],
-            error_rate=summary["error_rate"],
-            encryption_time=time_taken if time_taken else 0,
-            algorithm=algo
-        )
+    # Store transaction if successful (committed by the DB writer)
+    if row is not None:
+        await db_writer.write(_store_encrypted_transaction, row)
+
+    # Record session summary benchmarks (buffered, flushed in the background)
+    for algo, time_taken, failed in [("RSA", rsa_time, status == "rsa_failed"), ("PQC", pqc_time, status == "pqc_failed")]:
+        session_bm.clear()
+        if time_taken is not None:
+            session_bm.record_latency(time_taken)
+        if failed:
+            session_bm.record_error()
+        record_summary(session_bm.summary(), type=f"session_{algo.lower()}", algorithm=algo, encryption_time=time_taken if time_taken else 0)
 
     return {"status": "Transaction processed. Session benchmarks recorded."}
 
+def _store_encrypted_transaction(conn, row):
+    transaction_store.insert_transactions(conn.cursor(), [row])
+
 # ✅ Bulk upload with batch insert and header validation
 @router.post("/pushBulk")
 async def push_bulk(
-    db: sqlite3.Connection = Depends(get_db),
     file: UploadFile = File(None),
-    json_batch: list = Body(None)
+    json_batch: list = Body(None),
+    background: bool = False
 ):
-    BATCH_SIZE = 10000
-
-    if file:
-        content = await file.read()
-        filename = file.filename.lower()
-
-        if filename.endswith(".json"):
-            records = json.loads(content)
-        elif filename.endswith(".csv"):
-            sample = content.decode(errors='ignore')[:1024]
-            delimiter = ',' if sample.count(',') > sample.count(';') else ';'
-            df = pd.read_csv(io.StringIO(content.decode()), delimiter=delimiter)
+    BATCH_SIZE = config.BATCH_SIZE
 
-            # Validate CSV headers
-            expected_fields = set(Transaction.__annotations__.keys())
-            csv_fields = set(df.columns)
-            if not expected_fields.issubset(csv_fields):
-                return {"error": "CSV headers do not match Transaction schema"}
+    if background:
+        return await _queue_bulk_job(file, json_batch, BATCH_SIZE)
 
-            records = df.to_dict(orient="records")
-        else:
-            return {"error": "Unsupported file format."}
+    if file:
+        try:
+            batches = await run_in_threadpool(open_record_batches, file.file, file.filename.lower(), BATCH_SIZE)
+        except IngestError as e:
+            return {"error": str(e)}
     elif json_batch:
-        records = json_batch
+        batches = iter_list_batches(json_batch, BATCH_SIZE)
     else:
         return {"error": "No data provided."}
 
-    total_rows = len(records)
-    num_batches = math.ceil(total_rows / BATCH_SIZE)
-    total_success, total_fail = 0, 0
-
-    session_bm_rsa = Benchmark()
-    session_bm_pqc = Benchmark()
-
-    logger.info(f"🔄 Starting bulk processing of {total_rows} rows in {num_batches} batches...")
-
-    for b in range(num_batches):
-        batch_records = records[b*BATCH_SIZE : (b+1)*BATCH_SIZE]
-        insert_data = []
-
-        logger.info(f"🚀 Processing batch {b+1}/{num_batches} with {len(batch_records)} records...")
-
-        for idx, record in enumerate(batch_records, start=1):
-            data = json.dumps(record).encode()
-
-            rsa_time = None
-            pqc_time = None
-
-            # RSA encryption
-            rsa_private_key, rsa_public_key = generate_rsa_keys()
-            start_rsa = time.time()
-            try:
-                rsa_encrypted_key, rsa_ciphertext = rsa_hybrid_encrypt(data, rsa_public_key)
-                rsa_time = (time.time() - start_rsa) * 1000
-                rsa_benchmark.record_latency(rsa_time)
-                session_bm_rsa.record_latency(rsa_time)
-            except Exception as e:
-                logger.error(f"❌ RSA encryption failed at row {idx}: {e}")
-                rsa_benchmark.record_error()
-                session_bm_rsa.record_error()
-                total_fail += 1
-                continue
-
-            # PQC encryption
-            start_pqc = time.time()
-            try:
-                pqc_public_key, oqs_ciphertext, aes_ciphertext = pqc_kem_encrypt(data)
-                pqc_time = (time.time() - start_pqc) * 1000
-                pqc_benchmark.record_latency(pqc_time)
-                session_bm_pqc.record_latency(pqc_time)
-            except Exception as e:
-                logger.error(f"❌ PQC encryption failed at row {idx}: {e}")
-                pqc_benchmark.record_error()
-                session_bm_pqc.record_error()
-                total_fail += 1
-                continue
-
-            insert_data.append((
-                json.dumps(record),
-                rsa_encrypted_key.hex(),
-                rsa_ciphertext.hex(),
-                pqc_public_key.hex(),
-                oqs_ciphertext.hex(),
-                aes_ciphertext.hex()
-            ))
-            total_success += 1
-
-        if insert_data:
-            cursor = db.cursor()
-            cursor.executemany("""
-                INSERT INTO secure_transactions 
-                (transaction_json, rsa_encrypted_key, rsa_ciphertext, pqc_public_key, oqs_ciphertext, aes_ciphertext)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, insert_data)
-            db.commit()
-            logger.info(f"✅ Batch {b+1} inserted {len(insert_data)} records successfully.")
-
-    # Record session-level benchmarks
-    for bm, algo in [(session_bm_rsa, "RSA"), (session_bm_pqc, "PQC")]:
-        summary = bm.summary()
-        record_benchmark(
-            db,
-            type=f"bulk_session_{algo.lower()}",
-            latency=summary["average_latency"],
-            stddev=summary["stddev_latency"],
-            min_latency=summary["min_latency"],
-            max_latency=summary["max_latency"],
-            throughput=summary["throughput"],
-            error_rate=summary["error_rate"],
-            encryption_time=summary["average_latency"],
-            algorithm=algo
-        )
+    ingest_error = None
+    load = BulkLoad()
+
+    logger.info(f"🔄 Starting streaming bulk processing in batches of {BATCH_SIZE} rows...")
+
+    try:
+        async for batch_records in iterate_in_threadpool(profiler.iter_span("parse", batches)):
+            await load.process_batch(batch_records)
+    except IngestError as e:
+        logger.error(f"❌ Bulk upload stopped after {load.batches} batches: {e}")
+        ingest_error = str(e)
 
-    logger.info(f"🎯 Bulk processing complete. ✅ Success: {total_success}, ❌ Fail: {total_fail}")
+    load.record_session_benchmarks()
+
+    logger.info(f"🎯 Bulk processing complete. ✅ Success: {load.success}, ❌ Fail: {load.fail}")
+
+    if ingest_error:
+        return {
+            "error": ingest_error,
+            "total_rows": load.total_rows,
+            "success": load.success,
+            "fail": load.fail
+        }
 
     return {
         "status": "✅ Bulk load completed.",
-        "total_rows": total_rows,
-        "success": total_success,
-        "fail": total_fail
+        "total_rows": load.total_rows,
+        "success": load.success,
+        "fail": load.fail
     }
 
+async def _queue_bulk_job(file, json_batch, batch_size):
+    if file:
+        filename = file.filename.lower()
+        spool_path = await run_in_threadpool(spool_upload, file.file)
+    elif json_batch:
+        filename = "json_batch.ndjson"
+        spool_path = await run_in_threadpool(spool_records, json_batch)
+    else:
+        return {"error": "No data provided."}
+
+    try:
+        await run_in_threadpool(check_spooled_upload, spool_path, filename, batch_size)
+    except IngestError as e:
+        os.remove(spool_path)
+        return {"error": str(e)}
+
+    try:
+        job_id = await run_in_threadpool(_create_pooled_job, filename, spool_path, batch_size)
+    except Exception:
+        os.remove(spool_path)
+        raise
+    start_job(job_id)
+    logger.info(f"📥 Queued bulk job {job_id} for {filename}")
+    return {"status": "queued", "job_id": job_id}
+
+def _create_pooled_job(filename, spool_path, batch_size):
+    # A connection is borrowed for the insert only, not for the whole upload
+    db = db_pool.acquire()
+    try:
+        return create_job(db, filename, spool_path, batch_size)
+    finally:
+        db_pool.release(db)
+
+# ✅ Background bulk job endpoints
+@router.get("/jobs")
+async def get_jobs(db: sqlite3.Connection = Depends(get_db)):
+    return list_jobs(db)
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, db: sqlite3.Connection = Depends(get_db)):
+    job = job_status(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_bulk_job(job_id: str, db: sqlite3.Connection = Depends(get_db)):
+    status = cancel_job(db, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "status": status}
+
 # ✅ Benchmark endpoints
 @router.get("/benchmarks/live")
-async def get_live_benchmarks():
+async def get_live_benchmarks(window: str = None):
+    # ?window=1m|5m|60m: same shape, over the last window instead of since startup
+    if window:
+        rsa_rolling = rsa_benchmark.rolling_summary()
+        if window not in rsa_rolling:
+            raise HTTPException(status_code=400, detail=f"Unknown window, expected one of: {', '.join(rsa_rolling)}")
+        return {
+            "RSA": rsa_rolling[window],
+            "PQC": pqc_benchmark.rolling_summary()[window],
+            "RSA_DECRYPT": rsa_decrypt_benchmark.rolling_summary()[window],
+            "PQC_DECRYPT": pqc_decrypt_benchmark.rolling_summary()[window]
+        }
     return {
         "RSA": rsa_benchmark.summary(),
-        "PQC": pqc_benchmark.summary()
+        "PQC": pqc_benchmark.summary(),
+        "RSA_DECRYPT": rsa_decrypt_benchmark.summary(),
+        "PQC_DECRYPT": pqc_decrypt_benchmark.summary()
     }
 
-@router.get("/benchmarks/sessions")
-async def session_benchmarks(db: sqlite3.Connection = Depends(get_db)):
-    cursor = db.cursor()
-    cursor.execute("""
-        SELECT id, algorithm, latency, stddev, min_latency, max_latency, throughput, error_rate, encryption_time, timestamp 
-        FROM benchmarks
-    """)
-    rows = cursor.fetchall()
-    results = []
-    for row in rows:
-        results.append({
-            "id": row[0],
-            "algorithm": row[1],
-            "latency": row[2],
-            "stddev": row[3],
-            "min_latency": row[4],
-            "max_latency": row[5],
-            "throughput": row[6],
-            "error_rate": row[7],
-            "encryption_time": row[8],
-            "timestamp": row[9],
-        })
-    return results
+@router.get("/benchmarks/rolling")
+async def get_rolling_benchmarks():
+    return {
+        "RSA": rsa_benchmark.rolling_summary(),
+        "PQC": pqc_benchmark.rolling_summary(),
+        "RSA_DECRYPT": rsa_decrypt_benchmark.rolling_summary(),
+        "PQC_DECRYPT": pqc_decrypt_benchmark.rolling_summary()
+    }
+
+# ✅ Merged over every worker/replica that published a snapshot recently
+@router.get("/benchmarks/aggregate")
+async def get_aggregate_benchmarks():
+    return await run_in_threadpool(fleet_benchmarks)
+
+@router.get("/benchmarks/keys")
+async def key_provider_stats():
+    return {
+        "api": rsa_key_provider.stats(),
+        "workers": worker_key_stats,
+        "decrypt_cache": key_cache.stats()
+    }
+
+@router.get("/benchmarks/executor")
+async def crypto_executor_stats():
+    return crypto_executor.stats()
+
+@router.get("/benchmarks/coalescer")
+async def coalescer_stats():
+    return encryption_coalescer.stats()
+
+@router.get("/benchmarks/database")
+async def database_stats():
+    return {
+        "pool": db_pool.stats(),
+        "writer": db_writer.stats(),
+        "storage": transaction_store.stats()
+    }
+
+def _require_admin_token(request, enabled, admin_token):
+    if not enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("X-Admin-Token", "")
+    if not admin_token or not hmac.compare_digest(token, admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+# ✅ Admin-only: profiling must be enabled and the caller must send PROFILING_ADMIN_TOKEN
+def require_profiling_admin(request: Request):
+    _require_admin_token(request, config.PROFILING_ENABLED, config.PROFILING_ADMIN_TOKEN)
+
+# ✅ Admin-only: decryption must be enabled and the caller must send DECRYPT_ADMIN_TOKEN
+def require_decrypt_admin(request: Request):
+    _require_admin_token(request, config.DECRYPT_ENABLED, config.DECRYPT_ADMIN_TOKEN)
+
+# ✅ Sample this process for `seconds`, or until bulk job `job_id` finishes.
+# format=folded returns only the collapsed stacks, ready for flamegraph.pl / speedscope.
+@router.post("/admin/profile", dependencies=[Depends(require_profiling_admin)])
+async def profile_process(seconds: float = 10, job_id: str = None, format: str = "json", include_idle: bool = False):
+    if format not in ("json", "folded"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'folded'")
+    try:
+        if job_id:
+            task = get_job_task(job_id)
+            if task is None:
+                raise HTTPException(status_code=404, detail="Job is not queued or running in this process")
+            result = await profile_task(task, config.PROFILING_MAX_SECONDS, include_idle)
+        else:
+            if not 0 < seconds <= config.PROFILING_MAX_SECONDS:
+                raise HTTPException(status_code=400, detail=f"seconds must be in (0, {config.PROFILING_MAX_SECONDS}]")
+            result = await profile_for(seconds, include_idle)
+    except ProfileBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if format == "folded":
+        return PlainTextResponse(result["folded"])
+    return result
+
+# ✅ Prometheus scrape target (text exposition format)
+@router.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _check_scheme(scheme):
+    if scheme not in DECRYPT_SCHEMES:
+        raise HTTPException(status_code=400, detail=f"scheme must be one of: {', '.join(DECRYPT_SCHEMES)}")
+
+# ✅ Decrypt one stored transaction (scheme=pqc|rsa|both; both also checks the two plaintexts agree)
+@router.get("/transactions/{transaction_id}/decrypt", dependencies=[Depends(require_decrypt_admin)])
+async def decrypt_transaction(transaction_id: int, scheme: str = "pqc", db: sqlite3.Connection = Depends(get_db)):
+    _check_scheme(scheme)
+    results, not_found = await decrypt_transactions(db, [transaction_id], scheme)
+    if not_found:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return results[0]
+
+# ✅ Decrypt up to DECRYPT_MAX_BATCH transactions; keys are unwrapped once per key, not per row
+@router.post("/transactions/decrypt", dependencies=[Depends(require_decrypt_admin)])
+async def decrypt_transaction_batch(request: DecryptRequest, db: sqlite3.Connection = Depends(get_db)):
+    _check_scheme(request.scheme)
+    if not 0 < len(request.ids) <= config.DECRYPT_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"ids must contain 1 to {config.DECRYPT_MAX_BATCH} entries")
+    results, not_found = await decrypt_transactions(db, request.ids, request.scheme)
+    return {"results": results, "not_found": not_found}
+
+@router.get("/benchmarks/sink")
+async def benchmark_sink_stats():
+    return benchmark_sink.stats()
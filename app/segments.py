@@ -0,0 +1,419 @@
+"""
+Append-only segment files for encrypted transactions (STORAGE_BACKEND=segments).
+
+Each batch is one frame appended to the writing process's active segment in SEGMENT_DIR:
+
+    frame  = FRAME header (magic, record count, body length, CRC-32 of count/length/body) + body
+    body   = record offsets (u32 each, from the start of the body) + records
+    record = RECORD header (CRC-32 of the rest of the record, key ids, envelope id/seq, flags,
+             field lengths) + transaction_json, rsa_encrypted_key, rsa_ciphertext,
+             oqs_ciphertext, aes_ciphertext
+
+A frame only counts once SQLite has it: app/storage.py inserts a segment_batches row (segment,
+offset, first transaction id) in the same writer transaction, and the DB writer fsyncs the
+segment before that transaction commits. Anything in a segment that segment_batches doesn't
+point at (a torn tail after a crash, a frame whose transaction rolled back) is dead space:
+recovery truncates dead tails and compaction copies live frames out of sparse or small sealed
+segments into a new one, then deletes them.
+
+Every process appends to its own segment and holds an exclusive flock on it; a segment no
+process holds is sealed and never written again. Reads go through mmap: record fields are
+memoryviews into the mapping, checked against the record CRC.
+"""
+import fcntl
+import glob
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from app import config
+
+logger = logging.getLogger("uvicorn")
+
+SEGMENT_MAGIC = b"PQCSEG01"
+FRAME_MAGIC = b"FRM1"
+
+# magic, record_count, body_length, crc32
+FRAME = struct.Struct("<4sIII")
+# crc32, rsa_key_id, pqc_key_id, envelope_id, envelope_seq, flags, then the BLOB_FIELDS lengths
+RECORD = struct.Struct("<IqqqqB5I")
+OFFSET = struct.Struct("<I")
+
+BLOB_FIELDS = ("transaction_json", "rsa_encrypted_key", "rsa_ciphertext", "oqs_ciphertext", "aes_ciphertext")
+
+# Stand-ins for NULL: a length for absent fields, an id for absent envelope columns
+NULL_LENGTH = 0xFFFFFFFF
+NULL_ID = -1
+
+# flags: transaction_json was TEXT (legacy JSON plaintext) rather than a binary record
+FLAG_TEXT_JSON = 0x01
+
+SEGMENT_NAME = re.compile(r"seg-(\d{10})\.seg\Z")
+
+class SegmentError(Exception):
+    pass
+
+# ✅ Encode one batch as a frame: records are (rsa_key_id, pqc_key_id, envelope_id, envelope_seq, transaction_json,
+# rsa_encrypted_key, rsa_ciphertext, oqs_ciphertext, aes_ciphertext) with None for absent values
+def encode_frame(records):
+    offsets = bytearray()
+    parts = []
+    position = OFFSET.size * len(records)
+    for rsa_key_id, pqc_key_id, envelope_id, envelope_seq, *blobs in records:
+        flags = 0
+        if isinstance(blobs[0], str):
+            blobs[0] = blobs[0].encode()
+            flags |= FLAG_TEXT_JSON
+        lengths = [NULL_LENGTH if blob is None else len(blob) for blob in blobs]
+        payload = b"".join(blob for blob in blobs if blob is not None)
+        fields = RECORD.pack(
+            0, _id(rsa_key_id), _id(pqc_key_id), _id(envelope_id), _id(envelope_seq), flags, *lengths
+        )[OFFSET.size:]
+        crc = zlib.crc32(payload, zlib.crc32(fields))
+        parts.append(OFFSET.pack(crc) + fields + payload)
+        offsets += OFFSET.pack(position)
+        position += RECORD.size + len(payload)
+    body = bytes(offsets) + b"".join(parts)
+    return FRAME.pack(FRAME_MAGIC, len(records), len(body), _frame_crc(len(records), body)) + body
+
+def _id(value):
+    return NULL_ID if value is None else value
+
+def _frame_crc(count, body):
+    return zlib.crc32(body, zlib.crc32(struct.pack("<II", count, len(body))))
+
+def _read_frame_header(data, offset):
+    """(record_count, body_length, crc) of the frame at offset, or None if there's no complete header there."""
+    if offset + FRAME.size > len(data):
+        return None
+    magic, count, body_length, crc = FRAME.unpack_from(data, offset)
+    if magic != FRAME_MAGIC:
+        return None
+    return count, body_length, crc
+
+def frame_is_valid(data, offset):
+    """True when a whole frame with a matching checksum starts at offset."""
+    header = _read_frame_header(data, offset)
+    if header is None:
+        return False
+    count, body_length, crc = header
+    start = offset + FRAME.size
+    if start + body_length > len(data):
+        return False
+    return _frame_crc(count, memoryview(data)[start:start + body_length]) == crc
+
+def _decode_record(view):
+    """Record fields from a memoryview starting at its header; blobs are slices of view (no copy)."""
+    crc, rsa_key_id, pqc_key_id, envelope_id, envelope_seq, flags, *lengths = RECORD.unpack_from(view, 0)
+    end = RECORD.size + sum(length for length in lengths if length != NULL_LENGTH)
+    if end > len(view) or zlib.crc32(view[OFFSET.size:end]) != crc:
+        raise SegmentError("Record checksum mismatch")
+    record = {
+        "rsa_key_id": None if rsa_key_id == NULL_ID else rsa_key_id,
+        "pqc_key_id": None if pqc_key_id == NULL_ID else pqc_key_id,
+        "envelope_id": None if envelope_id == NULL_ID else envelope_id,
+        "envelope_seq": None if envelope_seq == NULL_ID else envelope_seq
+    }
+    position = RECORD.size
+    for name, length in zip(BLOB_FIELDS, lengths):
+        if length == NULL_LENGTH:
+            record[name] = None
+            continue
+        record[name] = view[position:position + length]
+        position += length
+    if flags & FLAG_TEXT_JSON:
+        record["transaction_json"] = bytes(record["transaction_json"]).decode()
+    return record
+
+def _try_lock(path):
+    """An fd holding an exclusive flock on path, or None if a writer holds it (or it's gone)."""
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+class _SegmentWriter:
+    """An open, flock-held segment being appended to."""
+
+    def __init__(self, directory):
+        self.fd, self.name = _create_segment(directory)
+        self.size = len(SEGMENT_MAGIC)
+        self.dirty = False
+
+    def append(self, data):
+        offset = self.size
+        view = memoryview(data)
+        try:
+            while view:
+                written = os.write(self.fd, view)
+                view = view[written:]
+        except BaseException:
+            # O_APPEND has moved past the bytes that did land: cut them off so the next frame
+            # starts at self.size, or at least take the real size if that fails too
+            try:
+                os.ftruncate(self.fd, self.size)
+            except OSError:
+                self.size = os.fstat(self.fd).st_size
+            raise
+        self.size += len(data)
+        self.dirty = True
+        return offset
+
+    def sync(self):
+        if self.dirty:
+            os.fsync(self.fd)
+            self.dirty = False
+
+    def close(self):
+        self.sync()
+        os.close(self.fd)
+
+def _create_segment(directory):
+    """(fd, name) of a new, locked segment. Built under a temp name, so it is never visible unlocked."""
+    os.makedirs(directory, exist_ok=True)
+    temp = os.path.join(directory, f".seg-{os.getpid()}-{threading.get_ident()}.tmp")
+    fd = os.open(temp, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, SEGMENT_MAGIC)
+        os.fsync(fd)
+        number = _next_segment_number(directory)
+        while True:
+            name = f"seg-{number:010d}.seg"
+            try:
+                os.link(temp, os.path.join(directory, name))
+                break
+            except FileExistsError:
+                number += 1
+        os.unlink(temp)
+        _fsync_dir(directory)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd, name
+
+def _next_segment_number(directory):
+    """Numbers only ever go up (SEGMENT_DIR/sequence), so a deleted segment's name is never reused under a cached mmap."""
+    fd = os.open(os.path.join(directory, "sequence"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        last = int(os.pread(fd, 20, 0) or b"0")
+        existing = [int(m.group(1)) for m in map(SEGMENT_NAME.match, os.listdir(directory)) if m]
+        number = max([last, *existing]) + 1
+        os.pwrite(fd, b"%020d" % number, 0)
+        os.fsync(fd)
+        return number
+    finally:
+        os.close(fd)
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class SegmentLog:
+    """
+    This process's segment writer (used from the DB writer thread) plus an LRU of read-only
+    mmaps shared by readers.
+    """
+
+    def __init__(self, directory, max_bytes, mmap_cache_size):
+        self.directory = directory
+        self.max_bytes = max(max_bytes, 1)
+        self.mmap_cache_size = max(mmap_cache_size, 1)
+        self._writer = None
+        # Segments rolled over in this / the previous writer transaction: kept locked until that transaction committed
+        self._retired = []
+        self._closing = []
+        self._maps = OrderedDict()
+        self._maps_lock = threading.Lock()
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.rollovers = 0
+
+    # ✅ Append one frame (DB writer thread); returns (segment, offset), durable after the next sync()
+    def append(self, frame):
+        writer = self._writer
+        if writer is not None and writer.size > len(SEGMENT_MAGIC) and writer.size + len(frame) > self.max_bytes:
+            self._retired.append(writer)
+            writer = self._writer = None
+            self.rollovers += 1
+        if writer is None:
+            writer = self._writer = _SegmentWriter(self.directory)
+            logger.info(f"🗂️ Writing segment {writer.name}")
+        offset = writer.append(frame)
+        self.frames_written += 1
+        self.bytes_written += len(frame)
+        return writer.name, offset
+
+    # ✅ DB writer commit hook: runs before every COMMIT, so no committed index row points at unsynced bytes
+    def sync(self):
+        for writer in self._retired:
+            writer.sync()
+        if self._writer is not None:
+            self._writer.sync()
+        # Segments retired before the previous commit are no longer referenced by an open transaction
+        for writer in self._closing:
+            writer.close()
+        self._closing = self._retired
+        self._retired = []
+
+    def close(self):
+        for writer in self._closing + self._retired + ([self._writer] if self._writer else []):
+            writer.close()
+        self._closing, self._retired, self._writer = [], [], None
+
+    def active_segments(self):
+        """Segments this process still holds locked (its active one and recently rolled over ones)."""
+        writers = self._closing + self._retired + ([self._writer] if self._writer else [])
+        return {writer.name for writer in writers}
+
+    def path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def _map(self, segment, needed):
+        """Read-only mmap of segment covering at least `needed` bytes (remapped if the segment grew)."""
+        with self._maps_lock:
+            data = self._maps.get(segment)
+            if data is not None and len(data) >= needed:
+                self._maps.move_to_end(segment)
+                return data
+        with open(self.path(segment), "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(data) < needed:
+            raise SegmentError(f"Segment {segment} is shorter than its index says")
+        with self._maps_lock:
+            self._maps[segment] = data
+            self._maps.move_to_end(segment)
+            while len(self._maps) > self.mmap_cache_size:
+                # Not closed: memoryviews handed out may still point into it
+                self._maps.popitem(last=False)
+        return data
+
+    def forget(self, segment):
+        with self._maps_lock:
+            self._maps.pop(segment, None)
+
+    # ✅ Zero-copy read of some records of one frame: {index: record fields}
+    def read_records(self, segment, offset, length, indexes):
+        data = self._map(segment, offset + length)
+        header = _read_frame_header(data, offset)
+        if header is None:
+            raise SegmentError(f"No frame at {segment}:{offset}")
+        count, body_length, _ = header
+        body = memoryview(data)[offset + FRAME.size:offset + FRAME.size + body_length]
+        records = {}
+        for index in indexes:
+            if not 0 <= index < count:
+                raise SegmentError(f"Record {index} out of range in {segment}:{offset}")
+            start = OFFSET.unpack_from(body, OFFSET.size * index)[0]
+            records[index] = _decode_record(body[start:])
+        return records
+
+    def segment_files(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if SEGMENT_NAME.match(name))
+
+    def sealed_segments(self):
+        """{segment: locked fd} for every segment no writer holds; the caller closes the fds."""
+        sealed = {}
+        active = self.active_segments()
+        for name in self.segment_files():
+            if name in active:
+                continue
+            fd = _try_lock(self.path(name))
+            if fd is not None:
+                sealed[name] = fd
+        return sealed
+
+    def remove_stale_temp_files(self):
+        for path in glob.glob(os.path.join(glob.escape(self.directory), ".seg-*.tmp")):
+            fd = _try_lock(path)
+            if fd is not None:
+                # A creator that died before linking its segment into place
+                os.unlink(path)
+                os.close(fd)
+
+    # ✅ Crash recovery for one sealed segment: cut everything after its last indexed frame
+    def truncate_after(self, segment, fd, live_end):
+        """live_end: end of the last frame segment_batches points into (0 if none). Returns bytes removed."""
+        size = os.fstat(fd).st_size
+        end = max(live_end, len(SEGMENT_MAGIC))
+        if size <= end:
+            return 0
+        os.ftruncate(fd, end)
+        os.fsync(fd)
+        self.forget(segment)
+        return size - end
+
+    # ✅ Compaction: copy frames (segment, offset, length) into new segments of at most max_bytes
+    def rewrite(self, frames):
+        """
+        Returns ([(new_segment, new_offset)] in frame order, [(name, fd)] of the new segments).
+        The new segments stay locked (so not compactable) until the caller has repointed the
+        index and closes the fds; every copied frame is checksum-verified first.
+        """
+        locations = []
+        outputs = []
+        writer = None
+        try:
+            for segment, offset, length in frames:
+                data = self._map(segment, offset + length)
+                if not frame_is_valid(data, offset):
+                    raise SegmentError(f"Frame {segment}:{offset} failed its checksum")
+                if writer is None or (writer.size > len(SEGMENT_MAGIC) and writer.size + length > self.max_bytes):
+                    if writer is not None:
+                        writer.sync()
+                    writer = _SegmentWriter(self.directory)
+                    outputs.append(writer)
+                locations.append((writer.name, writer.append(data[offset:offset + length])))
+            if writer is not None:
+                writer.sync()
+        except BaseException:
+            for output in outputs:
+                os.close(output.fd)
+                os.unlink(self.path(output.name))
+            raise
+        return locations, [(output.name, output.fd) for output in outputs]
+
+    def packed_segments(self, lengths):
+        """How many segments rewrite() fills with frames of these lengths."""
+        count = 0
+        size = None
+        for length in lengths:
+            if size is None or (size > len(SEGMENT_MAGIC) and size + length > self.max_bytes):
+                count += 1
+                size = len(SEGMENT_MAGIC)
+            size += length
+        return count
+
+    def delete(self, segment):
+        self.forget(segment)
+        os.unlink(self.path(segment))
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "active_segment": self._writer.name if self._writer else None,
+            "segments": len(self.segment_files()),
+            "frames_written": self.frames_written,
+            "bytes_written": self.bytes_written,
+            "rollovers": self.rollovers,
+            "mapped_segments": len(self._maps)
+        }
+
+# ✅ Global segment log: written when STORAGE_BACKEND=segments, read whenever segment_batches has rows
+segment_log = SegmentLog(config.SEGMENT_DIR, config.SEGMENT_MAX_BYTES, config.SEGMENT_MMAP_CACHE_SIZE)
@@ -0,0 +1,516 @@
+"""
+secure_transactions storage.
+
+Format v1 (legacy): table secure_transactions, every ciphertext hex-encoded TEXT and the
+Kyber public key repeated on each row.
+Format v2: table secure_transactions_v2 with raw BLOB ciphertexts and rsa_key_id/pqc_key_id
+referencing deduplicated rows in public_keys. Ids are unique across both tables, so a
+transaction id resolves to exactly one row whichever layout it is stored in.
+Envelope rows (ENVELOPE_ENCRYPTION) are v2 rows whose only ciphertext is aes_ciphertext,
+AES-GCM under their batch's data key; envelope_id points at the envelope_batches header
+holding that key sealed with RSA-OAEP and the KEM, and envelope_seq is the record's nonce.
+The header plus one row is enough to decrypt that row.
+transaction_json holds the record's plaintext as it was encrypted: JSON TEXT for older rows,
+a binary record BLOB (app/codec.py) since RECORD_FORMAT=binary; codec.decode_record reads both.
+Segment rows (STORAGE_BACKEND=segments) carry the same fields as v2 rows but live in
+append-only segment files (app/segments.py), one frame per inserted batch; a segment_batches
+row maps the batch's id range first_id .. first_id + record_count - 1 to its frame. Their ids
+come from secure_transactions_v2's AUTOINCREMENT sequence, so they stay unique too.
+Private keys written since key_secrets exists are kept there (see app/keystore.py); older
+rows have no stored key material and can't be decrypted.
+"""
+import bisect
+import fcntl
+import hashlib
+import logging
+import os
+from abc import ABC, abstractmethod
+from app import config
+from app.database import db_pool, db_writer
+from app.kem import KEM_ALGORITHM
+from app.keystore import store_key_secret
+from app.segments import SEGMENT_MAGIC, encode_frame, segment_log
+
+logger = logging.getLogger("uvicorn")
+
+STORAGE_FORMAT_VERSION = 2
+
+RSA_KEY_ALGORITHM = "RSA-2048"
+
+# Ids per `IN (...)` lookup, below SQLite's bound-variable limit
+MAX_IDS_PER_QUERY = 500
+
+V2_COLUMNS = (
+    "id, transaction_json, rsa_key_id, rsa_encrypted_key, rsa_ciphertext, pqc_key_id, oqs_ciphertext, aes_ciphertext,"
+    " envelope_id, envelope_seq"
+)
+
+def key_fingerprint(public_key: bytes):
+    return hashlib.sha256(public_key).digest()
+
+# ✅ Id of a public key in public_keys, inserting it on first sight.
+# key_ids caches lookups for the current transaction only, so a rollback can't leave stale ids behind.
+# With secret (private key bytes), the secret is also stored wrapped in key_secrets.
+def resolve_key_id(cursor, algorithm, public_key: bytes, key_ids, secret=None):
+    fingerprint = key_fingerprint(public_key)
+    key_id = key_ids.get(fingerprint)
+    if key_id is not None:
+        return key_id
+
+    cursor.execute(
+        "INSERT OR IGNORE INTO public_keys (algorithm, fingerprint, public_key) VALUES (?, ?, ?)",
+        (algorithm, fingerprint, public_key)
+    )
+    cursor.execute("SELECT id FROM public_keys WHERE fingerprint = ?", (fingerprint,))
+    key_id = key_ids[fingerprint] = cursor.fetchone()[0]
+    if secret is not None:
+        store_key_secret(cursor, key_id, fingerprint, secret)
+    return key_id
+
+# ✅ Insert encrypted rows produced by engine.encrypt_payload (caller commits)
+def insert_transactions(cursor, rows):
+    """
+    rows: (transaction_json, rsa_public_key, rsa_encrypted_key, rsa_ciphertext,
+           pqc_public_key, oqs_ciphertext, aes_ciphertext, rsa_private_key, pqc_secret_key)
+           with raw bytes fields; the private keys are persisted once per key via key_secrets.
+    """
+    key_ids = {}
+    insert_data = []
+    for (transaction_json, rsa_public_key, rsa_encrypted_key, rsa_ciphertext, pqc_public_key, oqs_ciphertext,
+         aes_ciphertext, rsa_private_key, pqc_secret_key) in rows:
+        insert_data.append((
+            transaction_json,
+            resolve_key_id(cursor, RSA_KEY_ALGORITHM, rsa_public_key, key_ids, rsa_private_key),
+            rsa_encrypted_key,
+            rsa_ciphertext,
+            resolve_key_id(cursor, KEM_ALGORITHM, pqc_public_key, key_ids, pqc_secret_key),
+            oqs_ciphertext,
+            aes_ciphertext
+        ))
+    cursor.executemany("""
+        INSERT INTO secure_transactions_v2
+        (transaction_json, rsa_key_id, rsa_encrypted_key, rsa_ciphertext, pqc_key_id, oqs_ciphertext, aes_ciphertext)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, insert_data)
+
+# ✅ Insert one envelope batch: its header, then its rows (caller commits)
+def insert_envelope_batch(cursor, header, rows):
+    """
+    header: engine.encrypt_envelope's (batch_uid, rsa_public_key, rsa_encrypted_key, pqc_public_key,
+            oqs_ciphertext, pqc_wrapped_key, rsa_private_key, pqc_secret_key)
+    rows: (transaction_json, seq, ciphertext)
+    """
+    envelope_id, rsa_key_id, pqc_key_id = _insert_envelope_header(cursor, header, len(rows))
+    cursor.executemany("""
+        INSERT INTO secure_transactions_v2
+        (transaction_json, rsa_key_id, pqc_key_id, aes_ciphertext, envelope_id, envelope_seq)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [
+        (transaction_json, rsa_key_id, pqc_key_id, ciphertext, envelope_id, seq)
+        for transaction_json, seq, ciphertext in rows
+    ])
+    return envelope_id
+
+def _insert_envelope_header(cursor, header, record_count):
+    """Returns (envelope_id, rsa_key_id, pqc_key_id)."""
+    (batch_uid, rsa_public_key, rsa_encrypted_key, pqc_public_key, oqs_ciphertext, pqc_wrapped_key,
+     rsa_private_key, pqc_secret_key) = header
+    key_ids = {}
+    rsa_key_id = resolve_key_id(cursor, RSA_KEY_ALGORITHM, rsa_public_key, key_ids, rsa_private_key)
+    pqc_key_id = resolve_key_id(cursor, KEM_ALGORITHM, pqc_public_key, key_ids, pqc_secret_key)
+    cursor.execute("""
+        INSERT INTO envelope_batches
+        (batch_uid, rsa_key_id, rsa_encrypted_key, pqc_key_id, oqs_ciphertext, pqc_wrapped_key, record_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (batch_uid, rsa_key_id, rsa_encrypted_key, pqc_key_id, oqs_ciphertext, pqc_wrapped_key, record_count))
+    return cursor.lastrowid, rsa_key_id, pqc_key_id
+
+def _blob(value):
+    return bytes(value) if value is not None else None
+
+def _v2_record(row, keys, envelopes):
+    rsa_key = keys.get(row[2], (None, None))
+    pqc_key = keys.get(row[5], (None, None))
+    return {
+        "id": row[0],
+        "format": 2,
+        "transaction_json": row[1],
+        "rsa_key_id": row[2],
+        "rsa_public_key": rsa_key[1],
+        "rsa_encrypted_key": _blob(row[3]),
+        "rsa_ciphertext": _blob(row[4]),
+        "pqc_key_id": row[5],
+        "pqc_algorithm": pqc_key[0],
+        "pqc_public_key": pqc_key[1],
+        "oqs_ciphertext": _blob(row[6]),
+        "aes_ciphertext": bytes(row[7]),
+        "envelope": envelopes.get(row[8]),
+        "envelope_seq": row[9]
+    }
+
+def _v1_record(row):
+    return {
+        "id": row[0],
+        "format": 1,
+        "transaction_json": row[1],
+        "rsa_key_id": None,
+        "rsa_public_key": None,
+        "rsa_encrypted_key": bytes.fromhex(row[2]),
+        "rsa_ciphertext": bytes.fromhex(row[3]),
+        "pqc_key_id": None,
+        "pqc_algorithm": "Kyber512",
+        "pqc_public_key": bytes.fromhex(row[4]),
+        "oqs_ciphertext": bytes.fromhex(row[5]),
+        "aes_ciphertext": bytes.fromhex(row[6]),
+        "envelope": None,
+        "envelope_seq": None
+    }
+
+def _segment_record(transaction_id, fields, keys, envelopes):
+    rsa_key = keys.get(fields["rsa_key_id"], (None, None))
+    pqc_key = keys.get(fields["pqc_key_id"], (None, None))
+    transaction_json = fields["transaction_json"]
+    return {
+        "id": transaction_id,
+        "format": 3,
+        "transaction_json": bytes(transaction_json) if isinstance(transaction_json, memoryview) else transaction_json,
+        "rsa_key_id": fields["rsa_key_id"],
+        "rsa_public_key": rsa_key[1],
+        "rsa_encrypted_key": _blob(fields["rsa_encrypted_key"]),
+        # Ciphertext bodies stay memoryviews into the segment mapping
+        "rsa_ciphertext": fields["rsa_ciphertext"],
+        "pqc_key_id": fields["pqc_key_id"],
+        "pqc_algorithm": pqc_key[0],
+        "pqc_public_key": pqc_key[1],
+        "oqs_ciphertext": _blob(fields["oqs_ciphertext"]),
+        "aes_ciphertext": fields["aes_ciphertext"],
+        "envelope": envelopes.get(fields["envelope_id"]),
+        "envelope_seq": fields["envelope_seq"]
+    }
+
+def _fetch_keys(cursor, key_ids):
+    key_ids = [key_id for key_id in set(key_ids) if key_id is not None]
+    if not key_ids:
+        return {}
+    placeholders = ",".join("?" * len(key_ids))
+    cursor.execute(f"SELECT id, algorithm, public_key FROM public_keys WHERE id IN ({placeholders})", key_ids)
+    return {key_id: (algorithm, bytes(public_key)) for key_id, algorithm, public_key in cursor.fetchall()}
+
+def _fetch_envelopes(cursor, envelope_ids):
+    envelope_ids = [envelope_id for envelope_id in set(envelope_ids) if envelope_id is not None]
+    if not envelope_ids:
+        return {}
+    placeholders = ",".join("?" * len(envelope_ids))
+    cursor.execute(f"""
+        SELECT id, batch_uid, rsa_encrypted_key, oqs_ciphertext, pqc_wrapped_key
+        FROM envelope_batches WHERE id IN ({placeholders})
+    """, envelope_ids)
+    return {
+        envelope_id: {
+            "id": envelope_id,
+            "batch_uid": bytes(batch_uid),
+            "rsa_encrypted_key": bytes(rsa_encrypted_key),
+            "oqs_ciphertext": bytes(oqs_ciphertext),
+            "pqc_wrapped_key": bytes(pqc_wrapped_key)
+        }
+        for envelope_id, batch_uid, rsa_encrypted_key, oqs_ciphertext, pqc_wrapped_key in cursor.fetchall()
+    }
+
+# ✅ Read path over both layouts; returns records (bytes fields) in the order of ids, skipping unknown ids
+def fetch_transactions(db, ids):
+    ids = list(ids)
+    cursor = db.cursor()
+    found = {}
+    for start in range(0, len(ids), MAX_IDS_PER_QUERY):
+        found.update(_fetch_slice(cursor, ids[start:start + MAX_IDS_PER_QUERY]))
+    return [found[i] for i in ids if i in found]
+
+def _fetch_slice(cursor, ids):
+    found = {}
+    placeholders = ",".join("?" * len(ids))
+    cursor.execute(f"SELECT {V2_COLUMNS} FROM secure_transactions_v2 WHERE id IN ({placeholders})", ids)
+    v2_rows = cursor.fetchall()
+    keys = _fetch_keys(cursor, [row[2] for row in v2_rows] + [row[5] for row in v2_rows])
+    envelopes = _fetch_envelopes(cursor, [row[8] for row in v2_rows])
+    for row in v2_rows:
+        found[row[0]] = _v2_record(row, keys, envelopes)
+
+    missing = [i for i in ids if i not in found]
+    if missing:
+        placeholders = ",".join("?" * len(missing))
+        cursor.execute(f"""
+            SELECT id, transaction_json, rsa_encrypted_key, rsa_ciphertext, pqc_public_key, oqs_ciphertext, aes_ciphertext
+            FROM secure_transactions WHERE id IN ({placeholders})
+        """, missing)
+        for row in cursor.fetchall():
+            found[row[0]] = _v1_record(row)
+
+    missing = [i for i in ids if i not in found]
+    if missing:
+        try:
+            found.update(_fetch_segment_records(cursor, missing))
+        except FileNotFoundError:
+            # Compaction moved a frame between the index lookup and the read; the index now has its new place
+            found.update(_fetch_segment_records(cursor, missing))
+    return found
+
+def _fetch_segment_records(cursor, ids):
+    cursor.execute("""
+        SELECT first_id, record_count, segment, frame_offset, frame_length FROM segment_batches
+        WHERE first_id <= ? AND first_id + record_count > ? ORDER BY first_id
+    """, (max(ids), min(ids)))
+    batches = cursor.fetchall()
+    if not batches:
+        return {}
+    first_ids = [batch[0] for batch in batches]
+    wanted = {}
+    for transaction_id in ids:
+        i = bisect.bisect_right(first_ids, transaction_id) - 1
+        if i >= 0 and transaction_id < batches[i][0] + batches[i][1]:
+            wanted.setdefault(i, []).append(transaction_id)
+
+    fields = {}
+    for i, transaction_ids in wanted.items():
+        first_id, _, segment, frame_offset, frame_length = batches[i]
+        records = segment_log.read_records(segment, frame_offset, frame_length, [t - first_id for t in transaction_ids])
+        for transaction_id in transaction_ids:
+            fields[transaction_id] = records[transaction_id - first_id]
+    keys = _fetch_keys(cursor, [f["rsa_key_id"] for f in fields.values()] + [f["pqc_key_id"] for f in fields.values()])
+    envelopes = _fetch_envelopes(cursor, [f["envelope_id"] for f in fields.values()])
+    return {transaction_id: _segment_record(transaction_id, f, keys, envelopes) for transaction_id, f in fields.items()}
+
+def get_transaction(db, transaction_id):
+    records = fetch_transactions(db, [transaction_id])
+    return records[0] if records else None
+
+def _reserve_ids(cursor, count):
+    """First of count new transaction ids, taken from secure_transactions_v2's AUTOINCREMENT sequence."""
+    cursor.execute(
+        "UPDATE sqlite_sequence SET seq = seq + ? WHERE name = 'secure_transactions_v2' RETURNING seq", (count,)
+    )
+    row = cursor.fetchone()
+    if row is not None:
+        return row[0] - count + 1
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM secure_transactions_v2")
+    last_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('secure_transactions_v2', ?)", (last_id + count,))
+    return last_id + 1
+
+def _repoint_batches(conn, moves):
+    conn.executemany(
+        "UPDATE segment_batches SET segment = ?, frame_offset = ? WHERE id = ? AND segment = ? AND frame_offset = ?",
+        moves
+    )
+
+class TransactionStore(ABC):
+    """
+    Where engine rows go. insert_transactions / insert_envelope_batch take the same rows as the
+    module functions above and run inside a DB writer transaction (caller commits); reads always
+    go through fetch_transactions, which covers every backend.
+    """
+    name = None
+
+    @abstractmethod
+    def insert_transactions(self, cursor, rows):
+        """Store engine rows, each with its own RSA/KEM ciphertexts."""
+
+    @abstractmethod
+    def insert_envelope_batch(self, cursor, header, rows):
+        """Returns the envelope_batches id of the inserted header."""
+
+    def compact(self):
+        """Reclaim dead space; returns bytes freed."""
+        return 0
+
+    def stop(self):
+        pass
+
+    def stats(self):
+        return {"backend": self.name}
+
+class SQLiteStore(TransactionStore):
+    """Default: one secure_transactions_v2 row per transaction."""
+    name = "sqlite"
+
+    def insert_transactions(self, cursor, rows):
+        insert_transactions(cursor, rows)
+
+    def insert_envelope_batch(self, cursor, header, rows):
+        return insert_envelope_batch(cursor, header, rows)
+
+class SegmentStore(TransactionStore):
+    """
+    Each inserted batch is one frame appended to a segment file plus one segment_batches row,
+    instead of a B-tree insert per transaction. Public keys, key secrets and envelope headers
+    stay in SQLite.
+    """
+    name = "segments"
+
+    def __init__(self, log, writer):
+        self.log = log
+        # fsync appended frames before the transaction holding their index rows commits
+        writer.add_commit_hook(log.sync)
+        self.compactions = 0
+        self.reclaimed_bytes = 0
+        self.truncated_bytes = 0
+
+    def insert_transactions(self, cursor, rows):
+        key_ids = {}
+        records = [
+            (
+                resolve_key_id(cursor, RSA_KEY_ALGORITHM, rsa_public_key, key_ids, rsa_private_key),
+                resolve_key_id(cursor, KEM_ALGORITHM, pqc_public_key, key_ids, pqc_secret_key),
+                None, None,
+                transaction_json, rsa_encrypted_key, rsa_ciphertext, oqs_ciphertext, aes_ciphertext
+            )
+            for (transaction_json, rsa_public_key, rsa_encrypted_key, rsa_ciphertext, pqc_public_key, oqs_ciphertext,
+                 aes_ciphertext, rsa_private_key, pqc_secret_key) in rows
+        ]
+        self._append(cursor, records)
+
+    def insert_envelope_batch(self, cursor, header, rows):
+        envelope_id, rsa_key_id, pqc_key_id = _insert_envelope_header(cursor, header, len(rows))
+        self._append(cursor, [
+            (rsa_key_id, pqc_key_id, envelope_id, seq, transaction_json, None, None, None, ciphertext)
+            for transaction_json, seq, ciphertext in rows
+        ])
+        return envelope_id
+
+    def _append(self, cursor, records):
+        if not records:
+            return
+        first_id = _reserve_ids(cursor, len(records))
+        frame = encode_frame(records)
+        segment, frame_offset = self.log.append(frame)
+        cursor.execute("""
+            INSERT INTO segment_batches (first_id, record_count, segment, frame_offset, frame_length)
+            VALUES (?, ?, ?, ?, ?)
+        """, (first_id, len(records), segment, frame_offset, len(frame)))
+
+    def _lock(self):
+        """Exclusive flock on SEGMENT_DIR/compact.lock (one compacting process at a time), or None if taken."""
+        os.makedirs(self.log.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.log.directory, "compact.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    # ✅ Recovery, then compaction, of the segments no writer holds
+    def compact(self):
+        lock = self._lock()
+        if lock is None:
+            return 0
+        sealed = {}
+        try:
+            self.log.remove_stale_temp_files()
+            sealed = self.log.sealed_segments()
+            frames = self._indexed_frames(list(sealed))
+            return self._recover(sealed, frames) + self._compact(sealed, frames)
+        finally:
+            for fd in sealed.values():
+                os.close(fd)
+            os.close(lock)
+
+    def _indexed_frames(self, segments):
+        """{segment: [(batch id, offset, length)]} from segment_batches."""
+        frames = {}
+        if not segments:
+            return frames
+        db = db_pool.acquire()
+        try:
+            for start in range(0, len(segments), MAX_IDS_PER_QUERY):
+                chunk = segments[start:start + MAX_IDS_PER_QUERY]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = db.execute(f"""
+                    SELECT id, segment, frame_offset, frame_length FROM segment_batches
+                    WHERE segment IN ({placeholders}) ORDER BY segment, frame_offset
+                """, chunk)
+                for batch_id, segment, frame_offset, frame_length in cursor.fetchall():
+                    frames.setdefault(segment, []).append((batch_id, frame_offset, frame_length))
+        finally:
+            db_pool.release(db)
+        return frames
+
+    def _recover(self, sealed, frames):
+        """Cut what a crashed writer left after a segment's last indexed frame (torn or never committed)."""
+        truncated = 0
+        for segment, fd in sealed.items():
+            live_end = max((offset + length for _, offset, length in frames.get(segment, [])), default=0)
+            removed = self.log.truncate_after(segment, fd, live_end)
+            if removed:
+                truncated += removed
+                logger.warning(f"⚠️ Recovered segment {segment}: truncated {removed} unindexed bytes")
+        self.truncated_bytes += truncated
+        return truncated
+
+    def _compact(self, sealed, frames):
+        reclaimed = 0
+        candidates = []
+        for segment, fd in sealed.items():
+            size = os.fstat(fd).st_size
+            live = frames.get(segment, [])
+            live_bytes = sum(length for _, _, length in live)
+            if not live:
+                self.log.delete(segment)
+                reclaimed += size
+            elif size < config.SEGMENT_COMPACT_SMALL_BYTES or live_bytes < config.SEGMENT_COMPACT_MIN_LIVE_RATIO * size:
+                candidates.append((segment, size, live_bytes))
+        # Only worth it if something is reclaimed: dead space, or small segments packing into fewer
+        dead_bytes = sum(size - len(SEGMENT_MAGIC) - live_bytes for _, size, live_bytes in candidates)
+        lengths = [length for segment, _, _ in candidates for _, _, length in frames[segment]]
+        if not dead_bytes and self.log.packed_segments(lengths) >= len(candidates):
+            candidates = []
+
+        if candidates:
+            moved = [(batch_id, segment, offset, length) for segment, _, _ in candidates
+                     for batch_id, offset, length in frames[segment]]
+            locations, outputs = self.log.rewrite([(segment, offset, length) for _, segment, offset, length in moved])
+            try:
+                db_writer.submit(_repoint_batches, [
+                    (new_segment, new_offset, batch_id, segment, offset)
+                    for (batch_id, segment, offset, _), (new_segment, new_offset) in zip(moved, locations)
+                ]).result()
+            except BaseException:
+                for name, fd in outputs:
+                    os.close(fd)
+                    self.log.delete(name)
+                raise
+            for name, fd in outputs:
+                reclaimed -= os.fstat(fd).st_size
+                os.close(fd)
+            for segment, size, _ in candidates:
+                self.log.delete(segment)
+                reclaimed += size
+            logger.info(f"🗜️ Compacted {len(candidates)} segments into {len(outputs)} ({len(moved)} frames)")
+
+        if reclaimed:
+            self.compactions += 1
+            self.reclaimed_bytes += reclaimed
+        return reclaimed
+
+    def stop(self):
+        self.log.close()
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            **self.log.stats(),
+            "compactions": self.compactions,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "truncated_bytes": self.truncated_bytes
+        }
+
+STORAGE_BACKENDS = ("sqlite", "segments")
+
+def build_store():
+    if config.STORAGE_BACKEND not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {config.STORAGE_BACKEND}")
+    if config.STORAGE_BACKEND == "segments":
+        return SegmentStore(segment_log, db_writer)
+    return SQLiteStore()
+
+# ✅ Global store the write paths (single route, coalescer, bulk loads) insert through
+transaction_store = build_store()
@@ -0,0 +1,246 @@
+"""
+Prometheus text-format metrics (exposition format 0.0.4) without a client library.
+
+Crypto stages, DB writes and requests observe into fixed-bucket histograms kept in this
+process. Process-pool workers return their observations with each chunk (drain/merge) so
+/metrics covers encryption wherever it ran. The endpoint label comes from the
+current_endpoint context variable, set per request by RequestMetricsMiddleware and carried
+onto the crypto executor threads. It is the matched route template (/jobs/{job_id}), never
+the raw path, so label cardinality stays bounded.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from starlette.routing import Match
+
+# Seconds; crypto stages sit in the 10µs..50ms range, requests and commits go higher
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+# Endpoint whose work is being done; "background" for key pool refills, resumed jobs, etc.
+current_endpoint = contextvars.ContextVar("current_endpoint", default="background")
+
+INF_LABEL = 'le="+Inf"'
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._le = [f'le="{bound}"' for bound in self.buckets]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [per-bucket counts (last one is +Inf), sum, count]
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def drain(self):
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    # ✅ {labels: (count, sum)}; diff two of these to get the activity in between
+    def totals(self):
+        with self._lock:
+            return {labels: (count, total) for labels, (_, total, count) in self._series.items()}
+
+    def merge(self, series):
+        with self._lock:
+            for labels, (counts, total, count) in series.items():
+                mine = self._series.get(labels)
+                if mine is None:
+                    mine = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                for index, n in enumerate(counts):
+                    mine[0][index] += n
+                mine[1] += total
+                mine[2] += count
+
+    def render(self, lines):
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in sorted(series):
+            cumulative = 0
+            for le, n in zip(self._le, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, INF_LABEL)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def drain(self):
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    def merge(self, series):
+        with self._lock:
+            for labels, value in series.items():
+                self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self, lines):
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, value in series:
+            lines.append(f"{self.name}_total{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def histogram(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        return self._metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name, help, labelnames):
+        return self._metrics.setdefault(name, Counter(name, help, labelnames))
+
+    # ✅ Observations since the last drain (worker processes ship these to the API process)
+    def drain(self):
+        return {name: metric.drain() for name, metric in self._metrics.items()}
+
+    def merge(self, drained):
+        for name, series in drained.items():
+            if series and name in self._metrics:
+                self._metrics[name].merge(series)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            metric.render(lines)
+        lines.append("")
+        return "\n".join(lines)
+
+registry = Registry()
+
+crypto_stage_seconds = registry.histogram(
+    "pqc_crypto_stage_seconds",
+    "Time spent in each crypto stage (rsa_keygen, rsa_oaep_wrap/unwrap, aes_gcm(_decrypt), kem_keygen, kem_encap/decap, sha256_kdf).",
+    ["stage", "algorithm", "endpoint"]
+)
+crypto_errors = registry.counter(
+    "pqc_crypto_errors",
+    "Failed encryptions by algorithm.",
+    ["algorithm", "endpoint"]
+)
+db_write_seconds = registry.histogram(
+    "pqc_db_write_seconds",
+    "Time a write function (inserts) spent inside the DB writer transaction.",
+    ["function", "endpoint"]
+)
+db_commit_seconds = registry.histogram(
+    "pqc_db_commit_seconds",
+    "Time spent in COMMIT per DB writer transaction.",
+    []
+)
+db_writes = registry.counter(
+    "pqc_db_writes",
+    "Write functions run by the DB writer, by outcome.",
+    ["function", "status"]
+)
+request_seconds = registry.histogram(
+    "pqc_http_request_duration_seconds",
+    "HTTP request handling time.",
+    ["endpoint", "method"]
+)
+http_requests = registry.counter(
+    "pqc_http_requests",
+    "HTTP requests by endpoint, method and status code.",
+    ["endpoint", "method", "status"]
+)
+
+def observe_stage(stage, algorithm, seconds):
+    crypto_stage_seconds.observe(seconds, stage, algorithm, current_endpoint.get())
+
+@contextmanager
+def stage(name, algorithm):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, algorithm, time.perf_counter() - start)
+
+def render():
+    return registry.render()
+
+def route_template(scope):
+    """Path template of the route that will handle the request (/jobs/{job_id}), or "unmatched"."""
+    router = getattr(scope.get("app"), "router", None)
+    partial = None
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match is Match.FULL:
+            return route.path
+        if match is Match.PARTIAL and partial is None:
+            # Right path, wrong method: the router answers 405 from this route
+            partial = route.path
+    return partial or "unmatched"
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware: times each request and tags the work it triggers with its endpoint."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = [500]
+        # Route template, never the raw path, so every label keeps bounded cardinality
+        endpoint = route_template(scope)
+        token = current_endpoint.set(endpoint)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_endpoint.reset(token)
+            request_seconds.observe(time.perf_counter() - start, endpoint, scope["method"])
+            http_requests.inc(endpoint, scope["method"], str(status[0]))
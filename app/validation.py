@@ -0,0 +1,189 @@
+"""
+Columnar validation and serialization of bulk record batches.
+
+A batch (a CSV DataFrame chunk or a list of JSON objects) is checked one column at a time
+with pandas/NumPy against the Transaction schema: every field present and non-null,
+coercible to its declared type, within range (RANGES) and, for the date fields, in the
+expected format (DATE_FORMATS). Failing rows are reported by index with the first problem
+found; the rest are serialized, again column-wise, into the RECORD_FORMAT payloads that are
+encrypted and stored as-is: binary records (app/codec.py) or canonical JSON (Transaction field
+order, json.dumps formatting).
+"""
+import json
+import re
+import numpy as np
+import pandas as pd
+from app import config
+from app.codec import encode_rows
+from app.models import Transaction
+
+FIELDS = list(Transaction.__annotations__)
+FIELD_TYPES = dict(Transaction.__annotations__)
+
+# Inclusive (min, max) bounds; None = unbounded
+RANGES = {
+    "amt": (0, None),
+    "zip": (0, 99999),
+    "lat": (-90, 90),
+    "long": (-180, 180),
+    "city_pop": (0, None),
+    "unix_time": (0, None),
+    "merch_lat": (-90, 90),
+    "merch_long": (-180, 180),
+    "is_fraud": (0, 1)
+}
+
+DATE_FORMATS = {
+    "trans_date_trans_time": "%Y-%m-%d %H:%M:%S",
+    "dob": "%Y-%m-%d"
+}
+
+# Characters json.dumps would escape (quotes, backslashes, control and non-ASCII characters)
+NEEDS_ESCAPE = re.compile(r'["\\\x00-\x1f\x7f-\U0010ffff]')
+
+class _Problems:
+    """First problem per row, filled one column-wide check at a time."""
+
+    def __init__(self, size):
+        self.bad = np.zeros(size, dtype=bool)
+        self.reasons = np.empty(size, dtype=object)
+
+    def add(self, mask, reason):
+        mask = np.asarray(mask, dtype=bool)
+        new = mask & ~self.bad
+        self.reasons[new] = reason
+        self.bad |= mask
+
+def _columns(batch):
+    """{field: NumPy array} for the batch, plus positions of records that aren't objects."""
+    if isinstance(batch, pd.DataFrame):
+        # CSV headers are matched like app/ingest.py's header check does: ignoring surrounding whitespace
+        frame = batch.rename(columns=lambda column: column.strip() if isinstance(column, str) else column)
+        frame = frame.reindex(columns=FIELDS)
+        not_objects = []
+    else:
+        not_objects = [i for i, record in enumerate(batch) if not isinstance(record, dict)]
+        if not_objects:
+            skip = set(not_objects)
+            batch = [record if i not in skip else {} for i, record in enumerate(batch)]
+        frame = pd.DataFrame.from_records(batch, columns=FIELDS, coerce_float=False)
+    columns = {}
+    for name in FIELDS:
+        column = frame[name]
+        numeric = pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column)
+        # Plain object arrays: pandas string dtypes are much slower for the checks below
+        columns[name] = column.to_numpy() if numeric else column.to_numpy(dtype=object)
+    return columns, not_objects
+
+def _coerce(values, field_type, problems, name):
+    """values converted to field_type; entries that can't be are flagged (and left NaN/None)."""
+    if field_type is str:
+        if values.dtype.kind in "iub":
+            return values.astype(str).astype(object)
+        if values.dtype.kind == "f":
+            # e.g. a CSV cc_num column with gaps: stringified, as the Transaction model does
+            return np.array([_number_text(v) if v == v else None for v in values], dtype=object)
+        if pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty"):
+            return values
+        text = values.copy()
+        for i, value in enumerate(values):
+            if isinstance(value, str) or value is None or value != value:
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value):
+                text[i] = _number_text(value)
+            else:
+                text[i] = None
+        problems.add(pd.isna(text) & ~pd.isna(values), f"{name} must be a string")
+        return text
+
+    if values.dtype.kind in "iub":
+        return values.astype("int64") if field_type is int else values.astype("float64")
+    numeric = values if values.dtype.kind == "f" else pd.to_numeric(values, errors="coerce").astype("float64")
+    finite = np.isfinite(numeric)
+    invalid = ~pd.isna(values) & ~finite
+    if field_type is int:
+        invalid |= finite & (np.mod(numeric, 1, where=finite, out=np.zeros_like(numeric)) != 0)
+    problems.add(invalid, f"{name} must be {'an integer' if field_type is int else 'a number'}")
+    return numeric
+
+def _number_text(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+# ✅ Validate a batch and serialize its valid rows; returns (payloads, positions, rejected)
+def validate_batch(batch):
+    """
+    payloads: each valid row encoded in RECORD_FORMAT, in batch order
+    positions: index in the batch of each payload
+    rejected: (index, reason) for every invalid row
+    """
+    raw, not_objects = _columns(batch)
+    size = len(raw[FIELDS[0]])
+    problems = _Problems(size)
+    problems.add(np.isin(np.arange(size), not_objects), "record is not a JSON object")
+
+    columns = {}
+    for name in FIELDS:
+        missing = pd.isna(raw[name])
+        problems.add(missing, f"{name} is missing")
+        columns[name] = value = _coerce(raw[name], FIELD_TYPES[name], problems, name)
+
+        if name in RANGES:
+            low, high = RANGES[name]
+            with np.errstate(invalid="ignore"):
+                if low is not None:
+                    problems.add(value < low, f"{name} must be >= {low}")
+                if high is not None:
+                    problems.add(value > high, f"{name} must be <= {high}")
+        if name in DATE_FORMATS:
+            parsed = pd.to_datetime(pd.Series(value).where(~missing), format=DATE_FORMATS[name], errors="coerce")
+            problems.add(~missing & parsed.isna().to_numpy(), f"{name} must match {DATE_FORMATS[name]}")
+
+    valid = ~problems.bad
+    positions = np.flatnonzero(valid).tolist()
+    rejected = [(int(i), problems.reasons[i]) for i in np.flatnonzero(problems.bad)]
+    if not positions:
+        return [], positions, rejected
+    valid_columns = {name: value[valid] for name, value in columns.items()}
+    if config.RECORD_FORMAT == "json":
+        return _serialize(valid_columns), positions, rejected
+    return encode_rows(zip(*_python_values(valid_columns)), config.RECORD_COMPRESSION), positions, rejected
+
+def _python_values(columns):
+    """Each column as a list of plain Python values of its field type, in FIELDS order."""
+    values = []
+    for name in FIELDS:
+        field_type = FIELD_TYPES[name]
+        column = columns[name]
+        if field_type is int:
+            values.append(column.astype("int64").tolist())
+        elif field_type is float:
+            values.append(column.astype("float64").tolist())
+        else:
+            values.append(column.tolist())
+    return values
+
+def _serialize(columns):
+    """One row template for the whole batch, filled with each row's values: json.dumps output, without per-row dumps."""
+    parts = []
+    values = []
+    for name in FIELDS:
+        column = columns[name]
+        field_type = FIELD_TYPES[name]
+        if field_type is str:
+            strings = column.tolist()
+            # One scan of the whole column decides whether any value needs JSON escaping
+            if NEEDS_ESCAPE.search("".join(strings)):
+                parts.append(f"{json.dumps(name)}: %s")
+                values.append([json.dumps(s) for s in strings])
+            else:
+                parts.append(f'{json.dumps(name)}: "%s"')
+                values.append(strings)
+        elif field_type is int:
+            parts.append(f"{json.dumps(name)}: %d")
+            values.append(column.astype("int64").tolist())
+        else:
+            # %r of a float is its repr, which is what json.dumps writes
+            parts.append(f"{json.dumps(name)}: %r")
+            values.append(column.astype("float64").tolist())
+    template = "{" + ", ".join(parts) + "}"
+    return [(template % row).encode() for row in zip(*values)]
@@ -0,0 +1,12 @@
+import os
+import tempfile
+
+# app.config reads the environment at import time: keep every test database, segment and
+# spool file out of the working tree
+_DATA_DIR = tempfile.mkdtemp(prefix="pqc-tests-")
+os.environ.setdefault("DB_PATH", os.path.join(_DATA_DIR, "creditcard.db"))
+os.environ.setdefault("METRICS_DB_PATH", os.path.join(_DATA_DIR, "metrics.db"))
+os.environ.setdefault("SEGMENT_DIR", os.path.join(_DATA_DIR, "segments"))
+os.environ.setdefault("BULK_JOB_SPOOL_DIR", os.path.join(_DATA_DIR, "bulk_jobs"))
+os.environ.setdefault("SUBSCRIBER_SPOOL_DIR", os.path.join(_DATA_DIR, "subscriber_spool"))
+os.environ.setdefault("KEY_STORE_MASTER_KEY_FILE", os.path.join(_DATA_DIR, "keystore.key"))
@@ -0,0 +1,176 @@
+import json
+import math
+import random
+import struct
+
+import pytest
+
+from app import codec, config
+from app.codec import (
+    BITMAP_BYTES, FIELDS, FIELD_TYPES, FLAG_DEFLATE, RECORD_VERSION, CodecError, decode_record, encode_record,
+    encode_rows, encode_transaction, storage_value
+)
+from app.models import Transaction
+
+SAMPLE = {
+    "trans_date_trans_time": "2019-01-01 00:00:18", "cc_num": "2703186189652095",
+    "merchant": "fraud_Rippin, Kub and Mann", "category": "misc_net", "amt": 4.97, "first": "Jennifer",
+    "last": "Banks", "gender": "F", "street": "561 Perry Cove", "city": "Moravian Falls", "state": "NC",
+    "zip": 28654, "lat": 36.0788, "long": -81.1781, "city_pop": 3495, "job": "Psychologist, counselling",
+    "dob": "1988-03-09", "trans_num": "0b242abb623afc578575680df30655b9", "unix_time": 1325376018,
+    "merch_lat": 36.011293, "merch_long": -82.048315, "is_fraud": 0
+}
+
+def values(record):
+    return [record[name] for name in FIELDS]
+
+def with_field(name, value):
+    return {**SAMPLE, name: value}
+
+def same(a, b):
+    """Field-by-field equality where floats must match bit for bit (so -0.0 != 0.0 and nan == nan)."""
+    for name in FIELDS:
+        x, y = a[name], b[name]
+        if FIELD_TYPES[name] is float:
+            if struct.pack("<d", x) != struct.pack("<d", y):
+                return False
+        elif type(x) is not type(y) or x != y:
+            return False
+    return True
+
+def packed_bits(data):
+    assert data[0] == RECORD_VERSION and not data[1] & FLAG_DEFLATE
+    return int.from_bytes(data[2:2 + BITMAP_BYTES], "little")
+
+def is_packed(data, name):
+    return bool(packed_bits(data) & 1 << FIELDS.index(name))
+
+def roundtrip(record, compress=False):
+    data = encode_record(values(record), compress)
+    decoded = decode_record(data)
+    assert same(decoded, record), (record, decoded)
+    return data
+
+def test_sample_roundtrip_is_compact():
+    data = roundtrip(SAMPLE)
+    assert len(data) < len(json.dumps(SAMPLE)) / 2
+    assert all(is_packed(data, name) for name in ("trans_date_trans_time", "dob", "cc_num", "trans_num", "amt", "lat"))
+
+@pytest.mark.parametrize("value", [
+    0, 1, -1, 63, -64, 64, -65, 127, 128, 8191, 8192, 2 ** 31 - 1, -2 ** 31, 2 ** 63 - 1, -2 ** 63, 2 ** 80, -2 ** 80
+])
+def test_int_varint_zigzag_edges(value):
+    roundtrip(with_field("zip", value))
+    assert codec._unzigzag(codec._zigzag(value)) == value
+    out = bytearray()
+    codec._put_varint(out, codec._zigzag(value))
+    assert codec._get_varint(out, 0) == (codec._zigzag(value), len(out))
+
+@pytest.mark.parametrize("value", [0.0, 4.97, -81.1781, 36.011293, 1.5, -0.5, 123456789.0, 0.123456789012345, 1e15])
+def test_short_decimals_are_scaled(value):
+    assert is_packed(roundtrip(with_field("amt", value)), "amt")
+
+@pytest.mark.parametrize("value", [
+    -0.0, 0.1 + 0.2, 1e-5, 1e20, 5e-324, 1.7976931348623157e308, 2 / 3, math.inf, -math.inf, math.nan
+])
+def test_other_floats_stay_raw_doubles(value):
+    assert not is_packed(roundtrip(with_field("lat", value)), "lat")
+
+@pytest.mark.parametrize("name,value,packed", [
+    ("trans_date_trans_time", "1970-01-01 00:00:00", True),
+    ("trans_date_trans_time", "1969-12-31 23:59:59", True),
+    ("trans_date_trans_time", "0001-01-01 00:00:00", True),
+    ("trans_date_trans_time", "9999-12-31 23:59:59", True),
+    ("trans_date_trans_time", "2019-02-30 00:00:00", False),
+    ("trans_date_trans_time", "2019-01-01 24:00:00", False),
+    ("trans_date_trans_time", "2019-01-01T00:00:18", False),
+    ("trans_date_trans_time", "2019-01-01 00:00:18.5", False),
+    ("dob", "1901-01-01", True),
+    ("dob", "1988-3-9", False),
+    ("dob", "", False),
+    ("cc_num", "0", True),
+    ("cc_num", "9" * 38, True),
+    ("cc_num", "9" * 39, False),
+    ("cc_num", "0123", False),
+    ("cc_num", "-5", False),
+    ("cc_num", "4111 1111", False),
+    ("cc_num", "٣٤٥", False),
+    ("trans_num", "0" * 32, True),
+    ("trans_num", "0B242ABB623AFC578575680DF30655B9", False),
+    ("trans_num", "0b242abb623afc578575680df30655b", False),
+    ("trans_num", "t0", False),
+    ("merchant", "Café Zürich – 東京", False),
+    ("street", "", False)
+])
+def test_string_packing_and_utf8_fallback(name, value, packed):
+    assert is_packed(roundtrip(with_field(name, value)), name) == packed
+
+def test_compression_is_used_only_when_smaller(monkeypatch):
+    plain = roundtrip(SAMPLE)
+    compressed = roundtrip(SAMPLE, compress=True)
+    assert compressed[1] & FLAG_DEFLATE
+    assert len(compressed) < len(plain)
+
+    monkeypatch.setattr(codec, "_deflate", lambda body: body + b"\x00")
+    assert encode_record(values(SAMPLE), compress=True) == plain
+
+def test_random_records_roundtrip():
+    rng = random.Random(20240601)
+    text = "abcxyz 0123-:_,.éß東"
+
+    def random_value(name):
+        kind = FIELD_TYPES[name]
+        if kind is int:
+            return rng.choice([rng.randint(-300, 300), rng.randint(-2 ** 64, 2 ** 64)])
+        if kind is float:
+            return rng.choice([round(rng.uniform(-180, 180), rng.randint(0, 8)), rng.uniform(-1e6, 1e6),
+                               rng.choice([-0.0, math.inf, math.nan])])
+        if name == "trans_num" and rng.random() < 0.5:
+            return "%032x" % rng.getrandbits(128)
+        if name == "cc_num" and rng.random() < 0.5:
+            return str(rng.getrandbits(rng.randint(1, 120)))
+        if name == "trans_date_trans_time" and rng.random() < 0.5:
+            return "%04d-%02d-%02d %02d:%02d:%02d" % (rng.randint(1, 9999), rng.randint(1, 12), rng.randint(1, 31),
+                                                      rng.randint(0, 25), rng.randint(0, 59), rng.randint(0, 60))
+        if name == "dob" and rng.random() < 0.5:
+            return "%04d-%02d-%02d" % (rng.randint(1, 9999), rng.randint(1, 13), rng.randint(1, 31))
+        return "".join(rng.choice(text) for _ in range(rng.randint(0, 40)))
+
+    records = [{name: random_value(name) for name in FIELDS} for _ in range(500)]
+    for compress in (False, True):
+        for record, data in zip(records, encode_rows([values(r) for r in records], compress)):
+            assert same(decode_record(data), record)
+
+@pytest.mark.parametrize("as_type", [str, bytes, bytearray, memoryview])
+def test_json_records_decode(as_type):
+    text = json.dumps(SAMPLE)
+    data = as_type(text) if as_type is str else as_type(text.encode())
+    assert decode_record(data) == SAMPLE
+
+def test_encode_transaction_follows_record_format(monkeypatch):
+    transaction = Transaction(**SAMPLE)
+    monkeypatch.setattr(config, "RECORD_FORMAT", "json")
+    payload = encode_transaction(transaction)
+    assert storage_value(payload) == payload.decode()
+    assert decode_record(storage_value(payload)) == SAMPLE
+
+    monkeypatch.setattr(config, "RECORD_FORMAT", "binary")
+    payload = encode_transaction(transaction)
+    assert storage_value(payload) is payload
+    assert same(decode_record(payload), SAMPLE)
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:1],
+    lambda data: data[:-3],
+    lambda data: data + b"\x00",
+    lambda data: bytes([RECORD_VERSION + 1]) + data[1:],
+    lambda data: data[:-1] + b"\x80"
+])
+def test_corrupt_records_raise_codec_error(corrupt):
+    with pytest.raises(CodecError):
+        decode_record(corrupt(encode_record(values(SAMPLE))))
+
+def test_corrupt_compressed_record_raises_codec_error():
+    data = encode_record(values(SAMPLE), compress=True)
+    with pytest.raises(CodecError):
+        decode_record(data[:2] + bytes(b ^ 0x5A for b in data[2:]))
@@ -0,0 +1,25 @@
+import asyncio
+import json
+
+import pytest
+
+from app.database import ConnectionPool, PoolTimeout
+from app.exceptions import pool_timeout_exception_handler
+
+def test_acquire_times_out_when_pool_is_exhausted():
+    pool = ConnectionPool(1)
+    conn = pool.acquire()
+    try:
+        with pytest.raises(PoolTimeout):
+            pool.acquire(timeout=0.05)
+    finally:
+        pool.release(conn)
+    # Released connections are handed out again
+    assert pool.acquire(timeout=0.05) is conn
+    pool.release(conn)
+
+def test_pool_timeout_maps_to_503():
+    response = asyncio.run(pool_timeout_exception_handler(None, PoolTimeout("busy")))
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert json.loads(response.body)["error"]["message"] == "busy"
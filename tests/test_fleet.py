@@ -0,0 +1,88 @@
+import multiprocessing
+import sqlite3
+import time
+
+from app.fleet import SNAPSHOT_FORMAT_VERSION, SnapshotStore, aggregate_snapshots
+from app.metrics import Benchmark, LatencyHistogram
+
+# Per process: (latencies in ms, errors)
+WORKLOADS = [
+    ([0.5, 1.0, 1.5, 2.0] * 50, 1),
+    ([5.0, 10.0, 20.0] * 40, 0),
+    ([100.0, 250.0] * 10 + [0.1] * 30, 3)
+]
+
+def publish_worker(latencies, errors):
+    # A fresh interpreter: the global benchmarks and snapshot store are this process's own
+    from app.fleet import publish_snapshot, snapshot_store
+    from app.metrics import rsa_benchmark
+    for latency in latencies:
+        rsa_benchmark.record_latency(latency)
+    for _ in range(errors):
+        rsa_benchmark.record_error()
+    publish_snapshot()
+    snapshot_store.close()
+
+def expected_percentiles(latencies):
+    histogram = LatencyHistogram()
+    for latency in latencies:
+        histogram.record(latency)
+    return dict(zip([name for name, _ in Benchmark.PERCENTILES], histogram.percentiles([q for _, q in Benchmark.PERCENTILES])))
+
+def test_snapshots_from_several_processes_merge(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "metrics.db")
+    monkeypatch.setenv("METRICS_DB_PATH", db_path)
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=publish_worker, args=workload) for workload in WORKLOADS]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    store = SnapshotStore(db_path)
+    snapshots = store.load(max_age=60)
+    store.close()
+    assert len(snapshots) == len(WORKLOADS)
+    assert len({snapshot["instance"] for snapshot in snapshots}) == len(WORKLOADS)
+
+    aggregate = aggregate_snapshots(snapshots)
+    rsa = aggregate["RSA"]
+    all_latencies = [latency for latencies, _ in WORKLOADS for latency in latencies]
+    assert rsa["count"] == len(all_latencies)
+    errors = sum(e for _, e in WORKLOADS)
+    assert rsa["error_rate"] == errors / (len(all_latencies) + errors) * 100
+    assert rsa["min_latency"] == min(all_latencies)
+    assert rsa["max_latency"] == max(all_latencies)
+    # Merged histograms give the same percentiles as one histogram over every observation
+    for name, value in expected_percentiles(all_latencies).items():
+        assert rsa[name] == value
+    assert rsa["throughput"] == sum(s["benchmarks"]["RSA"]["throughput"] for s in snapshots)
+    # Rolling windows merge the same way
+    assert rsa["windows"]["1m"]["count"] == len(all_latencies)
+    assert aggregate["PQC"]["count"] == 0
+
+def test_stale_snapshots_are_pruned(tmp_path):
+    db_path = str(tmp_path / "metrics.db")
+    store = SnapshotStore(db_path)
+    now = time.time()
+    fresh = Benchmark(windows=[60])
+    fresh.record_latency(1.0)
+    for instance, published_at, version in [
+        ("live:1", now, SNAPSHOT_FORMAT_VERSION),
+        ("dead:2", now - 120, SNAPSHOT_FORMAT_VERSION),
+        ("future-format:3", now, SNAPSHOT_FORMAT_VERSION + 1)
+    ]:
+        store.publish({"version": version, "instance": instance, "published_at": published_at,
+                       "benchmarks": {"RSA": fresh.snapshot()}})
+
+    snapshots = store.load(max_age=60)
+    store.close()
+
+    assert [snapshot["instance"] for snapshot in snapshots] == ["live:1"]
+    # Expired rows are deleted, not just skipped
+    conn = sqlite3.connect(db_path)
+    instances = {row[0] for row in conn.execute("SELECT instance FROM metrics_snapshots")}
+    conn.close()
+    assert instances == {"live:1", "future-format:3"}
+    assert aggregate_snapshots(snapshots)["RSA"]["count"] == 1
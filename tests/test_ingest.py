@@ -0,0 +1,45 @@
+import io
+import json
+
+import pytest
+
+from app import ingest
+from app.ingest import IngestError, iter_json_array
+
+class CountingStream(io.BytesIO):
+    reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+def parse(text):
+    return list(iter_json_array(io.BytesIO(text.encode())))
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(ingest, "READ_CHUNK_SIZE", 7)
+
+def test_records_cut_by_chunk_boundaries(small_chunks):
+    records = [{"text": "é" * 40 + '"\\', "n": -1.5e-3, "ok": True, "none": None, "nested": [1, {"a": 2}]}] * 5
+    assert parse(" ﻿[ " + " ,\n".join(json.dumps(r) for r in records) + " ] ") == records
+    assert parse("[]") == []
+    assert parse("[ 123 , 45 ]") == [123, 45]
+
+@pytest.mark.parametrize("text", [
+    '[{"a": 1},,{"a": 2}]', '[,{"a": 1}]', '[{"a": 1},]', '[{"a": 1} {"a": 2}]', '[{"a": 1}', '[{"a": 1},', '{"a": 1}'
+])
+def test_malformed_separators(text, small_chunks):
+    with pytest.raises(IngestError):
+        parse(text)
+
+def test_malformed_record_fails_without_reading_the_rest(small_chunks):
+    stream = CountingStream(('[{"a": 1 "b": 2}, ' + ", ".join(['{"a": 1}'] * 10000) + "]").encode())
+    with pytest.raises(IngestError, match="Expecting ','"):
+        list(iter_json_array(stream))
+    assert stream.reads < 10
+
+def test_oversized_record_is_rejected(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_JSON_RECORD_SIZE", 1000)
+    with pytest.raises(IngestError, match="larger than"):
+        parse('[{"a": "' + "x" * 100000 + '"}]')
@@ -0,0 +1,62 @@
+import os
+import time
+
+import pytest
+
+from app import jobs
+from app.database import db_pool, init_db
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    init_db()
+
+@pytest.fixture
+def db():
+    conn = db_pool.acquire()
+    yield conn
+    db_pool.release(conn)
+
+@pytest.fixture
+def spool():
+    return jobs.spool_records([{"n": 1}])
+
+def add_job(db, spool_path, owner=None, lease_until=None, status="running"):
+    job_id = jobs.create_job(db, "a.json", spool_path, 10)
+    db.execute(
+        "UPDATE bulk_jobs SET status = ?, owner = ?, lease_until = ? WHERE id = ?",
+        (status, owner, lease_until, job_id)
+    )
+    db.commit()
+    return job_id
+
+def test_only_one_claim_wins(db, spool):
+    job_id = add_job(db, spool)
+    assert jobs._claim(db, job_id)
+    db.commit()
+    # A live lease, even our own, is never claimed again
+    assert not jobs._claim(db, job_id)
+    assert jobs.get_job(db, job_id)["owner"] == jobs.OWNER_ID
+
+def test_expired_lease_is_claimed(db, spool):
+    job_id = add_job(db, spool, owner="elsewhere:1:dead", lease_until=time.time() - 1)
+    assert jobs._claim_orphaned_jobs() == [job_id]
+    assert jobs.get_job(db, job_id)["owner"] == jobs.OWNER_ID
+    assert jobs._claim_orphaned_jobs() == []
+
+def test_cancel_of_job_owned_elsewhere_only_flags_it(db, spool):
+    job_id = add_job(db, spool, owner="elsewhere:1:live", lease_until=time.time() + 60)
+    assert jobs.cancel_job(db, job_id) == "cancelling"
+    job = jobs.get_job(db, job_id)
+    assert (job["status"], job["cancel_requested"], job["owner"]) == ("running", 1, "elsewhere:1:live")
+    # The owner still needs its spool file
+    assert os.path.exists(spool)
+
+def test_cancel_of_orphaned_job_finishes_it(db, spool):
+    job_id = add_job(db, spool, status="queued")
+    assert jobs.cancel_job(db, job_id) == "cancelled"
+    assert jobs.get_job(db, job_id)["status"] == "cancelled"
+    assert not os.path.exists(spool)
+
+    # An owner finishing late doesn't overwrite the cancellation
+    jobs._finish(db, job_id, "completed")
+    assert jobs.get_job(db, job_id)["status"] == "cancelled"
@@ -0,0 +1,31 @@
+import pytest
+
+from app.metrics import RollingWindow
+
+QUANTILES = [0.5]
+
+def test_throughput_over_uptime_shorter_than_window():
+    window = RollingWindow(60, 12)
+    for _ in range(10):
+        window.record(1.0, now=1000.5)
+    histogram, errors, throughput = window.summary(now=1002.0, started_at=1000.0, quantiles=QUANTILES)
+    assert histogram.count == 10
+    assert throughput == pytest.approx(10 / 2.0)
+
+def test_throughput_over_slots_covered():
+    # 5s slots: at t=1003 the ring covers [945, 1003), 58s, not the nominal 60s
+    window = RollingWindow(60, 12)
+    for t in range(945, 1003):
+        window.record(1.0, now=t + 0.5)
+    histogram, errors, throughput = window.summary(now=1003.0, started_at=0.0, quantiles=QUANTILES)
+    assert histogram.count == 58
+    assert throughput == pytest.approx(1.0)
+
+def test_expired_slots_drop_out():
+    window = RollingWindow(60, 12)
+    window.record(1.0, now=100.0)
+    window.record_error(now=100.0)
+    window.record(1.0, now=170.0)
+    histogram, errors, throughput = window.summary(now=171.0, started_at=0.0, quantiles=QUANTILES)
+    assert (histogram.count, errors) == (1, 0)
+    assert throughput == pytest.approx(1 / 56.0)
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+from app import pubsub_subscriber
+from app.pubsub_subscriber import MemoryQueue, Subscriber
+
+class FakeLoad:
+    """Stands in for BulkLoad: fails the rows listed in fail_once on their first delivery only."""
+
+    fail_once = set()
+    seen = []
+    gate = None
+    in_flight = 0
+    max_in_flight = 0
+
+    def __init__(self, batches_done=0):
+        self.batches = batches_done
+        self.total_rows = self.success = self.fail = 0
+
+    async def process_batch(self, records):
+        cls = type(self)
+        cls.in_flight += 1
+        cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            if cls.gate is not None:
+                await cls.gate.wait()
+            failed = []
+            for position, record in enumerate(records):
+                cls.seen.append(record["n"])
+                if record["n"] in cls.fail_once:
+                    cls.fail_once.discard(record["n"])
+                    failed.append(position)
+            self.total_rows = len(records)
+            self.success = len(records) - len(failed)
+            self.fail = len(failed)
+            return failed
+        finally:
+            cls.in_flight -= 1
+
+    def merge(self, other):
+        self.total_rows += other.total_rows
+        self.success += other.success
+        self.fail += other.fail
+
+@pytest.fixture
+def fake_load(monkeypatch):
+    FakeLoad.fail_once = set()
+    FakeLoad.seen = []
+    FakeLoad.gate = None
+    FakeLoad.in_flight = FakeLoad.max_in_flight = 0
+    monkeypatch.setattr(pubsub_subscriber, "BulkLoad", FakeLoad)
+    return FakeLoad
+
+def publish(queue, count):
+    for n in range(count):
+        queue.publish(json.dumps({"n": n}).encode())
+
+async def run_until(subscriber, done, timeout=10):
+    stop = asyncio.Event()
+    task = asyncio.create_task(subscriber.run(stop))
+    deadline = time.monotonic() + timeout
+    while not done() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    stop.set()
+    await task
+    assert done()
+
+def test_nacked_rows_are_redelivered_and_acked(fake_load):
+    queue = MemoryQueue(ack_deadline_seconds=60)
+    publish(queue, 20)
+    fake_load.fail_once = {3, 17}
+    subscriber = Subscriber(queue, batch_size=5, batch_wait_ms=10, concurrency=2, max_outstanding=10, pull_timeout=0.05)
+
+    asyncio.run(run_until(subscriber, lambda: queue.acked == 20))
+
+    assert queue.redelivered == 2
+    assert queue.backlog() == 0
+    assert sorted(fake_load.seen) == sorted(list(range(20)) + [3, 17])
+    assert subscriber.nacked == 2
+    assert subscriber.acked == 20
+    assert subscriber.outstanding == 0
+    # Per-batch loads are folded into the subscriber's totals
+    assert subscriber.load.success == 20
+    assert subscriber.load.fail == 2
+
+def test_undecodable_messages_are_acked_not_retried(fake_load):
+    queue = MemoryQueue(ack_deadline_seconds=60)
+    queue.publish(b"not json")
+    queue.publish(b"[1, 2]")
+    publish(queue, 3)
+    subscriber = Subscriber(queue, batch_size=5, batch_wait_ms=10, pull_timeout=0.05)
+
+    asyncio.run(run_until(subscriber, lambda: queue.acked == 5))
+
+    assert subscriber.rejected == 2
+    assert queue.redelivered == 0
+    assert sorted(fake_load.seen) == [0, 1, 2]
+
+def test_max_outstanding_stops_pulling(fake_load):
+    queue = MemoryQueue(ack_deadline_seconds=60)
+    publish(queue, 50)
+    subscriber = Subscriber(queue, batch_size=5, batch_wait_ms=10, concurrency=4, max_outstanding=10, pull_timeout=0.05)
+
+    async def scenario():
+        fake_load.gate = asyncio.Event()
+        stop = asyncio.Event()
+        task = asyncio.create_task(subscriber.run(stop))
+        # Every batch is blocked: the worker pulls up to max_outstanding and then waits
+        await asyncio.sleep(0.5)
+        assert subscriber.outstanding == 10
+        assert len(queue._leased) == 10
+        assert fake_load.in_flight == 2
+        assert subscriber.paused > 0
+        fake_load.gate.set()
+        while queue.acked < 50:
+            await asyncio.sleep(0.01)
+        stop.set()
+        await task
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+    assert fake_load.max_in_flight <= 2
+    assert subscriber.acked == 50
+    assert subscriber.outstanding == 0
+
+def test_concurrency_limits_batches_in_flight(fake_load):
+    queue = MemoryQueue(ack_deadline_seconds=60)
+    publish(queue, 40)
+    subscriber = Subscriber(queue, batch_size=5, batch_wait_ms=10, concurrency=2, max_outstanding=40, pull_timeout=0.05)
+
+    async def scenario():
+        fake_load.gate = asyncio.Event()
+        stop = asyncio.Event()
+        task = asyncio.create_task(subscriber.run(stop))
+        await asyncio.sleep(0.5)
+        # Two batches encrypting, a third buffered while waiting for a slot
+        assert fake_load.in_flight == 2
+        assert subscriber.outstanding == 15
+        fake_load.gate.set()
+        while queue.acked < 40:
+            await asyncio.sleep(0.01)
+        stop.set()
+        await task
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+    assert fake_load.max_in_flight == 2
+
+class FakeSubscriberClient:
+    """Records modify_ack_deadline/acknowledge calls; pull hands out the messages in `pending`."""
+
+    def __init__(self):
+        self.pending = []
+        self.deadlines = []
+        self.acked = []
+        self.lock = threading.Lock()
+
+    def pull(self, request, timeout):
+        received = [types.SimpleNamespace(ack_id=ack_id, message=types.SimpleNamespace(data=data))
+                    for ack_id, data in self.pending[:request["max_messages"]]]
+        del self.pending[:request["max_messages"]]
+        return types.SimpleNamespace(received_messages=received)
+
+    def modify_ack_deadline(self, request):
+        with self.lock:
+            self.deadlines.append((tuple(request["ack_ids"]), request["ack_deadline_seconds"]))
+
+    def acknowledge(self, request):
+        self.acked.extend(request["ack_ids"])
+
+    def close(self):
+        pass
+
+    def extended(self, ack_id):
+        with self.lock:
+            return sum(1 for ack_ids, seconds in self.deadlines if ack_id in ack_ids and seconds > 0)
+
+@pytest.fixture
+def pubsub_client(monkeypatch):
+    client = FakeSubscriberClient()
+    pubsub_v1 = types.SimpleNamespace(SubscriberClient=lambda: client)
+    exceptions = types.SimpleNamespace(DeadlineExceeded=type("DeadlineExceeded", (Exception,), {}))
+    monkeypatch.setitem(sys.modules, "google", types.ModuleType("google"))
+    monkeypatch.setitem(sys.modules, "google.api_core", types.ModuleType("google.api_core"))
+    monkeypatch.setitem(sys.modules, "google.api_core.exceptions", exceptions)
+    monkeypatch.setitem(sys.modules, "google.cloud", types.SimpleNamespace(pubsub_v1=pubsub_v1))
+    monkeypatch.setitem(sys.modules, "google.cloud.pubsub_v1", pubsub_v1)
+    return client
+
+def test_pubsub_leases_are_extended_until_ack_or_nack(pubsub_client):
+    pubsub_client.pending = [("a", b"{}"), ("b", b"{}"), ("c", b"{}")]
+    queue = pubsub_subscriber.PubSubQueue("projects/p/subscriptions/s", ack_deadline_seconds=0.15)
+    try:
+        assert [message.ack_id for message in queue.pull(10, 1.0)] == ["a", "b", "c"]
+        # Extended right away on pull, then every third of the deadline
+        assert pubsub_client.deadlines[0] == (("a", "b", "c"), 0.15)
+        queue.ack(["a"])
+        queue.nack(["b"])
+        assert pubsub_client.deadlines[-1] == (("b",), 0)
+        renewed_a, renewed_b = pubsub_client.extended("a"), pubsub_client.extended("b")
+        time.sleep(0.4)
+        assert pubsub_client.extended("c") >= 3
+        assert (pubsub_client.extended("a"), pubsub_client.extended("b")) == (renewed_a, renewed_b)
+        assert pubsub_client.acked == ["a"]
+    finally:
+        queue.close()
+
@@ -0,0 +1,204 @@
+import multiprocessing
+import os
+
+import pytest
+
+from app import config
+from app.database import db_pool, db_writer, init_db
+from app.segments import SEGMENT_MAGIC, SEGMENT_NAME, SegmentError, encode_frame, segment_log
+from app.storage import SegmentStore, TransactionStore, fetch_transactions
+
+# The write paths insert through transaction_store; these tests drive a SegmentStore directly,
+# over the global segment_log (which fetch_transactions reads) pointed at a per-test directory
+store = SegmentStore(segment_log, db_writer)
+
+RSA_PUBLIC_KEY = os.urandom(294)
+PQC_PUBLIC_KEY = os.urandom(800)
+
+def engine_row(n):
+    return (b"\x01\x00plain-%d" % n, RSA_PUBLIC_KEY, os.urandom(256), os.urandom(64),
+            PQC_PUBLIC_KEY, os.urandom(768), os.urandom(64), b"rsa-private", b"pqc-secret")
+
+def insert(rows, fail=False):
+    """Insert rows in one writer transaction; returns their transaction ids."""
+    def write(conn):
+        cursor = conn.cursor()
+        store.insert_transactions(cursor, rows)
+        if fail:
+            raise RuntimeError("rolled back after the frame was appended")
+        cursor.execute("SELECT first_id FROM segment_batches WHERE id = ?", (cursor.lastrowid,))
+        first_id = cursor.fetchone()[0]
+        return list(range(first_id, first_id + len(rows)))
+    return db_writer.submit(write).result()
+
+def fetch(ids):
+    db = db_pool.acquire()
+    try:
+        return {record["id"]: bytes(record["transaction_json"]) for record in fetch_transactions(db, ids)}
+    finally:
+        db_pool.release(db)
+
+def index(ids):
+    db = db_pool.acquire()
+    try:
+        return db.execute(
+            "SELECT segment, frame_offset FROM segment_batches WHERE first_id <= ? AND first_id + record_count > ?",
+            (ids[0], ids[0])
+        ).fetchone()
+    finally:
+        db_pool.release(db)
+
+def seal():
+    """Commit once more (so rolled-over segments unlock) and release the active segment."""
+    db_writer.submit(lambda conn: None).result()
+    segment_log.close()
+
+def continue_numbering(directory):
+    """Every test shares one segment_batches index: start this directory's names after the ones it holds."""
+    db = db_pool.acquire()
+    try:
+        last = db.execute("SELECT max(segment) FROM segment_batches").fetchone()[0]
+    finally:
+        db_pool.release(db)
+    os.makedirs(directory)
+    with open(os.path.join(directory, "sequence"), "wb") as f:
+        f.write(b"%020d" % (int(SEGMENT_NAME.match(last).group(1)) if last else 0))
+
+def segment_sizes(directory):
+    return {name: os.path.getsize(os.path.join(directory, name)) for name in sorted(os.listdir(directory))
+            if name.startswith("seg-")}
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    init_db()
+    yield
+    seal()
+
+@pytest.fixture
+def segments(tmp_path, monkeypatch):
+    directory = str(tmp_path / "segments")
+    continue_numbering(directory)
+    monkeypatch.setattr(segment_log, "directory", directory)
+    monkeypatch.setattr(segment_log, "max_bytes", 16 * 1024)
+    monkeypatch.setattr(config, "SEGMENT_COMPACT_SMALL_BYTES", 8 * 1024)
+    monkeypatch.setenv("SEGMENT_DIR", directory)
+    yield directory
+    seal()
+
+def test_transaction_store_is_abstract():
+    with pytest.raises(TypeError):
+        TransactionStore()
+
+    class Partial(TransactionStore):
+        def insert_transactions(self, cursor, rows):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+
+def test_rolled_back_write_is_dead_space(segments):
+    first = insert([engine_row(n) for n in range(5)])
+    with pytest.raises(RuntimeError):
+        insert([engine_row(n) for n in range(5, 10)], fail=True)
+    second = insert([engine_row(n) for n in range(5, 10)])
+    seal()
+
+    assert fetch(first + second) == {i: b"\x01\x00plain-%d" % n for n, i in enumerate(first + second)}
+    # The rolled-back frame sits between the two live ones: compaction copies the live ones out
+    assert store.compact() > 0
+    assert fetch(first + second) == {i: b"\x01\x00plain-%d" % n for n, i in enumerate(first + second)}
+    assert store.compact() == 0
+
+def crash_after_append(rows_before_crash, results):
+    ids = insert([engine_row(n) for n in range(rows_before_crash)])
+    results.put(ids)
+    # Appended and synced, but its index row never commits
+    segment_log.append(encode_frame([(None, None, None, None, b"never committed", None, None, None, b"x")]))
+    segment_log.sync()
+    os._exit(1)
+
+def test_crashed_writer_tail_is_truncated(segments):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=crash_after_append, args=(3, results))
+    process.start()
+    ids = results.get(timeout=60)
+    process.join(60)
+    assert process.exitcode == 1
+
+    (segment, size), = segment_sizes(segments).items()
+    live_end = size - len(encode_frame([(None, None, None, None, b"never committed", None, None, None, b"x")]))
+    # Small enough to be a compaction candidate, but nothing to merge it with: only the tail goes
+    assert store.compact() == size - live_end
+    assert segment_sizes(segments) == {segment: live_end}
+    assert fetch(ids) == {i: b"\x01\x00plain-%d" % n for n, i in enumerate(ids)}
+
+def insert_in_child(first, count, results):
+    results.put(insert([engine_row(n) for n in range(first, first + count)]))
+    seal()
+    db_writer.stop()
+
+def test_two_processes_write_their_own_segments(segments):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [context.Process(target=insert_in_child, args=(n * 10, 10, results)) for n in range(2)]
+    for process in processes:
+        process.start()
+    ids = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    assert len(segment_sizes(segments)) == 2
+    assert {index(batch)[0] for batch in ids} == set(segment_sizes(segments))
+    everything = [i for batch in ids for i in batch]
+    assert len(fetch(everything)) == 20
+
+def test_compaction_merges_small_segments_and_repoints_index(segments):
+    batches = []
+    for n in range(6):
+        # One segment per batch
+        batches.append(insert([engine_row(n)]))
+        seal()
+    before = segment_sizes(segments)
+    assert len(before) == 6
+    expected = fetch([ids[0] for ids in batches])
+
+    assert store.compact() > 0
+    after = segment_sizes(segments)
+    assert len(after) < len(before)
+    assert not set(after) & set(before)
+    for ids in batches:
+        assert index(ids)[0] in after
+    assert fetch([ids[0] for ids in batches]) == expected
+    assert store.compact() == 0
+
+def test_flipped_byte_fails_the_read(segments):
+    ids = insert([engine_row(n) for n in range(3)])
+    seal()
+    segment = index(ids)[0]
+    path = os.path.join(segments, segment)
+    with open(path, "r+b") as f:
+        f.seek(os.path.getsize(path) - 10)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0x01]))
+    segment_log.forget(segment)
+
+    assert fetch(ids[:2]) == {ids[0]: b"\x01\x00plain-0", ids[1]: b"\x01\x00plain-1"}
+    with pytest.raises(SegmentError, match="checksum"):
+        fetch(ids[2:])
+
+def test_only_one_process_compacts_at_a_time(segments):
+    insert([engine_row(0)])
+    seal()
+    with open(os.path.join(segments, "seg-0000009999.seg"), "wb") as f:
+        f.write(SEGMENT_MAGIC)
+    lock = store._lock()
+    try:
+        assert store._lock() is None
+        assert store.compact() == 0
+        assert "seg-0000009999.seg" in segment_sizes(segments)
+    finally:
+        os.close(lock)
+    assert store.compact() == len(SEGMENT_MAGIC)
@@ -0,0 +1,187 @@
+import errno
+import multiprocessing
+import os
+
+import pytest
+
+from app.segments import FRAME, OFFSET, SEGMENT_MAGIC, SegmentError, SegmentLog, encode_frame, frame_is_valid
+
+def record(n, envelope=False):
+    if envelope:
+        return (1, 2, 7, n, b"\x01\x00plain-%d" % n, None, None, None, os.urandom(48))
+    return (1, 2, None, None, b"\x01\x00plain-%d" % n, os.urandom(256), os.urandom(64), os.urandom(768), os.urandom(64))
+
+def blobs(fields):
+    return tuple(None if value is None else bytes(value) if not isinstance(value, str) else value for value in fields)
+
+FIELD_NAMES = ("rsa_key_id", "pqc_key_id", "envelope_id", "envelope_seq", "transaction_json",
+               "rsa_encrypted_key", "rsa_ciphertext", "oqs_ciphertext", "aes_ciphertext")
+
+def as_tuple(fields):
+    return blobs(fields[name] for name in FIELD_NAMES)
+
+@pytest.fixture
+def log(tmp_path):
+    log = SegmentLog(str(tmp_path / "segments"), max_bytes=64 * 1024, mmap_cache_size=4)
+    yield log
+    log.close()
+
+def append(log, records):
+    frame = encode_frame(records)
+    segment, offset = log.append(frame)
+    log.sync()
+    return segment, offset, len(frame)
+
+def test_frame_roundtrip(log):
+    records = [record(0), record(1, envelope=True), (None, None, None, None, '{"legacy": "json"}', None, None, None, b"x")]
+    segment, offset, length = append(log, records)
+
+    read = log.read_records(segment, offset, length, [2, 0, 1])
+    assert [as_tuple(read[i]) for i in range(3)] == [blobs(r) for r in records]
+    # Legacy JSON plaintext comes back as TEXT
+    assert read[2]["transaction_json"] == '{"legacy": "json"}'
+    with pytest.raises(SegmentError):
+        log.read_records(segment, offset, length, [3])
+
+def test_flipped_byte_fails_record_and_frame_checksums(log):
+    records = [record(0), record(1)]
+    segment, offset, length = append(log, records)
+    body = offset + FRAME.size
+    with open(log.path(segment), "rb") as f:
+        data = f.read()
+    second = OFFSET.unpack_from(data, body + OFFSET.size)[0]
+    position = body + second + 100
+    with open(log.path(segment), "r+b") as f:
+        f.seek(position)
+        f.write(bytes([data[position] ^ 0x01]))
+    log.forget(segment)
+
+    assert as_tuple(log.read_records(segment, offset, length, [0])[0]) == blobs(records[0])
+    with pytest.raises(SegmentError, match="checksum"):
+        log.read_records(segment, offset, length, [1])
+    with open(log.path(segment), "rb") as f:
+        assert not frame_is_valid(f.read(), offset)
+
+def test_failed_write_leaves_no_partial_frame(log, monkeypatch):
+    first = append(log, [record(0)])
+    real_write = os.write
+
+    def write_then_fail(fd, data):
+        real_write(fd, bytes(data[:100]))
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(os, "write", write_then_fail)
+    with pytest.raises(OSError):
+        log.append(encode_frame([record(1)]))
+    monkeypatch.undo()
+
+    segment, offset, length = append(log, [record(2)])
+    assert (segment, offset) == (first[0], first[1] + first[2])
+    assert os.path.getsize(log.path(segment)) == offset + length
+    assert log.read_records(segment, offset, length, [0])[0]["transaction_json"] == b"\x01\x00plain-2"
+
+def test_truncate_after_cuts_torn_tail(log):
+    first = append(log, [record(0)])
+    second = append(log, [record(1)])
+    segment = first[0]
+    live_end = second[1] + second[2]
+    # A crashed writer's half-written frame after the last indexed one
+    with open(log.path(segment), "ab") as f:
+        f.write(encode_frame([record(2)])[:100])
+    log.close()
+
+    sealed = log.sealed_segments()
+    assert list(sealed) == [segment]
+    try:
+        assert log.truncate_after(segment, sealed[segment], live_end) == 100
+        assert log.truncate_after(segment, sealed[segment], live_end) == 0
+    finally:
+        os.close(sealed[segment])
+    assert os.path.getsize(log.path(segment)) == live_end
+    assert log.read_records(segment, second[1], second[2], [0])[0]["transaction_json"] == b"\x01\x00plain-1"
+
+def test_truncate_after_empties_segment_with_no_indexed_frames(log):
+    segment, _, _ = append(log, [record(0)])
+    log.close()
+    sealed = log.sealed_segments()
+    try:
+        log.truncate_after(segment, sealed[segment], 0)
+    finally:
+        os.close(sealed[segment])
+    with open(log.path(segment), "rb") as f:
+        assert f.read() == SEGMENT_MAGIC
+
+def test_rewrite_copies_frames_into_new_segments(log):
+    log.max_bytes = 4096
+    frames = [append(log, [record(n)]) for n in range(6)]
+    log.close()
+    old_segments = {segment for segment, _, _ in frames}
+    assert len(old_segments) > 1
+
+    locations, outputs = log.rewrite(frames)
+    try:
+        assert len(outputs) == log.packed_segments([length for _, _, length in frames])
+        assert not {name for name, _ in outputs} & old_segments
+        for (segment, offset, length), (new_segment, new_offset) in zip(frames, locations):
+            assert as_tuple(log.read_records(new_segment, new_offset, length, [0])[0]) == \
+                as_tuple(log.read_records(segment, offset, length, [0])[0])
+        # The new segments stay locked until the caller has repointed the index
+        assert not set(log.sealed_segments()) & {name for name, _ in outputs}
+    finally:
+        for _, fd in outputs:
+            os.close(fd)
+
+def test_rewrite_refuses_corrupt_frame_and_leaves_nothing_behind(log):
+    frames = [append(log, [record(0)]), append(log, [record(1)])]
+    log.close()
+    segment, offset, _ = frames[1]
+    with open(log.path(segment), "r+b") as f:
+        f.seek(offset + FRAME.size + 50)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    log.forget(segment)
+    before = set(os.listdir(log.directory))
+
+    with pytest.raises(SegmentError):
+        log.rewrite(frames)
+    assert set(os.listdir(log.directory)) == before
+
+def test_segment_names_are_never_reused(log):
+    first, _, _ = append(log, [record(0)])
+    log.close()
+    log.delete(first)
+    second, _, _ = append(log, [record(1)])
+    assert second > first
+
+def hold_segment(directory, ready, release):
+    log = SegmentLog(directory, max_bytes=64 * 1024, mmap_cache_size=4)
+    log.append(encode_frame([record(0)]))
+    log.sync()
+    ready.put(log.active_segments().pop())
+    release.wait(30)
+    log.close()
+
+def test_segment_held_by_another_process_is_not_sealed(log):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    release = context.Event()
+    process = context.Process(target=hold_segment, args=(log.directory, ready, release))
+    process.start()
+    try:
+        held = ready.get(timeout=30)
+        mine, _, _ = append(log, [record(1)])
+        assert set(log.segment_files()) == {held, mine}
+        # Neither another process's active segment nor our own is compactable
+        assert log.sealed_segments() == {}
+    finally:
+        release.set()
+        process.join(30)
+    assert process.exitcode == 0
+
+    sealed = log.sealed_segments()
+    try:
+        assert list(sealed) == [held]
+    finally:
+        for fd in sealed.values():
+            os.close(fd)
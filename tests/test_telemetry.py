@@ -0,0 +1,48 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import telemetry
+from app.telemetry import RequestMetricsMiddleware
+
+def build_app(seen):
+    app = FastAPI()
+    app.add_middleware(RequestMetricsMiddleware)
+
+    @app.get("/jobs/{job_id}")
+    def get_job(job_id: str):
+        seen.append(telemetry.current_endpoint.get())
+        telemetry.observe_stage("aes_gcm", "AES", 0.001)
+        return {"job_id": job_id}
+
+    @app.post("/pushBulk")
+    def push_bulk():
+        return {}
+
+    return app
+
+def series(metric):
+    """Label tuples the metric has observed."""
+    with metric._lock:
+        return set(metric._series)
+
+def test_labels_use_route_template_not_raw_path():
+    seen = []
+    client = TestClient(build_app(seen))
+    for job_id in ("a1", "b2", "c3"):
+        assert client.get(f"/jobs/{job_id}").status_code == 200
+
+    assert seen == ["/jobs/{job_id}"] * 3
+    stage_endpoints = {labels[2] for labels in series(telemetry.crypto_stage_seconds)}
+    assert "/jobs/{job_id}" in stage_endpoints
+    assert not any(endpoint.startswith("/jobs/") and "{" not in endpoint for endpoint in stage_endpoints)
+    assert ("/jobs/{job_id}", "GET", "200") in series(telemetry.http_requests)
+
+def test_unmatched_and_wrong_method_paths():
+    client = TestClient(build_app([]))
+    assert client.get("/no/such/path/123").status_code == 404
+    assert client.get("/pushBulk").status_code == 405
+
+    requests = series(telemetry.http_requests)
+    assert ("unmatched", "GET", "404") in requests
+    assert ("/pushBulk", "GET", "405") in requests
+    assert not any("/no/such" in labels[0] for labels in requests)
@@ -0,0 +1,34 @@
+import io
+
+import pandas as pd
+
+from app.ingest import open_record_batches
+from app.validation import validate_batch
+
+SAMPLE = {
+    "trans_date_trans_time": "2019-01-01 00:00:18", "cc_num": "2703186189652095",
+    "merchant": "fraud_Rippin, Kub and Mann", "category": "misc_net", "amt": 4.97, "first": "Jennifer",
+    "last": "Banks", "gender": "F", "street": "561 Perry Cove", "city": "Moravian Falls", "state": "NC",
+    "zip": 28654, "lat": 36.0788, "long": -81.1781, "city_pop": 3495, "job": "Psychologist, counselling",
+    "dob": "1988-03-09", "trans_num": "0b242abb623afc578575680df30655b9", "unix_time": 1325376018,
+    "merch_lat": 36.011293, "merch_long": -82.048315, "is_fraud": 0
+}
+
+def test_csv_headers_with_surrounding_whitespace():
+    frame = pd.DataFrame([SAMPLE] * 3)
+    frame.columns = [f" {name}\t" for name in frame.columns]
+    stream = io.BytesIO(frame.to_csv(index=False).encode())
+
+    batch = next(open_record_batches(stream, "upload.csv", 10))
+    payloads, positions, rejected = validate_batch(batch)
+    assert rejected == []
+    assert positions == [0, 1, 2]
+    # The caller's DataFrame keeps its own column names
+    assert list(batch.columns)[0] == " trans_date_trans_time\t"
+
+def test_invalid_rows_are_rejected_by_position():
+    records = [SAMPLE, {**SAMPLE, "amt": -1}, {**SAMPLE, "dob": "09/03/1988"}, "not a record"]
+    payloads, positions, rejected = validate_batch(records)
+    assert positions == [0]
+    assert len(payloads) == 1
+    assert rejected == [(1, "amt must be >= 0"), (2, "dob must match %Y-%m-%d"), (3, "record is not a JSON object")]